@@ -5,37 +5,55 @@ Processes Zeffy payment data to generate member analytics
 
 Usage:
     python analyze_members.py
+    python analyze_members.py --as-of 2025-06-30              # The numbers as they stood at the end of a past day
+    python analyze_members.py --as-of 2025-06-30 june.json    # ...and save that dashboard data to a file
 """
 
 import pandas as pd
+import numpy as np
 import json
-from datetime import datetime, timedelta
+from datetime import datetime, time, timedelta
 from pathlib import Path
 import glob
 import os
+import re
 import sys
+import pickle
+
+from master_store import (ANALYSIS_COLUMNS, MASTER_STORE, MASTER_XLSX, content_hash, frame_hash,
+                          is_date_column, last_modified, prune_payments, read_payments, store_version)
+from dashboard_schema import write_dashboard
+from pipeline_metrics import last_run, stage
+from publish import refresh_lock
+from kpi_store import STORE_FILE, TRENDS_NAME, append_point, trends_json
+from revenue_rollups import (ROLLUP_FILE, ROLLUPS_NAME, build_rollups, revenue_series,
+                             rollups_json, update_rollups)
+from cohorts import COHORTS_NAME, build_cohorts, cohorts_json
 
 # Configuration - auto-detect environment
 if os.name == 'nt':  # Windows
     EXPORT_FOLDER = r'C:\Users\erin\Zeffy_Exports'
     OUTPUT_FILE = r'C:\Users\erin\CFL Member Dashboard\dashboard_data.json'
+    ANALYSIS_CACHE = r'C:\Users\erin\CFL Member Dashboard\analysis_cache.pkl'
 else:  # Linux/Server
     EXPORT_FOLDER = '/var/www/cfl-member-dashboard/exports'
     OUTPUT_FILE = '/var/www/cfl-member-dashboard/exports/dashboard_data.json'
+    ANALYSIS_CACHE = '/var/www/cfl-member-dashboard/exports/analysis_cache.pkl'
+
+# Bump when prepare_payments changes so old cached results are ignored
+CACHE_VERSION = 4
+
+# Membership type rules (edit the JSON to add a tier)
+MEMBERSHIP_TYPES_FILE = Path(__file__).parent / 'membership_types.json'
 
 def get_latest_export_file():
     """Find the payment data file (prefer master database if exists)"""
 
-    # Auto-detect master database path
-    if os.name == 'nt':  # Windows
-        master_db = Path(r'C:\Users\erin\CFL Member Dashboard\payment_history_master.xlsx')
-    else:  # Linux/Server
-        master_db = Path('/var/www/cfl-member-dashboard/exports/payment_history_master.xlsx')
-
-    # Use master database if it exists
-    if master_db.exists():
-        print(f"Using master database: {master_db}")
-        return master_db
+    # Use master database if it exists (columnar store, then the old xlsx master)
+    for master_db in (Path(MASTER_STORE), Path(MASTER_XLSX)):
+        if master_db.exists():
+            print(f"Using master database: {master_db}")
+            return master_db
 
     # Otherwise fall back to latest export
     export_path = Path(EXPORT_FOLDER)
@@ -48,44 +66,136 @@ def get_latest_export_file():
     latest_file = max(files, key=lambda f: f.stat().st_mtime)
     return latest_file
 
+def load_membership_rules(rules_file=MEMBERSHIP_TYPES_FILE):
+    """Load the ordered membership type rules from membership_types.json"""
+    with open(rules_file, 'r') as f:
+        return json.load(f)['membership_types']
+
+def compile_membership_pattern(rules):
+    """Compile the membership rules into one regex
+
+    Each type is a lookahead branch tried in rule order from the start of
+    the text, so the first rule with a matching keyword wins no matter
+    where in the text the keywords appear.
+    """
+    branches = [
+        '(?=.*?(%s))' % '|'.join(re.escape(keyword.lower()) for keyword in rule['keywords'])
+        for rule in rules
+    ]
+    return re.compile('^(?:%s)' % '|'.join(branches), re.DOTALL)
+
+MEMBERSHIP_RULES = load_membership_rules()
+MEMBERSHIP_TYPES = [rule['type'] for rule in MEMBERSHIP_RULES]
+MEMBERSHIP_PATTERN = compile_membership_pattern(MEMBERSHIP_RULES)
+
 def categorize_membership(details):
     """Categorize membership type from payment details"""
     if pd.isna(details):
         return None
 
-    details_lower = str(details).lower()
-
-    if 'basic' in details_lower:
-        return 'Basic'
-    elif 'pro' in details_lower or 'professional' in details_lower:
-        return 'Pro'
-    elif 'volunteer' in details_lower:
-        return 'Volunteer'
-    else:
+    match = MEMBERSHIP_PATTERN.match(str(details).lower())
+    if match is None:
         return None  # Not a membership payment
+    return MEMBERSHIP_TYPES[match.lastindex - 1]
+
+def categorize_memberships(details):
+    """Categorize a whole column of payment details at once
+
+    Vectorized version of categorize_membership: returns the membership type
+    for each row, or None for rows that aren't membership payments. Payment
+    details repeat a lot, so the pattern only runs over the distinct values.
+    """
+    codes, uniques = pd.factorize(details)
+    text = pd.Series(uniques, dtype=object).astype(str).str.lower()
+    matched = text.str.extract(MEMBERSHIP_PATTERN).notna().to_numpy()
+
+    # Exactly one group is filled for a match: the type that won
+    type_names = np.array(MEMBERSHIP_TYPES + [None], dtype=object)
+    unique_types = type_names[np.where(matched.any(axis=1), matched.argmax(axis=1), len(MEMBERSHIP_TYPES))]
+
+    # Missing details have code -1, which picks the trailing None
+    return pd.Series(np.append(unique_types, None)[codes], index=details.index)
 
 def is_membership_payment(details):
     """Check if payment is a membership payment"""
     return categorize_membership(details) is not None
 
-def analyze_payments(file_path):
-    """Analyze payment data and generate dashboard metrics"""
-
-    # Read Excel file
-    df = pd.read_excel(file_path)
-
+def summarize_members(df_memberships, contact_col, date_col, recurring_col=None,
+                      first_name_col=None, last_name_col=None):
+    """Summarize each member's payment history into one row per member
+
+    Sorts the payments once and aggregates per member, so every member list
+    can be built from this table instead of re-filtering payments per email.
+    Members keep the order they first appear in the payment data.
+    """
+    payments = df_memberships[df_memberships[contact_col].notna()]
+    member_order = payments[contact_col].unique()
+
+    # Stable sort keeps same-day payments in file order; undated rows sort last
+    ordered = payments.sort_values(date_col, kind='mergesort')
+    grouped = ordered.groupby(contact_col, sort=False)
+    latest = ordered.drop_duplicates(subset=contact_col, keep='last').set_index(contact_col)
+
+    summary = pd.DataFrame({
+        'first_payment': grouped[date_col].min(),
+        'last_payment': grouped[date_col].max(),
+        'total_payments': grouped.size(),
+        'membership_type': latest['Membership Type'],
+    }).reindex(member_order)
+    latest = latest.reindex(member_order)
+
+    # Latest recurring status ("Unknown" when blank)
+    if recurring_col:
+        status = latest[recurring_col].astype(object)
+        summary['recurring_status'] = status.where(status.notna(), 'Unknown')
+    else:
+        summary['recurring_status'] = 'Unknown'
+    summary['past_due'] = summary['recurring_status'].astype(str).str.lower().str.contains('past due', regex=False)
+
+    # Latest name, falling back to email
+    if first_name_col and last_name_col:
+        summary['name'] = [
+            _member_name(email, first, last)
+            for email, first, last in zip(summary.index, latest[first_name_col], latest[last_name_col])
+        ]
+    else:
+        summary['name'] = summary.index
+
+    return summary
+
+def _member_name(email, first, last):
+    """Format a member's display name from their latest first/last name"""
+    first = first if not pd.isna(first) else ''
+    last = last if not pd.isna(last) else ''
+    if first or last:
+        return f"{first} {last}".strip()
+    return email
+
+def end_of_day(day):
+    """The last moment of a day (the as-of time for a date)"""
+    return datetime.combine(day, time.max)
+
+def prepare_payments(df, as_of=None):
+    """Parse and aggregate payment data
+
+    Covers everything that doesn't depend on today's date: filtering to
+    successful membership payments, the per-member summary and the member
+    cohorts (see cohorts.py). The result
+    is what the analysis cache stores between runs. With `as_of` only the
+    payments made by then are used (undated ones are left out).
+    """
     print(f"Loaded {len(df)} payment records")
     print(f"Columns: {df.columns.tolist()}")
 
-    # Convert date column to datetime
+    # Convert date column to datetime (read_payments has usually done this already)
     # Adjust column name based on actual data
-    date_col = 'Payment Date' if 'Payment Date' in df.columns else df.columns[0]
-    df[date_col] = pd.to_datetime(df[date_col], errors='coerce')
+    date_col = next((col for col in df.columns if is_date_column(col)), df.columns[0])
+    if not pd.api.types.is_datetime64_any_dtype(df[date_col]):
+        df[date_col] = pd.to_datetime(df[date_col], errors='coerce')
 
-    # Get current date and 30 days ago
-    now = datetime.now()
-    thirty_days_ago = now - timedelta(days=31)  # 31 days to include members whose payment is due today
-    sixty_days_ago = now - timedelta(days=60)  # Still used for quit members
+    if as_of is not None:
+        df = df[df[date_col] <= as_of]
+        print(f"Using the {len(df)} payments made by {as_of:%Y-%m-%d %H:%M}")
 
     # Filter for successful payments only
     if 'Payment Status' in df.columns:
@@ -96,7 +206,7 @@ def analyze_payments(file_path):
     # Categorize memberships and filter only membership payments
     details_col = 'Details' if 'Details' in df.columns else 'Description'
     if details_col in df.columns:
-        df_success['Membership Type'] = df_success[details_col].apply(categorize_membership)
+        df_success['Membership Type'] = categorize_memberships(df_success[details_col])
         # Filter to only membership payments (not None)
         df_memberships = df_success[df_success['Membership Type'].notna()].copy()
     else:
@@ -104,14 +214,150 @@ def analyze_payments(file_path):
 
     print(f"Found {len(df_memberships)} membership payments out of {len(df_success)} total successful payments")
 
-    # Get amount column
+    # Get amount, contact and name columns
     amount_col = 'Total Amount' if 'Total Amount' in df.columns else 'Amount'
+    contact_col = 'Email' if 'Email' in df.columns else 'Contact'
+    first_name_col = 'First Name' if 'First Name' in df.columns else None
+    last_name_col = 'Last Name' if 'Last Name' in df.columns else None
+
+    # Find members who quit
+    # Method 1: Has "Stopped" recurring status (officially cancelled)
+    recurring_col = 'Recurring Status' if 'Recurring Status' in df_memberships.columns else None
+    stopped_members = set()
+    if recurring_col:
+        stopped_df = df_memberships[df_memberships[recurring_col].str.contains('Stopped', case=False, na=False)]
+        stopped_members = set(stopped_df[contact_col].dropna().unique())
+        print(f"Found {len(stopped_members)} members with 'Stopped' recurring status")
+
+    # One row per member with their full payment history summarized
+    members = summarize_members(df_memberships, contact_col, date_col, recurring_col,
+                                first_name_col, last_name_col)
+
+    # Retention by join month and tenure per type (only change when the payments do)
+    cohorts = build_cohorts(members, df_memberships, date_col, contact_col, amount_col)
+
+    # Only keep the payment columns the date-relative windows (and kpi_history.py) need
+    window_cols = [col for col in (date_col, contact_col, 'Membership Type', amount_col, recurring_col)
+                   if col in df_memberships.columns]
+
+    return {
+        'memberships': df_memberships[window_cols],
+        'members': members,
+        'cohorts': cohorts,
+        'stopped_members': stopped_members,
+        'total_payments': len(df_success),
+        'date_col': date_col,
+        'contact_col': contact_col,
+        'amount_col': amount_col,
+        'recurring_col': recurring_col,
+    }
+
+def load_prepared(file_path, cache_path=None, payments=None, as_of=None):
+    """Parse and aggregate a payment file, reusing the cached result if possible
+
+    The cache is keyed on the content hash of the input (and the membership
+    rules), so a refresh over a byte-identical export or master skips
+    straight to the date windows. `payments` is the file's contents already
+    in memory (e.g. the merged master from pipeline.py); it is used instead
+    of reading the file, and hashed instead of the file. As-of runs (see
+    prepare_payments) bypass the cache.
+    """
+    if payments is not None:
+        payments = prune_payments(payments, ANALYSIS_COLUMNS)
+
+    def read():
+        return payments if payments is not None else read_payments(file_path, ANALYSIS_COLUMNS)
+
+    if cache_path is None or as_of is not None:
+        return {**prepare_payments(read(), as_of), 'cache_hit': False}
+
+    cache_path = Path(cache_path)
+    input_hash = frame_hash(payments) if payments is not None else content_hash(file_path)
+    cache_key = f"{CACHE_VERSION}:{pd.__version__}:{MEMBERSHIP_PATTERN.pattern}:{input_hash}"
+
+    if cache_path.exists():
+        try:
+            with open(cache_path, 'rb') as f:
+                cached = pickle.load(f)
+            if cached['key'] == cache_key:
+                print(f"Input unchanged, using cached analysis: {cache_path}")
+                return {**cached['prepared'], 'cache_hit': True}
+        except Exception as e:
+            print(f"⚠ Ignoring unreadable analysis cache: {e}")
+
+    prepared = prepare_payments(read())
+
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = cache_path.with_suffix('.tmp')
+    with open(temp_path, 'wb') as f:
+        pickle.dump({'key': cache_key, 'prepared': prepared}, f)
+    os.replace(temp_path, cache_path)
+
+    return {**prepared, 'cache_hit': False}
+
+def rollup_basis(version):
+    """What stored revenue rollups were built from: the master's store_version
+    under the current membership rules"""
+    return f"{CACHE_VERSION}:{MEMBERSHIP_PATTERN.pattern}:{version}" if version else None
+
+def analyze_payments(file_path, cache_path=None, payments=None, as_of=None, rollup_file=None, outputs=None,
+                     changes=None):
+    """Analyze payment data and generate dashboard metrics
+
+    Measured from now, or from `as_of` (a datetime) using only the payments
+    made by then: the dashboard as it would have looked at that moment.
+    With rollup_file, the stored revenue rollups are brought up to date
+    first and the trends read from them (not for as-of runs); `changes` is
+    what the merge that produced the payments touched (see
+    merge_payments.merge_export), so only that needs checking. `outputs`
+    (a dict) receives the JSON files published next to the dashboard data.
+    """
+    with stage('analyze.prepare') as metrics:
+        prepared = load_prepared(file_path, cache_path, payments, as_of)
+        metrics.update(rows=len(prepared['memberships']), cache_hit=prepared['cache_hit'],
+                       in_memory=payments is not None)
+
+    rollups = None
+    if rollup_file and as_of is None and prepared['amount_col'] in prepared['memberships'].columns:
+        with stage('analyze.rollups') as metrics:
+            # Even on a cache hit: the stored table may be from other input (a
+            # restore, another run), and the day checksums catch that cheaply
+            since, previous = (changes['since'], rollup_basis(changes['version'])) if changes else (None, None)
+            rollups, metrics['days_recomputed'] = update_rollups(prepared, rollup_file, since,
+                                                                 rollup_basis(store_version(file_path)), previous)
+            metrics['since'] = str(since) if since is not None else None
+            metrics['rows'] = len(rollups)
+        if outputs is not None:
+            outputs[ROLLUPS_NAME] = rollups_json(rollups)
+
+    if outputs is not None:
+        outputs[COHORTS_NAME] = cohorts_json(prepared['cohorts'])
+
+    with stage('analyze.windows', rows=len(prepared['members'])):
+        return build_dashboard(prepared, as_of or datetime.now(), rollups)
+
+def build_dashboard(prepared, now, rollups=None):
+    """Apply the date windows (30/60/180 days from now) to prepared payment data
+
+    The monthly trend comes from the revenue rollups if given (see
+    revenue_rollups.py), else from the months it covers.
+    """
+    df_memberships = prepared['memberships']
+    members = prepared['members'].copy()
+    stopped_members = prepared['stopped_members']
+    date_col = prepared['date_col']
+    contact_col = prepared['contact_col']
+    amount_col = prepared['amount_col']
+    recurring_col = prepared['recurring_col']
+
+    # Get current date and 30 days ago
+    thirty_days_ago = now - timedelta(days=31)  # 31 days to include members whose payment is due today
+    sixty_days_ago = now - timedelta(days=60)  # Still used for quit members
 
     # Find active members (paid in last 30 days) - only membership payments
     recent_payments = df_memberships[df_memberships[date_col] >= thirty_days_ago]
 
     # Get unique members (by email or contact)
-    contact_col = 'Email' if 'Email' in df.columns else 'Contact'
     active_members = recent_payments[contact_col].nunique()
 
     # Count by membership type
@@ -136,33 +382,19 @@ def analyze_payments(file_path):
     # Calculate revenue by membership type
     revenue_by_type = recent_payments.groupby('Membership Type')[amount_col].sum().to_dict() if amount_col in recent_payments.columns else {}
 
-    # Find members who quit
-    # Method 1: Has "Stopped" recurring status (officially cancelled)
-    recurring_col = 'Recurring Status' if 'Recurring Status' in df_memberships.columns else None
-    stopped_members = set()
-    if recurring_col:
-        stopped_df = df_memberships[df_memberships[recurring_col].str.contains('Stopped', case=False, na=False)]
-        stopped_members = set(stopped_df[contact_col].unique())
-        print(f"Found {len(stopped_members)} members with 'Stopped' recurring status")
+    members['days_as_member'] = (now - members['first_payment']).dt.days
+    members['days_since_last'] = (now - members['last_payment']).dt.days
 
     # Method 2: Members who are "Past due" for 15+ days are considered quit
     # Check if they have "Past due" status AND haven't paid in 15+ days
     late_quit_members = set()
-    past_due_members = set()
-
     if recurring_col:
-        for email in df_memberships[contact_col].unique():
-            if email not in stopped_members:  # Don't double count stopped members
-                member_payments = df_memberships[df_memberships[contact_col] == email].sort_values(date_col)
-                recurring_status = member_payments[recurring_col].iloc[-1] if not pd.isna(member_payments[recurring_col].iloc[-1]) else ''
-                last_payment = member_payments[date_col].max()
-                days_since_last = (now - last_payment).days
-
-                # If status is "Past due" and it's been 15+ days since last payment, they quit
-                if 'past due' in str(recurring_status).lower() and days_since_last >= 15:
-                    late_quit_members.add(email)
-                elif 'past due' in str(recurring_status).lower():
-                    past_due_members.add(email)  # Track members who are past due but < 15 days
+        late_quit = (
+            members['past_due'] &
+            (members['days_since_last'] >= 15) &
+            ~members.index.isin(stopped_members)  # Don't double count stopped members
+        )
+        late_quit_members = set(members.index[late_quit])
 
     print(f"Found {len(late_quit_members)} members who are Past Due for 15+ days")
 
@@ -171,54 +403,33 @@ def analyze_payments(file_path):
     quit_count = len(quit_members)
 
     # Current active members are those who paid in last 45 days and haven't stopped
-    current_members = recent_payments[contact_col].unique()
+    current_members = recent_payments[contact_col].dropna().unique()
 
     # Calculate average payment per member type
     avg_payment_by_type = recent_payments.groupby('Membership Type')[amount_col].mean().to_dict() if amount_col in recent_payments.columns else {}
 
-    # Get payment trend (last 6 months) - only memberships
+    # Get payment trend (the months of the last 6) - only memberships
     six_months_ago = now - timedelta(days=180)
-    trend_data = df_memberships[df_memberships[date_col] >= six_months_ago]
-    trend_data['Month'] = trend_data[date_col].dt.to_period('M')
-    monthly_trend = trend_data.groupby('Month')[amount_col].sum().to_dict() if amount_col in trend_data.columns else {}
-    monthly_trend = {str(k): float(v) for k, v in monthly_trend.items()}
-
-    # Get name columns
-    first_name_col = 'First Name' if 'First Name' in df.columns else None
-    last_name_col = 'Last Name' if 'Last Name' in df.columns else None
+    trend_start = six_months_ago.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    if amount_col not in df_memberships.columns:
+        monthly_trend = {}
+    else:
+        if rollups is None:
+            rollups = build_rollups(prepared, ['month'], since=trend_start)
+        monthly_trend = revenue_series(rollups, 'month', trend_start, now)
 
     # Build detailed member lists
     active_member_list = []
-    for email in current_members:
-        # Get ALL payment history for this member (not just recent)
-        member_data = df_memberships[df_memberships[contact_col] == email].sort_values(date_col)
-        first_payment = member_data[date_col].min()
-        last_payment = member_data[date_col].max()
-        days_as_member = (now - first_payment).days
-        membership_type = member_data['Membership Type'].iloc[-1]
-
-        # Get recurring status
-        recurring_status = 'Active'
-        if recurring_col and not member_data.empty:
-            recurring_status = member_data[recurring_col].iloc[-1] if not pd.isna(member_data[recurring_col].iloc[-1]) else 'Unknown'
-
-        # Get name
-        name = email
-        if first_name_col and last_name_col:
-            first = member_data[first_name_col].iloc[-1] if not pd.isna(member_data[first_name_col].iloc[-1]) else ''
-            last = member_data[last_name_col].iloc[-1] if not pd.isna(member_data[last_name_col].iloc[-1]) else ''
-            if first or last:
-                name = f"{first} {last}".strip()
-
+    for member in members.loc[current_members].itertuples():
         active_member_list.append({
-            'name': name,
-            'email': email,
-            'membership_type': membership_type,
-            'days_as_member': int(days_as_member),
-            'first_payment': first_payment.strftime('%Y-%m-%d'),
-            'last_payment': last_payment.strftime('%Y-%m-%d'),
-            'total_payments': len(member_data),
-            'recurring_status': recurring_status
+            'name': member.name,
+            'email': member.Index,
+            'membership_type': member.membership_type,
+            'days_as_member': int(member.days_as_member),
+            'first_payment': member.first_payment.strftime('%Y-%m-%d'),
+            'last_payment': member.last_payment.strftime('%Y-%m-%d'),
+            'total_payments': int(member.total_payments),
+            'recurring_status': member.recurring_status if recurring_col else 'Active'
         })
 
     # Sort by days as member (descending)
@@ -232,45 +443,23 @@ def analyze_payments(file_path):
 
     # Build quit member list (only those who quit in last 30 days)
     quit_member_list = []
-    for email in quit_members:
-        member_data = df_memberships[df_memberships[contact_col] == email].sort_values(date_col)
-        last_payment = member_data[date_col].max()
-        days_since_last = (now - last_payment).days
-
+    for member in members[members.index.isin(quit_members)].itertuples():
         # Determine quit reason
-        is_stopped = email in stopped_members
-        is_late_quit = email in late_quit_members
-
-        membership_type = member_data['Membership Type'].iloc[-1]
-
-        if is_stopped:
+        if member.Index in stopped_members:
             quit_reason = 'Cancelled (Recurring Stopped)'
-        elif is_late_quit:
+        elif member.Index in late_quit_members:
             quit_reason = 'Past Due 15+ days'
         else:
             quit_reason = 'Inactive (No recent payment)'
 
-        # Get recurring status
-        recurring_status = 'Unknown'
-        if recurring_col and not member_data.empty:
-            recurring_status = member_data[recurring_col].iloc[-1] if not pd.isna(member_data[recurring_col].iloc[-1]) else 'Unknown'
-
-        # Get name
-        name = email
-        if first_name_col and last_name_col:
-            first = member_data[first_name_col].iloc[-1] if not pd.isna(member_data[first_name_col].iloc[-1]) else ''
-            last = member_data[last_name_col].iloc[-1] if not pd.isna(member_data[last_name_col].iloc[-1]) else ''
-            if first or last:
-                name = f"{first} {last}".strip()
-
         quit_member_list.append({
-            'name': name,
-            'email': email,
-            'membership_type': membership_type,
-            'last_payment': last_payment.strftime('%Y-%m-%d'),
-            'days_since_last': int(days_since_last),
+            'name': member.name,
+            'email': member.Index,
+            'membership_type': member.membership_type,
+            'last_payment': member.last_payment.strftime('%Y-%m-%d'),
+            'days_since_last': int(member.days_since_last),
             'quit_reason': quit_reason,
-            'recurring_status': recurring_status
+            'recurring_status': member.recurring_status
         })
 
     # Sort quit members by days since last payment
@@ -295,39 +484,18 @@ def analyze_payments(file_path):
     # Active = paid in last 30 days AND recurring not stopped
     active_paid_members = [m for m in active_member_list_unique if m.get('recurring_status') != 'Stopped']
 
-    # Late on Payment = recurring NOT stopped but no payment in last 30 days
+    # Late on Payment = status is "Past due" AND less than 15 days since last payment
+    # After 15 days past due, they're moved to "Recently Quit"
     late_member_list = []
-    for email in df_memberships[contact_col].unique():
-        member_data = df_memberships[df_memberships[contact_col] == email].sort_values(date_col)
-        last_payment = member_data[date_col].max()
-        days_since_last = (now - last_payment).days
-
-        # Check if recurring is active (not stopped)
-        recurring_status = 'Unknown'
-        if recurring_col and not member_data.empty:
-            recurring_status = member_data[recurring_col].iloc[-1] if not pd.isna(member_data[recurring_col].iloc[-1]) else 'Unknown'
-
-        # Late if: status is "Past due" AND less than 15 days since last payment
-        # After 15 days past due, they're moved to "Recently Quit"
-        if 'past due' in str(recurring_status).lower() and days_since_last < 15:
-            membership_type = member_data['Membership Type'].iloc[-1]
-
-            # Get name
-            name = email
-            if first_name_col and last_name_col:
-                first = member_data[first_name_col].iloc[-1] if not pd.isna(member_data[first_name_col].iloc[-1]) else ''
-                last = member_data[last_name_col].iloc[-1] if not pd.isna(member_data[last_name_col].iloc[-1]) else ''
-                if first or last:
-                    name = f"{first} {last}".strip()
-
-            late_member_list.append({
-                'name': name,
-                'email': email,
-                'membership_type': membership_type,
-                'last_payment': last_payment.strftime('%Y-%m-%d'),
-                'days_since_last': int(days_since_last),
-                'recurring_status': recurring_status
-            })
+    for member in members[members['past_due'] & (members['days_since_last'] < 15)].itertuples():
+        late_member_list.append({
+            'name': member.name,
+            'email': member.Index,
+            'membership_type': member.membership_type,
+            'last_payment': member.last_payment.strftime('%Y-%m-%d'),
+            'days_since_last': int(member.days_since_last),
+            'recurring_status': member.recurring_status
+        })
 
     # Sort late members by days since last payment
     late_member_list.sort(key=lambda x: x['days_since_last'])
@@ -364,6 +532,7 @@ def analyze_payments(file_path):
     # Prepare dashboard data
     dashboard_data = {
         'last_updated': now.strftime('%Y-%m-%d %H:%M:%S'),
+        'as_of': now.strftime('%Y-%m-%d %H:%M:%S'),  # When the day counts were taken (last_updated becomes the data's time)
         'ongoing_members': ongoing_count,  # Active, NOT cancelled
         'total_active_members': total_active_count,  # Total including cancelled but still active
         'membership_breakdown': {k: int(v) for k, v in membership_counts.items()},
@@ -376,7 +545,7 @@ def analyze_payments(file_path):
         'members_late_payment': late_count,  # Count of late members
         'avg_payment_by_type': {k: float(v) for k, v in avg_payment_by_type.items()},
         'monthly_trend': monthly_trend,
-        'total_payments': len(df_success),
+        'total_payments': prepared['total_payments'],
         'new_members_30_days': len(new_member_list_unique),  # Count unique names
         'active_member_list': active_member_list_unique,
         'new_member_list': new_member_list_unique,
@@ -386,31 +555,72 @@ def analyze_payments(file_path):
 
     return dashboard_data
 
+def generate_dashboard(output_file=None, payments=None, source_file=None, changes=None):
+    """Analyze the latest payment data and write dashboard_data.json
+
+    `payments` is the payment data already in memory (pipeline.py passes the
+    merged master), with source_file the file it was saved to and `changes`
+    what the merge touched. Raises on failure so callers (the refresh
+    daemon) can report it.
+    """
+    # Get latest export file
+    latest_file = Path(source_file) if source_file else get_latest_export_file()
+    print(f"Processing: {latest_file}" + (" (in memory)" if payments is not None else ''))
+
+    # Get file modification time as the "last updated" timestamp
+    file_mtime = datetime.fromtimestamp(last_modified(latest_file))
+
+    output_path = Path(output_file or OUTPUT_FILE)
+
+    # Analyze data (reusing the cached parse if the input hasn't changed),
+    # updating the revenue rollups kept next to the dashboard data
+    rollup_file = output_path.with_name(Path(ROLLUP_FILE).name)
+    outputs = {}
+    data = analyze_payments(latest_file, cache_path=ANALYSIS_CACHE, payments=payments, rollup_file=rollup_file,
+                            outputs=outputs, changes=changes)
+
+    # Override last_updated with CSV export time
+    data['last_updated'] = file_mtime.strftime('%Y-%m-%d %H:%M:%S')
+
+    # One more point for the KPI trends (the store lives next to the dashboard data)
+    store_file = output_path.with_name(Path(STORE_FILE).name)
+    with stage('analyze.kpi_store') as metrics:
+        metrics['appended'] = append_point(data, store_file) is not None
+        trends = trends_json(store_file)
+        metrics['trend_bytes'] = len(trends)
+
+    # Published together with the stage metrics of the run that produced it
+    extra_files = {TRENDS_NAME: trends, **outputs}
+    run_metrics = last_run()
+    if run_metrics:
+        extra_files['run_metrics.json'] = json.dumps(run_metrics)
+
+    # Save to JSON (compact, versioned, with a delta from the previous version)
+    with stage('analyze.write_json') as metrics:
+        doc = write_dashboard(data, output_path, extra_files)
+        metrics.update(version=doc['version'], bytes=output_path.stat().st_size)
+
+    print(f"\n✓ Dashboard data generated successfully!")
+    print(f"✓ Saved to: {output_path} (version {doc['version']})")
+    return data
+
 def main():
     try:
-        # Get latest export file
-        latest_file = get_latest_export_file()
-        print(f"Processing: {latest_file}")
-
-        # Get file modification time as the "last updated" timestamp
-        file_mtime = datetime.fromtimestamp(latest_file.stat().st_mtime)
-
-        # Analyze data
-        data = analyze_payments(latest_file)
-
-        # Override last_updated with CSV export time
-        data['last_updated'] = file_mtime.strftime('%Y-%m-%d %H:%M:%S')
-
-        # Save to JSON
-        output_path = Path(OUTPUT_FILE)
-        output_path.parent.mkdir(parents=True, exist_ok=True)
-
-        with open(output_path, 'w') as f:
-            json.dump(data, f, indent=2)
+        if '--as-of' in sys.argv:
+            # A past day's numbers: analyze only, the published dashboard is left alone
+            args = sys.argv[sys.argv.index('--as-of') + 1:]
+            as_of = end_of_day(datetime.strptime(args[0], '%Y-%m-%d'))
+            data = analyze_payments(get_latest_export_file(), as_of=as_of)
+            if len(args) > 1:
+                with open(args[1], 'w') as f:
+                    json.dump(data, f, indent=2)
+                print(f"✓ Saved to: {args[1]}")
+        else:
+            # Publishes from the master, so not while a refresh is rewriting it
+            with refresh_lock():
+                data = generate_dashboard()
 
-        print(f"\n✓ Dashboard data generated successfully!")
-        print(f"✓ Saved to: {output_path}")
-        print(f"\n📊 Summary:")
+        print(f"\n📊 Summary" + (f" (as of {data['as_of']})" if '--as-of' in sys.argv else '') + ":")
         print(f"  Active Members: {data['total_active_members']}")
         print(f"  Monthly Revenue: ${data['monthly_revenue']:.2f}")
         print(f"  Members Quit (60 days): {data['members_quit_60_days']}")
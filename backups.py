@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""
+Master Database Backups
+=======================
+Space-efficient snapshots of the payment history master database
+
+Every file that makes up the master store (the base Parquet file plus its
+delta files) is saved once, named by its SHA-256 hash. A snapshot is just a
+list of those hashes, so a run that only appended a small delta stores only
+that delta. Files whose size and modification time match the last snapshot
+aren't hashed again, so the big base file is only read when it changes. Old snapshots are thinned to one per hour/day/week and files no
+snapshot refers to are deleted.
+
+Usage:
+    python backups.py list                    # Show retained snapshots
+    python backups.py restore WHEN [path]     # Rebuild the master as of WHEN (e.g. 2025-10-01 or 2025-10-01T18:00)
+    python backups.py prune                   # Apply the retention policy now
+    python backups.py migrate                 # Move old payment_history_backup_* files into the backup store
+
+Retention (override in .env):
+    BACKUP_KEEP_LAST    always keep this many newest snapshots (default 8)
+    BACKUP_KEEP_HOURLY  newest snapshot per hour for this many hours (default 48)
+    BACKUP_KEEP_DAILY   newest snapshot per day for this many days (default 30)
+    BACKUP_KEEP_WEEKLY  newest snapshot per week for this many weeks (default 52)
+"""
+import os
+import sys
+import json
+import shutil
+import hashlib
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pandas as pd
+from dotenv import load_dotenv
+
+from master_store import MASTER_STORE, delta_folder, delta_files, load_master, normalize_types, save_master
+from publish import LOCK_FILE, atomic_path, refresh_lock
+
+load_dotenv()
+
+KEEP_LAST = int(os.getenv('BACKUP_KEEP_LAST', 8))
+
+RETENTION = {
+    'hourly': int(os.getenv('BACKUP_KEEP_HOURLY', 48)),
+    'daily': int(os.getenv('BACKUP_KEEP_DAILY', 30)),
+    'weekly': int(os.getenv('BACKUP_KEEP_WEEKLY', 52)),
+}
+
+# Bucket length and bucket label for each retention tier
+RETENTION_BUCKETS = {
+    'hourly': (timedelta(hours=1), lambda t: t.strftime('%Y-%m-%d %H')),
+    'daily': (timedelta(days=1), lambda t: t.strftime('%Y-%m-%d')),
+    'weekly': (timedelta(weeks=1), lambda t: '%d-W%02d' % t.isocalendar()[:2]),
+}
+
+def backup_folder(store_path=MASTER_STORE):
+    """Folder holding the backups of a master store"""
+    return Path(store_path).parent / 'payment_history_backups'
+
+def load_manifest(store_path=MASTER_STORE):
+    """Load the list of snapshots, oldest first"""
+    manifest_path = backup_folder(store_path) / 'manifest.json'
+    if not manifest_path.exists():
+        return []
+    with open(manifest_path, 'r') as f:
+        return json.load(f)['snapshots']
+
+def save_manifest(snapshots, store_path=MASTER_STORE):
+    """Save the list of snapshots"""
+    manifest_path = backup_folder(store_path) / 'manifest.json'
+    manifest_path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = manifest_path.with_suffix('.tmp')
+    with open(temp_path, 'w') as f:
+        json.dump({'snapshots': snapshots}, f, indent=2)
+    os.replace(temp_path, manifest_path)
+
+def file_digest(file_path, chunk_size=1 << 20):
+    """SHA-256 of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def store_object(file_path, store_path=MASTER_STORE, last=None):
+    """Save a file into the backup store under its content hash
+
+    `last` is the file's entry in the previous snapshot; if its size and
+    modification time still match, the recorded hash is reused unread.
+    """
+    stat = Path(file_path).stat()
+    objects = backup_folder(store_path) / 'objects'
+    if last and (last.get('size'), last.get('mtime_ns')) == (stat.st_size, stat.st_mtime_ns) \
+            and (objects / f"{last['sha256']}.parquet").exists():
+        return last['sha256']
+
+    digest = file_digest(file_path)
+    object_path = objects / f'{digest}.parquet'
+    if not object_path.exists():
+        object_path.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(file_path, object_path)
+    return digest
+
+def snapshot(store_path=MASTER_STORE, when=None):
+    """Record the current state of the master store
+
+    Returns the new snapshot, or None if nothing changed since the last one.
+    """
+    store_path = Path(store_path)
+    if not store_path.exists():
+        raise FileNotFoundError(f"No master store found at {store_path}")
+
+    snapshots = load_manifest(store_path)
+    last = {f['name']: f for f in snapshots[-1]['files']} if snapshots else {}
+    files = []
+    for path in [store_path] + delta_files(store_path):
+        stat = path.stat()
+        files.append({'name': path.name, 'sha256': store_object(path, store_path, last.get(path.name)),
+                      'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns})
+
+    # Same contents as last time; just note new modification times so they match next time
+    content = lambda entries: [(f['name'], f['sha256']) for f in entries]
+    if snapshots and content(snapshots[-1]['files']) == content(files):
+        if snapshots[-1]['files'] != files:
+            snapshots[-1]['files'] = files
+            save_manifest(snapshots, store_path)
+        return None
+
+    entry = {'time': (when or datetime.now()).strftime('%Y-%m-%dT%H:%M:%S'), 'files': files}
+    snapshots.append(entry)
+    snapshots.sort(key=lambda s: s['time'])
+    save_manifest(snapshots, store_path)
+    return entry
+
+def select_retained(times, now=None, retention=RETENTION, keep_last=KEEP_LAST):
+    """Pick which snapshot times to keep under the retention policy
+
+    The newest keep_last snapshots (at least one) are always kept. Each tier
+    then keeps the newest snapshot in every hour/day/week within its window.
+    """
+    now = now or datetime.now()
+    keep = set(sorted(times)[-max(keep_last, 1):])
+
+    for tier, count in retention.items():
+        length, bucket_of = RETENTION_BUCKETS[tier]
+        cutoff = now - length * count
+        seen_buckets = set()
+        for t in sorted(times, reverse=True):
+            if t < cutoff:
+                break
+            if bucket_of(t) not in seen_buckets:
+                seen_buckets.add(bucket_of(t))
+                keep.add(t)
+
+    return keep
+
+def prune(store_path=MASTER_STORE, now=None, retention=RETENTION, keep_last=KEEP_LAST):
+    """Drop snapshots outside the retention policy and delete unused files"""
+    snapshots = load_manifest(store_path)
+    times = [datetime.fromisoformat(s['time']) for s in snapshots]
+    keep = select_retained(times, now, retention, keep_last)
+
+    retained = [s for s, t in zip(snapshots, times) if t in keep]
+    save_manifest(retained, store_path)
+
+    # Delete objects no retained snapshot refers to
+    referenced = {f['sha256'] for s in retained for f in s['files']}
+    removed_bytes = 0
+    for object_path in (backup_folder(store_path) / 'objects').glob('*.parquet'):
+        if object_path.stem not in referenced:
+            removed_bytes += object_path.stat().st_size
+            object_path.unlink()
+
+    print(f"✓ Kept {len(retained)} of {len(snapshots)} snapshots ({removed_bytes:,} bytes freed)")
+    return retained
+
+def backup_master(store_path=MASTER_STORE):
+    """Snapshot the master store and apply the retention policy"""
+    entry = snapshot(store_path)
+    if entry:
+        print(f"✓ Backup snapshot saved: {entry['time']}")
+    else:
+        print("✓ Backup unchanged since last snapshot")
+    prune(store_path)
+
+def restore(when, store_path=MASTER_STORE, output_path=None):
+    """Rebuild the master as of a point in time
+
+    Uses the newest snapshot taken at or before `when`. Restores over the
+    master store unless output_path is given. The current master is
+    snapshotted first so a restore can itself be undone.
+
+    The snapshot is written as a single base file (its deltas folded in)
+    through a temp file. The current deltas are moved aside by rename just
+    before the new base replaces the old one, and only then deleted. The
+    refresh lock is held throughout, so no refresh reads or appends to the
+    store halfway.
+    """
+    if isinstance(when, str):
+        parsed = datetime.fromisoformat(when)
+        # A bare date means "as of the end of that day"
+        when = parsed + timedelta(days=1, seconds=-1) if len(when) == 10 else parsed
+    candidates = [s for s in load_manifest(store_path) if datetime.fromisoformat(s['time']) <= when]
+    if not candidates:
+        raise ValueError(f"No snapshot at or before {when}")
+    entry = candidates[-1]
+
+    target = Path(output_path or store_path)
+    with refresh_lock(Path(store_path).parent / Path(LOCK_FILE).name):
+        if target.exists() and target == Path(store_path):
+            snapshot(store_path)
+
+        # Put the snapshot's files back together as a store in a staging folder
+        objects = backup_folder(store_path) / 'objects'
+        staging = backup_folder(store_path) / f'restore-{uuid.uuid4().hex[:8]}'
+        staged_base = staging / entry['files'][0]['name']
+        try:
+            delta_folder(staged_base).mkdir(parents=True)
+            shutil.copyfile(objects / f"{entry['files'][0]['sha256']}.parquet", staged_base)
+            for delta in entry['files'][1:]:
+                shutil.copyfile(objects / f"{delta['sha256']}.parquet", delta_folder(staged_base) / delta['name'])
+            df = load_master(staged_base)
+
+            target.parent.mkdir(parents=True, exist_ok=True)
+            old_deltas = None
+            with atomic_path(target) as temp_path:
+                normalize_types(df).to_parquet(temp_path, index=False)
+                # The old deltas belong to the old base: out of the way first
+                if delta_folder(target).exists():
+                    old_deltas = delta_folder(target).with_name(f'.{delta_folder(target).name}.{staging.name}')
+                    os.replace(delta_folder(target), old_deltas)
+            if old_deltas:
+                shutil.rmtree(old_deltas, ignore_errors=True)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+    print(f"✓ Restored snapshot from {entry['time']} to {target} ({len(df)} records)")
+    return target
+
+def migrate_legacy_backups(store_path=MASTER_STORE):
+    """Move old full-copy payment_history_backup_* files into the backup store"""
+    folder = Path(store_path).parent
+    legacy = sorted(folder.glob('payment_history_backup_*.xlsx')) + sorted(folder.glob('payment_history_backup_*.parquet'))
+
+    for path in legacy:
+        when = datetime.strptime(path.stem.replace('payment_history_backup_', ''), '%Y%m%d_%H%M%S')
+        df = pd.read_excel(path) if path.suffix == '.xlsx' else pd.read_parquet(path)
+
+        # Store each old backup as a one-file snapshot
+        temp_path = backup_folder(store_path) / 'migrate.parquet'
+        temp_path.parent.mkdir(parents=True, exist_ok=True)
+        save_master(df, temp_path)
+        digest = store_object(temp_path, store_path)
+        temp_path.unlink()
+
+        snapshots = load_manifest(store_path)
+        snapshots.append({'time': when.strftime('%Y-%m-%dT%H:%M:%S'),
+                          'files': [{'name': Path(store_path).name, 'sha256': digest}]})
+        snapshots.sort(key=lambda s: s['time'])
+        save_manifest(snapshots, store_path)
+
+        path.unlink()
+        print(f"  Migrated {path.name}")
+
+    print(f"✓ Migrated {len(legacy)} old backups")
+    prune(store_path)
+
+def list_snapshots(store_path=MASTER_STORE):
+    """Print the retained snapshots"""
+    objects = backup_folder(store_path) / 'objects'
+    for entry in load_manifest(store_path):
+        size = sum((objects / f"{f['sha256']}.parquet").stat().st_size for f in entry['files'])
+        print(f"  {entry['time']}  {len(entry['files'])} files  {size:,} bytes")
+
+if __name__ == "__main__":
+    commands = {'list': list_snapshots, 'restore': restore, 'prune': prune, 'migrate': migrate_legacy_backups}
+    if len(sys.argv) < 2 or sys.argv[1] not in commands:
+        print(__doc__)
+        sys.exit(1)
+
+    try:
+        if sys.argv[1] == 'restore':
+            if len(sys.argv) < 3:
+                raise ValueError("restore needs a date, e.g. python backups.py restore 2025-10-01")
+            restore(sys.argv[2], output_path=sys.argv[3] if len(sys.argv) > 3 else None)
+        else:
+            commands[sys.argv[1]]()
+    except Exception as e:
+        print(f"✗ Error: {e}")
+        sys.exit(1)
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Refresh Pipeline Benchmark
+==========================
+Times each stage of the data refresh on synthetic Zeffy exports, fully
+offline, so we can see how the pipeline scales and catch regressions
+
+Stages timed at each size:
+    load     - read the latest export (Excel up to --xlsx-max rows, Parquet above)
+    load_pruned - the same, reading only the analysis columns with compact types
+    merge    - merge_payments() into an existing master (incremental, then --full)
+    analyze  - parse/aggregate the master, then apply the date windows
+    json     - serialize dashboard_data.json (compact form)
+
+Usage:
+    python benchmark.py                                  # 1k, 10k, 100k, 1M rows
+    python benchmark.py --sizes 1000 50000 --save bench.json
+    python benchmark.py --baseline bench.json            # Fail if any stage got 20%+ slower
+"""
+import io
+import sys
+import json
+import time
+import argparse
+import tempfile
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta
+from pathlib import Path
+from unittest.mock import patch
+
+import merge_payments
+import analyze_members
+import pipeline_metrics
+from dashboard_schema import compact_dashboard
+from master_store import ANALYSIS_COLUMNS, read_payments, save_master
+from synthetic_zeffy import generate_payments, rows_to_members, write_export
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000, 1_000_000]
+
+# Writing/reading Excel gets very slow past this size (and xlsx caps out at ~1M rows)
+XLSX_MAX_ROWS = 100_000
+
+def timed(func, *args, **kwargs):
+    """Run func quietly and return (result, seconds)"""
+    start = time.perf_counter()
+    with redirect_stdout(io.StringIO()):
+        result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+def benchmark_size(rows, work_dir, xlsx_max=XLSX_MAX_ROWS, years=3, seed=0):
+    """Time every pipeline stage for one synthetic history size"""
+    work_dir = Path(work_dir)
+    now = datetime.now().replace(microsecond=0)
+    df = generate_payments(rows_to_members(rows, years), years, seed, now)
+
+    # The master holds everything but the last week; the export is "All time"
+    master_path = work_dir / 'payment_history_master.parquet'
+    save_master(df[df['Payment Date (UTC)'] < now - timedelta(days=7)], master_path)
+    suffix = '.xlsx' if len(df) <= xlsx_max else '.parquet'
+    export_path = write_export(df, work_dir / f'zeffy-payments-benchmark{suffix}')
+
+    results = {'rows': len(df), 'export_format': suffix.lstrip('.')}
+    _, results['load'] = timed(read_payments, export_path)
+    _, results['load_pruned'] = timed(read_payments, export_path, ANALYSIS_COLUMNS)
+
+    # Point the merge and stage metrics at the benchmark folder (put back afterwards)
+    metrics_file = work_dir / 'pipeline_metrics.jsonl'
+    with patch.object(merge_payments, 'MASTER_DB', str(master_path)), \
+         patch.multiple(pipeline_metrics, METRICS_FILE=str(metrics_file),
+                        LAST_RUN_FILE=str(work_dir / 'last_run_metrics.json')):
+        _, results['merge'] = timed(merge_payments.merge_payments, export_file=export_path)
+        _, results['merge_full'] = timed(merge_payments.merge_payments, incremental=False, export_file=export_path)
+
+        prepared, results['analyze_prepare'] = timed(analyze_members.load_prepared, master_path)
+        data, results['analyze_windows'] = timed(analyze_members.build_dashboard, prepared, now)
+        _, results['json'] = timed(lambda: json.dumps(compact_dashboard(data), separators=(',', ':')))
+
+    # Peak memory of the heaviest instrumented stage
+    with open(metrics_file, 'r') as f:
+        peaks = [json.loads(line)['peak_rss_mb'] for line in f]
+    results['peak_rss_mb'] = max((peak for peak in peaks if peak is not None), default=None)
+
+    return results
+
+def print_results(all_results):
+    """Print a table of stage timings"""
+    stages = ['load', 'load_pruned', 'merge', 'merge_full', 'analyze_prepare', 'analyze_windows', 'json']
+    print(f"{'rows':>10}  {'export':>7}  " + "  ".join(f"{stage:>15}" for stage in stages) + f"  {'peak MB':>8}")
+    for results in all_results:
+        print(f"{results['rows']:>10,}  {results['export_format']:>7}  " +
+              "  ".join(f"{results[stage]:>14.3f}s" for stage in stages) +
+              f"  {results['peak_rss_mb'] or 0:>8.0f}")
+
+def compare_to_baseline(all_results, baseline_path, threshold=0.2):
+    """Report stages that got slower than the baseline; returns True if any did"""
+    with open(baseline_path, 'r') as f:
+        baseline = {b['target_rows']: b for b in json.load(f)['results']}
+
+    regressed = False
+    for results in all_results:
+        base = baseline.get(results['target_rows'])
+        if not base:
+            continue
+        for stage, seconds in results.items():
+            if not isinstance(seconds, float) or stage not in base:
+                continue
+            # Ignore tiny timings where noise dominates
+            if seconds > base[stage] * (1 + threshold) and seconds - base[stage] > 0.05:
+                print(f"✗ REGRESSION at {results['target_rows']:,} rows: {stage} "
+                      f"{base[stage]:.3f}s → {seconds:.3f}s")
+                regressed = True
+
+    if not regressed:
+        print(f"✓ No stage more than {threshold:.0%} slower than {baseline_path}")
+    return regressed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the dashboard refresh pipeline')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='Payment row counts to test')
+    parser.add_argument('--xlsx-max', type=int, default=XLSX_MAX_ROWS, help='Largest size to test with an Excel export')
+    parser.add_argument('--save', help='Save results to this JSON file')
+    parser.add_argument('--baseline', help='Compare against results saved with --save')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Slowdown that counts as a regression (default 0.2)')
+    args = parser.parse_args()
+
+    all_results = []
+    for size in args.sizes:
+        print(f"Benchmarking {size:,} rows...")
+        with tempfile.TemporaryDirectory() as work_dir:
+            results = benchmark_size(size, work_dir, args.xlsx_max)
+        results['target_rows'] = size
+        all_results.append(results)
+
+    print()
+    print_results(all_results)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'created': datetime.now().isoformat(timespec='seconds'), 'results': all_results}, f, indent=2)
+        print(f"\n✓ Results saved: {args.save}")
+
+    if args.baseline and compare_to_baseline(all_results, args.baseline, args.threshold):
+        sys.exit(1)
@@ -1,59 +1,141 @@
 #!/usr/bin/env python3
 """
 CGI endpoint to trigger dashboard data refresh
+
+Hands the refresh to the resident refresh daemon (refresh_daemon.py), so
+clicks that arrive while a refresh is running share it instead of starting
+another. Returns the job id right away; poll refresh_status.py?job=<id> for
+progress. Add ?wait=1 to block until the refresh finishes instead.
+
+If the daemon is down the refresh runs in a separate background process
+(refresh_daemon.py --job) that reports its progress in
+exports/refresh_job.json, which refresh_status.py reads instead. That
+process has no time limit, and clicks while it runs join it.
 """
 import subprocess
 import json
 import sys
 import os
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime
+from urllib.parse import parse_qs
 
 # Change to the dashboard directory
 os.chdir('/var/www/cfl-member-dashboard')
 
+DAEMON_URL = 'http://127.0.0.1:%s' % os.getenv('REFRESH_DAEMON_PORT', '8765')
+
+# Progress of a refresh started without the daemon (see refresh_daemon.py --job)
+JOB_FILE = 'exports/refresh_job.json'
+
 print("Content-Type: application/json")
 print("Access-Control-Allow-Origin: *")
 print()
 
-try:
-    # Run zeffy export with venv python
-    venv_python = '/var/www/cfl-member-dashboard/venv/bin/python3'
-    result1 = subprocess.run([venv_python, 'zeffy_export.py'],
-                            capture_output=True,
-                            text=True,
-                            timeout=120)
-
-    if result1.returncode != 0:
-        print(json.dumps({
+def refresh_with_daemon(wait=False):
+    """Ask the refresh daemon to start a refresh (and optionally wait for it)"""
+    request = urllib.request.Request(DAEMON_URL + '/refresh' + ('?wait=1' if wait else ''), data=b'', method='POST')
+    with urllib.request.urlopen(request, timeout=300 if wait else 10) as response:
+        job = json.load(response)
+
+    if job['state'] == 'running':
+        return {
+            **job,
+            'success': True,
+            'message': 'Refresh already in progress' if job['joined'] else 'Refresh started'
+        }
+    if job['state'] != 'succeeded':
+        return {
             'success': False,
-            'error': 'Zeffy export failed',
-            'details': result1.stderr
-        }))
-        sys.exit(1)
+            'error': job['error'] or 'Refresh failed',
+            'details': job['details'],
+            'job_id': job['job_id']
+        }
+    return {
+        'success': True,
+        'message': 'Dashboard data refreshed successfully',
+        'job_id': job['job_id']
+    }
 
-    # Run analysis
-    result2 = subprocess.run([venv_python, 'analyze_members.py'],
-                            capture_output=True,
-                            text=True,
-                            timeout=60)
+def read_job():
+    """The background refresh's progress, or None"""
+    try:
+        with open(JOB_FILE, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
 
-    if result2.returncode != 0:
-        print(json.dumps({
-            'success': False,
-            'error': 'Analysis failed',
-            'details': result2.stderr
-        }))
-        sys.exit(1)
+def is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
 
-    print(json.dumps({
+def refresh_with_scripts(wait=False):
+    """Start the refresh in a background process (daemon not running)
+
+    Returns the job right away, like the daemon does, or joins the
+    background refresh already running. With wait, blocks until it's done.
+    """
+    job = read_job()
+    joined = bool(job and job['state'] == 'running' and is_running(job['pid']))
+    if not joined:
+        # Export, merge and analyze in a detached venv python, so it outlives this request
+        venv_python = '/var/www/cfl-member-dashboard/venv/bin/python3'
+        job_id = datetime.now().strftime('%Y%m%d-%H%M%S')
+        with open('exports/refresh_job.log', 'w') as log:
+            process = subprocess.Popen([venv_python, 'refresh_daemon.py', '--job', job_id],
+                                       stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT,
+                                       start_new_session=True)
+        # Until the refresh writes its own progress
+        job = {'job_id': job_id, 'state': 'running', 'pid': process.pid, 'stages': {}, 'stage_seconds': {},
+               'current_stage': None, 'progress': 0, 'message': None, 'error': None, 'details': None}
+        with open(JOB_FILE + '.tmp', 'w') as f:
+            json.dump(job, f)
+        os.replace(JOB_FILE + '.tmp', JOB_FILE)
+
+    while wait and job['state'] == 'running' and is_running(job['pid']):
+        time.sleep(2)
+        job = read_job() or job
+    if job['state'] == 'running' and not is_running(job['pid']):
+        job = {**job, 'state': 'failed', 'error': 'Refresh process stopped unexpectedly'}
+
+    if job['state'] == 'running':
+        return {
+            **job,
+            'success': True,
+            'joined': joined,
+            'message': 'Refresh already in progress' if joined else 'Refresh started'
+        }
+    if job['state'] != 'succeeded':
+        return {
+            'success': False,
+            'error': job['error'] or 'Refresh failed',
+            'details': job['details'],
+            'job_id': job['job_id']
+        }
+    return {
         'success': True,
-        'message': 'Dashboard data refreshed successfully'
-    }))
+        'message': 'Dashboard data refreshed successfully',
+        'job_id': job['job_id']
+    }
+
+try:
+    wait = parse_qs(os.environ.get('QUERY_STRING', '')).get('wait', ['0'])[0] not in ('0', '')
+    try:
+        result = refresh_with_daemon(wait)
+    except urllib.error.URLError:
+        result = refresh_with_scripts(wait)
+
+    print(json.dumps(result))
+    if not result['success']:
+        sys.exit(1)
 
-except subprocess.TimeoutExpired:
-    print(json.dumps({
-        'success': False,
-        'error': 'Update timed out'
-    }))
 except Exception as e:
     print(json.dumps({
         'success': False,
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+CGI endpoint reporting the progress of a dashboard data refresh
+
+Usage: /cgi-bin/refresh_status.py?job=<job_id>   (omit job for the latest refresh)
+
+Asks the refresh daemon; if it's down, reports the background refresh
+refresh_data.py started instead (from exports/refresh_job.json).
+"""
+import json
+import os
+import urllib.error
+import urllib.request
+from urllib.parse import parse_qs, quote
+
+DAEMON_URL = 'http://127.0.0.1:%s' % os.getenv('REFRESH_DAEMON_PORT', '8765')
+
+JOB_FILE = '/var/www/cfl-member-dashboard/exports/refresh_job.json'
+
+print("Content-Type: application/json")
+print("Cache-Control: no-store")
+print("Access-Control-Allow-Origin: *")
+print()
+
+def background_job(job_id):
+    """The background refresh's progress if it's the one asked about, or None"""
+    try:
+        with open(JOB_FILE, 'r') as f:
+            job = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if job_id and job['job_id'] != job_id:
+        return None
+
+    if job['state'] == 'running':
+        try:
+            os.kill(job['pid'], 0)
+        except ProcessLookupError:
+            job.update(state='failed', error='Refresh process stopped unexpectedly')
+        except PermissionError:
+            pass
+    return job
+
+try:
+    job_id = parse_qs(os.environ.get('QUERY_STRING', '')).get('job', [''])[0]
+    url = DAEMON_URL + '/status' + (f'/{quote(job_id)}' if job_id else '')
+    with urllib.request.urlopen(url, timeout=10) as response:
+        print(json.dumps({'success': True, **json.load(response)}))
+
+except urllib.error.HTTPError as e:
+    print(json.dumps({
+        'success': False,
+        'error': 'Unknown refresh job' if e.code == 404 else f'Refresh daemon error ({e.code})'
+    }))
+except urllib.error.URLError:
+    job = background_job(job_id)
+    if job:
+        print(json.dumps({'success': True, **job}))
+    else:
+        print(json.dumps({
+            'success': False,
+            'error': 'Refresh daemon is not running' if not job_id else 'Unknown refresh job'
+        }))
+except Exception as e:
+    print(json.dumps({
+        'success': False,
+        'error': str(e)
+    }))
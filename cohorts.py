@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Member Cohorts
+==============
+Retention by the month members joined, and how long members of each type
+stay
+
+Members are grouped into cohorts by the month of their first membership
+payment. For each cohort and each month since joining:
+    retention          share of the cohort still paying: their last
+                       payment is in that month or later
+    revenue_retention  the cohort's membership revenue that month, as a
+                       share of its revenue in the month it joined
+Months that haven't happened yet are null. The latest month is usually
+still running, so its numbers are partial.
+
+Tenure is the time from a member's first payment to their last, so for
+members who are still paying it is their tenure so far. The median is
+given per (current) membership type.
+
+Everything is computed with array operations over the per-member summary
+(first/last payment) and the payments, so it costs about the same as one
+groupby however long the history gets. prepare_payments() builds the
+tables, so they are stored in the analysis cache with the rest of the
+prepared data and only recomputed when the payments change. The analysis
+publishes them as cohorts.json for trends.html.
+
+Usage:
+    python cohorts.py                   # Retention of the last 12 cohorts, and median tenure per type
+    python cohorts.py --revenue         # Revenue retention instead
+    python cohorts.py --all             # Every cohort
+"""
+import sys
+import json
+
+import numpy as np
+import pandas as pd
+
+COHORTS_NAME = 'cohorts.json'
+
+DAYS_PER_MONTH = 365.25 / 12
+
+def month_numbers(dates):
+    """Months since year 0 (so consecutive months differ by one)"""
+    return (dates.dt.year * 12 + dates.dt.month - 1).to_numpy('int64')
+
+def month_label(number):
+    return f'{number // 12:04d}-{number % 12 + 1:02d}'
+
+def rounded_rows(matrix, digits=4):
+    """Matrix rows as lists, with null for NaN"""
+    return [[None if np.isnan(value) else round(float(value), digits) for value in row] for row in matrix]
+
+def build_cohorts(members, memberships, date_col, contact_col, amount_col):
+    """Cohort tables from the per-member summary and the membership payments (see prepare_payments)"""
+    dated = members[members['first_payment'].notna()]
+    if dated.empty:
+        return {'cohorts': [], 'sizes': [], 'through': None, 'retention': [], 'revenue': [],
+                'revenue_retention': [], 'median_tenure_months': {}, 'members_by_type': {}}
+
+    first = month_numbers(dated['first_payment'])
+    last = month_numbers(dated['last_payment'])
+    cohort_months, cohort = np.unique(first, return_inverse=True)
+    latest = int(last.max())
+    width = latest - int(cohort_months[0]) + 1  # Months since joining, for the oldest cohort
+
+    # Members whose last payment is k months after their first, per cohort;
+    # summed from the right, those still paying k months in
+    tenure_months = last - first
+    last_counts = np.bincount(cohort * width + tenure_months, minlength=len(cohort_months) * width)
+    retained = last_counts.reshape(-1, width)[:, ::-1].cumsum(axis=1)[:, ::-1]
+    sizes = retained[:, 0]
+
+    # Revenue by cohort and month since joining
+    payments = memberships[memberships[date_col].notna()]
+    member = dated.index.get_indexer(payments[contact_col])
+    payments, member = payments[member >= 0], member[member >= 0]
+    offset = month_numbers(payments[date_col]) - first[member]
+    amounts = payments[amount_col].fillna(0).to_numpy('float64') if amount_col in payments.columns else None
+    revenue = np.bincount(cohort[member] * width + offset, amounts,
+                          minlength=len(cohort_months) * width).reshape(-1, width)
+
+    # Months after the latest payment haven't happened yet
+    future = cohort_months[:, None] + np.arange(width)[None, :] > latest
+    retention = np.where(future, np.nan, retained / sizes[:, None])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        revenue_retention = np.where(future | (revenue[:, :1] <= 0), np.nan, revenue / revenue[:, :1])
+    revenue = np.where(future, np.nan, revenue)
+
+    tenure = (dated['last_payment'] - dated['first_payment']).dt.days / DAYS_PER_MONTH
+    by_type = tenure.groupby(dated['membership_type'].astype(object))
+
+    return {
+        'cohorts': [month_label(month) for month in cohort_months],
+        'sizes': sizes.tolist(),
+        'through': month_label(latest),
+        'retention': rounded_rows(retention),
+        'revenue': rounded_rows(revenue, 2),
+        'revenue_retention': rounded_rows(revenue_retention),
+        'median_tenure_months': {str(type_name): round(float(value), 1) for type_name, value in by_type.median().items()},
+        'members_by_type': {str(type_name): int(count) for type_name, count in by_type.size().items()},
+    }
+
+def cohorts_json(cohorts):
+    return json.dumps(cohorts, separators=(',', ':'))
+
+def cohort_table(cohorts, key='retention', last=12):
+    """A cohort matrix as a DataFrame (cohorts by months since joining), for printing"""
+    table = pd.DataFrame(cohorts[key], index=pd.Index(cohorts['cohorts'], name='cohort'), dtype='float64')
+    table.insert(0, 'members', cohorts['sizes'])
+    table = table.tail(last) if last else table
+    return table.dropna(axis=1, how='all')
+
+def main():
+    from analyze_members import ANALYSIS_CACHE, get_latest_export_file, load_prepared
+
+    prepared = load_prepared(get_latest_export_file(), ANALYSIS_CACHE)
+    cohorts = prepared['cohorts']
+    key = 'revenue_retention' if '--revenue' in sys.argv else 'retention'
+    table = cohort_table(cohorts, key, last=None if '--all' in sys.argv else 12)
+
+    print(f"\n📊 {key.replace('_', ' ').capitalize()} by month since joining (through {cohorts['through']}):")
+    print(table.to_string(float_format=lambda value: f'{value:.0%}', na_rep=''))
+    print("\n⏱ Median tenure (first to last payment):")
+    for type_name, months in cohorts['median_tenure_months'].items():
+        print(f"  {type_name}: {months} months ({cohorts['members_by_type'][type_name]} members)")
+
+if __name__ == "__main__":
+    try:
+        main()
+    except Exception as e:
+        print(f"✗ Error: {e}")
+        sys.exit(1)
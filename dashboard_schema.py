@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+Compact Dashboard Data
+======================
+Writes dashboard_data.json in a compact, versioned form, plus a small delta
+file the dashboard can poll instead of downloading everything again
+
+The analysis builds four member lists (active, new, late, quit) that repeat
+the same members' names, types and dates. In the compact form each member is
+stored once in a `members` table, keyed by email, as a row of values in
+`member_fields` order. The lists only hold emails, plus the fields their
+entries had, so expand_dashboard() gives back exactly what the analysis built
+(dashboard.html does the same expansion in the browser).
+
+Day counts (days_as_member, days_since_last) grow every day for everyone, so
+storing them as-is would change every member on every run. They are stored
+as `day_base` minus the count instead. day_base is the analysis date as a day
+number, so a member's stored values only change when their payments do.
+
+Every document carries a `version` that goes up by one whenever the content
+changes, and an `etag` (a hash of the content, not counting `as_of`, the
+moment the analysis ran). A run that changes nothing leaves the published
+document and delta untouched. Next to it,
+dashboard_delta.json holds the changes from the previous version: changed
+stats, changed or removed members and changed lists. A client that has
+version N polls the delta. If the delta's base_version is N, the client
+applies it. If the delta's version is N, nothing changed. Otherwise the
+client downloads the full file again.
+
+Both files are also written gzipped (dashboard_data.json.gz, ...), so
+run_dashboard.py and nginx (gzip_static) can send them compressed without
+compressing on every request. All of them are published together as one
+generation (see publish.py), so a reader never gets a delta that doesn't
+match the document next to it.
+
+Usage:
+    python dashboard_schema.py [dashboard_data.json]    # Show version, size and list lengths
+"""
+import sys
+import json
+import gzip
+import hashlib
+from datetime import datetime
+from pathlib import Path
+
+from publish import Generation
+
+SCHEMA_VERSION = 2
+
+MEMBER_LISTS = ['active_member_list', 'new_member_list', 'quit_member_list', 'late_member_list']
+
+# Member record columns, in the order rows are stored
+MEMBER_FIELDS = ['name', 'membership_type', 'recurring_status', 'first_payment', 'last_payment',
+                 'days_as_member', 'days_since_last', 'total_payments', 'quit_reason']
+
+# Member fields stored as day_base minus the value
+DAY_FIELDS = {'days_as_member', 'days_since_last'}
+
+# Fields describing the document rather than the dashboard
+META_KEYS = {'schema', 'version', 'etag'}
+
+# The moment the analysis ran changes every run; the day it fell on (day_base)
+# is all the content depends on, so it is left out of the etag
+VOLATILE_KEYS = {'as_of'}
+
+def content_etag(doc):
+    """Hash of a compact document's content (ignoring its version fields and the run time)"""
+    content = {key: value for key, value in doc.items() if key not in META_KEYS | VOLATILE_KEYS}
+    encoded = json.dumps(content, sort_keys=True, separators=(',', ':')).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()[:16]
+
+def day_number(timestamp):
+    """Day number of a 'YYYY-MM-DD HH:MM:SS' timestamp (days since 0001-01-01)"""
+    return datetime.strptime(timestamp[:10], '%Y-%m-%d').toordinal()
+
+def compact_dashboard(data, version=1):
+    """Convert the analysis output to the compact form (members stored once)"""
+    day_base = day_number(data.get('as_of') or data['last_updated'])
+    records = {}
+    lists = {}
+    for list_name in MEMBER_LISTS:
+        entries = data.get(list_name, [])
+        fields = []
+        for entry in entries:
+            record = records.setdefault(entry['email'], {})
+            for field, value in entry.items():
+                if field == 'email':
+                    continue
+                if field not in fields:
+                    fields.append(field)
+                record.setdefault(field, day_base - value if field in DAY_FIELDS else value)
+        lists[list_name] = {'fields': fields, 'ids': [entry['email'] for entry in entries]}
+
+    # Fields outside MEMBER_FIELDS (if the analysis grows one) go on the end
+    member_fields = MEMBER_FIELDS + sorted({field for record in records.values() for field in record} - set(MEMBER_FIELDS))
+
+    doc = {'schema': SCHEMA_VERSION, 'version': version, 'day_base': day_base}
+    doc.update({key: value for key, value in data.items() if key not in MEMBER_LISTS})
+    doc['member_fields'] = member_fields
+    doc['members'] = {email: [record.get(field) for field in member_fields] for email, record in records.items()}
+    doc['lists'] = lists
+    doc['etag'] = content_etag(doc)
+    return doc
+
+def expand_dashboard(doc):
+    """Convert a compact document back to the analysis output"""
+    if doc.get('schema') != SCHEMA_VERSION:
+        return doc  # Written before the compact schema
+
+    data = {key: value for key, value in doc.items()
+            if key not in META_KEYS | {'day_base', 'member_fields', 'members', 'lists'}}
+    positions = {field: i for i, field in enumerate(doc['member_fields'])}
+
+    def member_value(email, field):
+        value = doc['members'][email][positions[field]]
+        return doc['day_base'] - value if field in DAY_FIELDS else value
+
+    for list_name, member_list in doc['lists'].items():
+        data[list_name] = [
+            {'email': email, **{field: member_value(email, field) for field in member_list['fields']}}
+            for email in member_list['ids']
+        ]
+    return data
+
+def dashboard_delta(old, new):
+    """Changes that turn compact document `old` into `new`"""
+    skip = META_KEYS | {'members', 'lists'}
+    changed = {key: value for key, value in new.items() if key not in skip and old.get(key) != value}
+    removed = [key for key in old if key not in skip and key not in new]
+
+    return {
+        'schema': SCHEMA_VERSION,
+        'base_version': old['version'],
+        'base_etag': old['etag'],
+        'version': new['version'],
+        'etag': new['etag'],
+        'set': changed,
+        'unset': removed,
+        'members': {email: row for email, row in new['members'].items() if old['members'].get(email) != row},
+        'removed_members': [email for email in old['members'] if email not in new['members']],
+        'lists': {name: member_list for name, member_list in new['lists'].items() if old['lists'].get(name) != member_list},
+    }
+
+def apply_delta(doc, delta):
+    """Apply a delta to the compact document it was made from"""
+    if delta['base_version'] != doc['version'] or delta['base_etag'] != doc['etag']:
+        raise ValueError(f"Delta is from version {delta['base_version']}, document is version {doc['version']}")
+
+    doc = {**doc, **delta['set'], 'version': delta['version'], 'etag': delta['etag']}
+    for key in delta['unset']:
+        doc.pop(key, None)
+    members = {email: row for email, row in doc['members'].items() if email not in delta['removed_members']}
+    members.update(delta['members'])
+    doc['members'] = members
+    doc['lists'] = {**doc['lists'], **delta['lists']}
+    return doc
+
+def delta_path(output_path):
+    """The delta file that goes with a dashboard data file"""
+    output_path = Path(output_path)
+    return output_path.with_name(output_path.stem.replace('_data', '') + '_delta.json')
+
+def load_document(output_path):
+    """Load the compact document currently published, or None"""
+    output_path = Path(output_path)
+    if not output_path.exists():
+        return None
+    try:
+        with open(output_path, 'r') as f:
+            doc = json.load(f)
+    except ValueError:
+        return None
+    return doc if doc.get('schema') == SCHEMA_VERSION else None
+
+def add_json(generation, name, data):
+    """Add compact JSON and a gzipped copy of it to a generation"""
+    encoded = json.dumps(data, separators=(',', ':')).encode('utf-8')
+    generation.write(name, encoded)
+    generation.write(f'{name}.gz', gzip.compress(encoded, mtime=0))
+
+def published_bytes(path):
+    """The bytes of a published file, or None"""
+    path = Path(path)
+    return path.read_bytes() if path.exists() else None
+
+def write_dashboard(data, output_path, extra_files=None):
+    """Publish the analysis output as a compact document, plus the delta from the last one
+
+    extra_files ({name: bytes or text}) are published in the same
+    generation. The version only goes up when the content changed; an
+    unchanged document and its delta are carried over as they are (same
+    mtime, so same ETag), and a new generation is only made if an extra
+    file changed. Returns the document.
+    """
+    output_path = Path(output_path)
+    extra_files = {name: body.encode('utf-8') if isinstance(body, str) else body
+                   for name, body in (extra_files or {}).items()}
+
+    previous = load_document(output_path)
+    doc = compact_dashboard(data, version=previous['version'] if previous else 1)
+    unchanged = previous is not None and previous['etag'] == doc['etag']
+    if unchanged:
+        if all(published_bytes(output_path.parent / name) == body for name, body in extra_files.items()):
+            return previous
+        doc = previous
+    elif previous:
+        doc['version'] = previous['version'] + 1
+        delta = dashboard_delta(previous, doc)
+    else:
+        # Nothing to diff against: clients on any other version re-download
+        delta = {'schema': SCHEMA_VERSION, 'base_version': None, 'base_etag': None,
+                 'version': doc['version'], 'etag': doc['etag']}
+
+    with Generation(output_path.parent) as generation:
+        if unchanged:
+            for name in (output_path.name, delta_path(output_path).name):
+                for file_name in (name, f'{name}.gz'):
+                    if (output_path.parent / file_name).exists():
+                        generation.carry(file_name, output_path.parent / file_name)
+        else:
+            add_json(generation, output_path.name, doc)
+            add_json(generation, delta_path(output_path).name, delta)
+        for name, body in extra_files.items():
+            generation.write(name, body)
+    return doc
+
+if __name__ == "__main__":
+    from analyze_members import OUTPUT_FILE
+
+    output_path = Path(sys.argv[1] if len(sys.argv) > 1 else OUTPUT_FILE)
+    doc = load_document(output_path)
+    if doc is None:
+        print(f"✗ No compact dashboard data at {output_path}")
+        sys.exit(1)
+
+    print(f"✓ {output_path}: version {doc['version']}, etag {doc['etag']}, {output_path.stat().st_size:,} bytes")
+    print(f"  {len(doc['members'])} members; " +
+          ", ".join(f"{name} {len(member_list['ids'])}" for name, member_list in doc['lists'].items()))
+    delta_file = delta_path(output_path)
+    if delta_file.exists():
+        print(f"  Delta: {delta_file.stat().st_size:,} bytes")
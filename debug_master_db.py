@@ -4,6 +4,7 @@ Debug script to check master database usage
 """
 import sys
 import os
+import time
 from pathlib import Path
 
 os.chdir('/var/www/cfl-member-dashboard')
@@ -11,12 +12,13 @@ sys.path.insert(0, '/var/www/cfl-member-dashboard')
 
 # Import the function
 from analyze_members import get_latest_export_file
+from master_store import MASTER_STORE, load_master
 
 print("=" * 60)
 print("MASTER DATABASE DEBUG")
 print("=" * 60)
 
-master_path = Path('/var/www/cfl-member-dashboard/exports/payment_history_master.xlsx')
+master_path = Path(MASTER_STORE)
 print(f"\nMaster database path: {master_path}")
 print(f"Master exists: {master_path.exists()}")
 
@@ -24,6 +26,10 @@ if master_path.exists():
     print(f"Master size: {master_path.stat().st_size} bytes")
     print(f"Master modified: {master_path.stat().st_mtime}")
 
+    start = time.perf_counter()
+    load_master(master_path)
+    print(f"Master load time: {time.perf_counter() - start:.3f}s")
+
 print("\nCalling get_latest_export_file()...")
 latest = get_latest_export_file()
 print(f"Result: {latest}")
@@ -35,9 +41,8 @@ else:
     print("\nChecking why...")
 
     # Check if master actually has data
-    import pandas as pd
     try:
-        df = pd.read_excel(master_path)
+        df = load_master(master_path)
         print(f"Master has {len(df)} rows")
         print(f"Columns: {df.columns.tolist()[:5]}")
 
@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+"""
+KPI History
+===========
+The dashboard's headline numbers for every day of the payment history,
+worked out in one pass
+
+`analyze_members.py --as-of DATE` shows the dashboard as it stood at the end
+of a past day. Doing that for every day would mean running the analysis once
+per day, so backfill() computes the daily series directly from each member's
+payment timeline instead.
+
+Between two of a member's payments their state is fixed: it comes from the
+latest payment row (type, recurring status), and "stopped" once any row so
+far said Stopped. Each payment therefore gives a stretch of days, and every
+KPI condition ("paid in the last 31 days", "past due under 15 days", ...)
+cuts that stretch down to a range of days. The daily counts are then sums
+over those ranges, with no per-day loop.
+
+The numbers match the dashboard's rules exactly, including the
+de-duplication of members by name. (A member's name is their current name;
+the history doesn't replay name changes.)
+
+KPIs, per day (the dashboard's keys):
+    ongoing_members, total_active_members, new_members_30_days,
+    members_late_payment, members_quit_60_days, projected_revenue
+
+Usage:
+    python kpi_history.py                                           # Whole history, last 14 days shown
+    python kpi_history.py --start 2025-01-01 --end 2025-06-30 --output kpis.csv
+"""
+import sys
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from analyze_members import ANALYSIS_CACHE, get_latest_export_file, load_prepared
+from pipeline_metrics import stage
+
+KPI_COLUMNS = ['ongoing_members', 'total_active_members', 'new_members_30_days',
+               'members_late_payment', 'members_quit_60_days', 'projected_revenue']
+
+DAY = 86_400 * 10**9  # One day in nanoseconds
+NEVER = np.iinfo(np.int64).max
+
+def day_ends(start, end):
+    """The as-of moments (the end of each day, see analyze_members.end_of_day) as int64 nanoseconds"""
+    days = pd.date_range(pd.Timestamp(start).normalize(), pd.Timestamp(end).normalize(), freq='D')
+    return (days + pd.Timedelta(days=1) - pd.Timedelta(microseconds=1)).to_numpy('datetime64[ns]').view('i8')
+
+# Day ranges are kept as "global" positions, key * stride + day, so ranges
+# belonging to different members (or names) never touch and one sorted array
+# holds them all.
+
+def daily_totals(lo, hi, stride, weights=None):
+    """Per-day sum of weights (default 1) over half-open global day ranges"""
+    keep = lo < hi
+    weights = weights[keep] if weights is not None else None
+    added = np.bincount(lo[keep] % stride, weights, minlength=stride)
+    removed = np.bincount(hi[keep] % stride, weights, minlength=stride)
+    return np.cumsum(added - removed)[:stride - 1]
+
+def union_ranges(lo, hi):
+    """Merge overlapping or touching ranges; returns sorted, disjoint (lo, hi)"""
+    keep = lo < hi
+    lo, hi = lo[keep], hi[keep]
+    if not len(lo):
+        return lo, hi
+    order = np.argsort(lo, kind='stable')
+    lo, hi = lo[order], hi[order]
+    reach = np.maximum.accumulate(hi)
+    starts = np.ones(len(lo), dtype=bool)
+    starts[1:] = lo[1:] > reach[:-1]
+    ends = np.append(np.flatnonzero(starts)[1:] - 1, len(lo) - 1)
+    return lo[starts], reach[ends]
+
+def subtract_ranges(lo, hi, cut_lo, cut_hi):
+    """Parts of ranges not covered by the sorted, disjoint cut ranges
+
+    Returns (source, lo, hi): each piece with the index of the range it came from.
+    """
+    if not len(cut_lo):
+        return np.arange(len(lo)), lo, hi
+
+    # Cut ranges overlapping each range: first..first+overlaps-1
+    first = np.searchsorted(cut_hi, lo, side='right')
+    overlaps = np.maximum(np.searchsorted(cut_lo, hi, side='left') - first, 0)
+
+    # A range with k overlapping cuts leaves up to k+1 pieces (the gaps around them)
+    pieces = overlaps + 1
+    source = np.repeat(np.arange(len(lo)), pieces)
+    k = np.arange(len(source)) - np.repeat(np.cumsum(pieces) - pieces, pieces)
+    cut = first[source] + k
+    last = len(cut_lo) - 1
+    piece_lo = np.where(k == 0, lo[source], cut_hi[np.clip(cut - 1, 0, last)])
+    piece_hi = np.where(k == overlaps[source], hi[source], cut_lo[np.clip(cut, 0, last)])
+    piece_lo = np.maximum(piece_lo, lo[source])
+    piece_hi = np.minimum(piece_hi, hi[source])
+
+    keep = piece_lo < piece_hi
+    return source[keep], piece_lo[keep], piece_hi[keep]
+
+def overlap_totals(lo, hi, query_lo, query_hi, weights, stride):
+    """Per-day sum of each query's weight over the days it shares with the sorted, disjoint ranges"""
+    source, shared_lo, shared_hi = subtract_ranges(query_lo, query_hi, *complement(lo, hi))
+    return daily_totals(shared_lo, shared_hi, stride, weights[source])
+
+def complement(lo, hi):
+    """The gaps around sorted, disjoint ranges (everything they don't cover)"""
+    return np.append(np.iinfo(np.int64).min, hi), np.append(lo, np.iinfo(np.int64).max)
+
+def member_timelines(prepared, ends):
+    """One row per dated membership payment, sorted by member and date, with the day ranges it governs
+
+    Each row's state lasts from its payment until the member's next payment
+    (`segment_lo`..`segment_hi`, as indexes into `ends`).
+    """
+    payments = prepared['memberships']
+    date_col, contact_col = prepared['date_col'], prepared['contact_col']
+    amount_col, recurring_col = prepared['amount_col'], prepared['recurring_col']
+    payments = payments[payments[contact_col].notna() & payments[date_col].notna()]
+
+    member, emails = pd.factorize(payments[contact_col])
+    dates = payments[date_col].to_numpy('datetime64[ns]').view('i8')
+    position = np.arange(len(payments))  # File order breaks same-time ties, as in the analysis
+    if amount_col in payments.columns:
+        amounts = pd.to_numeric(payments[amount_col], errors='coerce').fillna(0).to_numpy('float64')
+    else:
+        amounts = np.zeros(len(payments))
+    if recurring_col:
+        status = payments[recurring_col].astype(object).where(payments[recurring_col].notna(), 'Unknown')
+        status = status.astype(str)
+        lower = status.str.lower()
+        not_stopped = (status != 'Stopped').to_numpy()
+        past_due = lower.str.contains('past due', regex=False).to_numpy()
+        says_stopped = lower.str.contains('stopped', regex=False).to_numpy()
+    else:
+        not_stopped = np.ones(len(payments), dtype=bool)
+        past_due = says_stopped = np.zeros(len(payments), dtype=bool)
+
+    order = np.lexsort((position, dates, member))
+    rows = pd.DataFrame({
+        'member': member[order], 'date': dates[order], 'position': position[order], 'amount': amounts[order],
+        'not_stopped': not_stopped[order], 'past_due': past_due[order], 'says_stopped': says_stopped[order],
+    })
+
+    member_start = np.ones(len(rows), dtype=bool)
+    member_start[1:] = rows['member'].to_numpy()[1:] != rows['member'].to_numpy()[:-1]
+    next_date = np.append(rows['date'].to_numpy()[1:], NEVER)
+    next_date[np.append(member_start[1:], True)] = NEVER
+
+    rows['first_date'] = rows.groupby('member')['date'].transform('min')
+    rows['stopped'] = rows.groupby('member')['says_stopped'].cummax().astype(bool)
+    rows['segment_lo'] = np.searchsorted(ends, rows['date'].to_numpy(), side='left')
+    rows['segment_hi'] = np.searchsorted(ends, next_date, side='left')
+    return rows, emails
+
+def ongoing_ranges(rows, active_lo, active_hi, names, stride, ends):
+    """Day ranges (by member) in which a member is counted as ongoing
+
+    The dashboard lists active members longest-standing first and keeps the
+    first one of each name, so a member only counts on days when no
+    longer-standing member of the same name is active. "Longest standing"
+    is the first payment's day; same-name members who joined the same day
+    are ordered by whose payment comes first in the file within the 31-day
+    window, which can change day to day, so those are settled day by day.
+    """
+    member = rows['member'].to_numpy()
+    n_members = member.max() + 1
+    first_day = np.zeros(n_members, dtype=np.int64)
+    first_day[member] = rows['first_date'].to_numpy() // DAY
+
+    # Members who joined on the same day under the same name form a unit
+    units = pd.DataFrame({'name': names, 'first_day': first_day}).groupby(['name', 'first_day'], sort=False)
+    unit = units.ngroup().to_numpy()
+    unit_keys = units.size().rename('size').reset_index()
+    unit_size = unit_keys['size'].to_numpy()
+    tied = unit_size[unit] > 1
+
+    # Ongoing candidate days: active with a latest status other than Stopped
+    candidate = rows['not_stopped'].to_numpy()
+    cand_member = member[candidate]
+    cand_lo = cand_member * stride + active_lo[candidate]
+    cand_hi = cand_member * stride + active_hi[candidate]
+    untied = ~tied[cand_member]
+    pieces = [(cand_member[untied], cand_lo[untied], cand_hi[untied])]
+
+    if tied.any():
+        # Each tied member's active days, with their first file position in the window that day
+        tied_rows = rows[tied[member]]
+        window_lo = np.searchsorted(ends, tied_rows['date'].to_numpy(), side='left')
+        window_hi = np.searchsorted(ends, tied_rows['date'].to_numpy() + 31 * DAY, side='right')
+        days = np.maximum(window_hi - window_lo, 0)
+        pair_row = np.repeat(np.arange(len(tied_rows)), days)
+        pair_day = window_lo[pair_row] + np.arange(len(pair_row)) - np.repeat(np.cumsum(days) - days, days)
+        pair_member = tied_rows['member'].to_numpy()[pair_row]
+        pair_position = tied_rows['position'].to_numpy()[pair_row]
+
+        # The member listed first in their unit each day
+        pair_unit = unit[pair_member]
+        order = np.lexsort((pair_position, pair_day, pair_unit))
+        pair_unit, pair_day, pair_member = pair_unit[order], pair_day[order], pair_member[order]
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = (pair_unit[1:] != pair_unit[:-1]) | (pair_day[1:] != pair_day[:-1])
+        pair_day, pair_member = pair_day[first], pair_member[first]
+
+        # ...counts if their status that day isn't Stopped
+        segment_keys = member * stride + rows['segment_lo'].to_numpy()
+        segment = np.searchsorted(segment_keys, pair_member * stride + pair_day, side='right') - 1
+        counted = rows['not_stopped'].to_numpy()[segment]
+        kept_lo, kept_hi = union_ranges(pair_member[counted] * stride + pair_day[counted],
+                                        pair_member[counted] * stride + pair_day[counted] + 1)
+        pieces.append((kept_lo // stride, kept_lo, kept_hi))
+
+    cand_member, cand_lo, cand_hi = (np.concatenate(part) for part in zip(*pieces))
+
+    # Peel off the days a longer-standing unit of the same name is active,
+    # one seniority level at a time (level 0 is each name's longest standing)
+    level = unit_keys.sort_values('first_day').groupby('name').cumcount().sort_index().to_numpy()
+    member_level = level[unit]
+    row_level = member_level[member]
+    active_name_lo = names[member] * stride + active_lo
+    active_name_hi = names[member] * stride + active_hi
+
+    cand_level = member_level[cand_member]
+    cand_day_lo, cand_day_hi = cand_lo % stride, cand_hi % stride
+    senior_lo = senior_hi = np.array([], dtype=np.int64)
+    kept = []
+    for depth in range(level.max() + 1):
+        at_level = cand_level == depth
+        name_lo = names[cand_member[at_level]] * stride + cand_day_lo[at_level]
+        name_hi = names[cand_member[at_level]] * stride + cand_day_hi[at_level]
+        source, lo, hi = subtract_ranges(name_lo, name_hi, senior_lo, senior_hi)
+        owner = cand_member[at_level][source]
+        kept.append((owner * stride + lo % stride, owner * stride + hi % stride))
+
+        # Everyone at this level is senior to the next
+        joined = row_level == depth
+        senior_lo, senior_hi = union_ranges(np.concatenate([senior_lo, active_name_lo[joined]]),
+                                            np.concatenate([senior_hi, active_name_hi[joined]]))
+
+    lo, hi = (np.concatenate(part) for part in zip(*kept))
+    return union_ranges(lo, hi)
+
+def backfill(prepared, start=None, end=None):
+    """Daily KPIs (as of the end of each day) from prepared payment data (see analyze_members.load_prepared)
+
+    Defaults to the first payment's day through today. Returns a DataFrame
+    indexed by date with KPI_COLUMNS.
+    """
+    payments = prepared['memberships']
+    dates = payments[prepared['date_col']].dropna()
+    start = pd.Timestamp(start) if start is not None else (dates.min() if len(dates) else pd.Timestamp.now())
+    end = pd.Timestamp(end) if end is not None else pd.Timestamp.now()
+    ends = day_ends(start, end)
+    index = pd.DatetimeIndex(ends.view('datetime64[ns]')).normalize().rename('date')
+    n_days = len(ends)
+    stride = n_days + 1
+
+    rows, emails = member_timelines(prepared, ends)
+    if rows.empty or not n_days:
+        return pd.DataFrame(0, index=index, columns=KPI_COLUMNS, dtype='float64')
+
+    member = rows['member'].to_numpy()
+    date = rows['date'].to_numpy()
+    segment_lo, segment_hi = rows['segment_lo'].to_numpy(), rows['segment_hi'].to_numpy()
+    not_stopped, past_due = rows['not_stopped'].to_numpy(), rows['past_due'].to_numpy()
+
+    # Members are de-duplicated by (current) name, as on the dashboard
+    member_names = prepared['members']['name'].reindex(emails).to_numpy()
+    names = pd.factorize(member_names)[0]
+    row_name = names[member]
+
+    def by_name(lo, hi, when=None):
+        """Days with at least one member of a name meeting a condition, counted per day"""
+        when = np.ones(len(lo), dtype=bool) if when is None else when
+        merged_lo, merged_hi = union_ranges(row_name[when] * stride + lo[when], row_name[when] * stride + hi[when])
+        return daily_totals(merged_lo, merged_hi, stride)
+
+    # Active: paid in the last 31 days
+    active_lo = segment_lo
+    active_hi = np.minimum(segment_hi, np.searchsorted(ends, date + 31 * DAY, side='right'))
+
+    # New: active, not Stopped, first payment under 31 days ago
+    new_hi = np.minimum(active_hi, np.searchsorted(ends, rows['first_date'].to_numpy() + 31 * DAY, side='left'))
+
+    # Late: past due, last payment under 15 days ago; quit: stopped, or past due 15+ days
+    fifteen_days = np.searchsorted(ends, date + 15 * DAY, side='left')
+    late_hi = np.minimum(segment_hi, fifteen_days)
+    stopped = rows['stopped'].to_numpy()
+    quit_lo = np.where(stopped, segment_lo, np.maximum(segment_lo, fifteen_days))
+
+    kpis = pd.DataFrame(index=index)
+    kpis['total_active_members'] = by_name(active_lo, active_hi)
+    kpis['new_members_30_days'] = by_name(active_lo, new_hi, not_stopped)
+    kpis['members_late_payment'] = by_name(segment_lo, late_hi, past_due)
+    kpis['members_quit_60_days'] = by_name(quit_lo, segment_hi, stopped | past_due)
+
+    ongoing_lo, ongoing_hi = ongoing_ranges(rows, active_lo, active_hi, names, stride, ends)
+    ongoing = daily_totals(ongoing_lo, ongoing_hi, stride)
+    kpis['ongoing_members'] = ongoing
+
+    # Projected revenue: ongoing members' average payment last calendar month
+    # times the ongoing count (their last-31-days total if none paid last month)
+    amount = rows['amount'].to_numpy()
+    month = pd.DatetimeIndex(date.view('datetime64[ns]')).to_period('M').asi8
+    day_month = index.to_period('M').asi8
+    monthly = pd.DataFrame({'member': member, 'month': month, 'amount': amount}) \
+        .groupby(['member', 'month'], sort=True)['amount'].sum().reset_index()
+    next_lo = np.searchsorted(day_month, monthly['month'].to_numpy() + 1, side='left')
+    next_hi = np.searchsorted(day_month, monthly['month'].to_numpy() + 1, side='right')
+    month_lo = monthly['member'].to_numpy() * stride + next_lo
+    month_hi = monthly['member'].to_numpy() * stride + next_hi
+    last_month_total = overlap_totals(ongoing_lo, ongoing_hi, month_lo, month_hi,
+                                      monthly['amount'].to_numpy(), stride)
+    last_month_payers = overlap_totals(ongoing_lo, ongoing_hi, month_lo, month_hi,
+                                       np.ones(len(monthly)), stride)
+    recent_total = overlap_totals(ongoing_lo, ongoing_hi, member * stride + active_lo,
+                                  member * stride + np.searchsorted(ends, date + 31 * DAY, side='right'),
+                                  amount, stride)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        projected = np.where(last_month_payers > 0, last_month_total / last_month_payers * ongoing,
+                             recent_total / ongoing * ongoing)
+    kpis['projected_revenue'] = np.where(ongoing > 0, projected, 0.0)
+
+    counts = KPI_COLUMNS[:-1]
+    kpis[counts] = kpis[counts].round().astype('int64')
+    return kpis[KPI_COLUMNS]
+
+def main():
+    parser = argparse.ArgumentParser(description='Daily dashboard KPIs over the payment history')
+    parser.add_argument('--start', help='First day (YYYY-MM-DD, default: the first payment)')
+    parser.add_argument('--end', help='Last day (YYYY-MM-DD, default: today)')
+    parser.add_argument('--output', help='Write the series to this CSV file')
+    args = parser.parse_args()
+
+    try:
+        prepared = load_prepared(get_latest_export_file(), ANALYSIS_CACHE)
+        with stage('kpi.backfill') as metrics:
+            kpis = backfill(prepared, args.start, args.end)
+            metrics['days'] = len(kpis)
+    except Exception as e:
+        print(f"✗ Error: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
+
+    if args.output:
+        kpis.to_csv(args.output, float_format='%.2f')
+        print(f"✓ Wrote {len(kpis)} days of KPIs to {args.output}")
+    else:
+        print(kpis.tail(14).to_string(float_format=lambda value: f'{value:,.2f}'))
+
+if __name__ == "__main__":
+    main()
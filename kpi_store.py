@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+KPI Store
+=========
+Keeps the dashboard's headline numbers from every refresh, so trends can be
+charted over any range without going back to the payments
+
+dashboard_data.json only ever holds the latest numbers. Each analysis run
+also appends one point to kpi_store.jsonl: the KPIs and the per-type
+breakdowns, stamped with the time they were measured (`as_of`). Points are
+only ever appended, in time order, one JSON line each, so a run adds a few
+hundred bytes and a range query only parses the lines in its range.
+
+With each refresh the daily series (the last point of each day) is
+published next to the dashboard data as kpi_trends.json, which trends.html
+charts. Days before the first refresh can be filled in from the payment
+history with `backfill` (see kpi_history.py); those points have the six
+KPIs kpi_history computes but no per-type breakdowns.
+
+Usage:
+    python kpi_store.py status                                # Number of points and the range they cover
+    python kpi_store.py query 2025-01-01 2025-06-30 W         # Weekly series for a range (start/end/freq optional)
+    python kpi_store.py backfill                              # Fill in the days before the first point
+"""
+import os
+import sys
+import json
+from pathlib import Path
+
+import pandas as pd
+
+from publish import atomic_write
+
+# Auto-detect environment
+if os.name == 'nt':  # Windows
+    STORE_FILE = r'C:\Users\erin\CFL Member Dashboard\kpi_store.jsonl'
+else:  # Linux/Server
+    STORE_FILE = '/var/www/cfl-member-dashboard/exports/kpi_store.jsonl'
+
+TRENDS_NAME = 'kpi_trends.json'
+
+# Dashboard values kept per point
+KPI_KEYS = ['ongoing_members', 'total_active_members', 'new_members_30_days', 'members_late_payment',
+            'members_quit_60_days', 'monthly_revenue', 'projected_revenue', 'total_payments']
+BREAKDOWN_KEYS = ['membership_breakdown', 'revenue_by_type']
+
+# Every line starts with {"as_of":"YYYY-MM-DD HH:MM:SS", so ranges can be
+# checked without parsing the JSON
+AS_OF_SLICE = slice(10, 29)
+
+def make_point(data, **fields):
+    """A store point from the analysis output (as_of first, see AS_OF_SLICE)"""
+    point = {'as_of': data['as_of']}
+    point.update({key: data[key] for key in KPI_KEYS if key in data})
+    point.update({key: data[key] for key in BREAKDOWN_KEYS if key in data})
+    point.update(fields)
+    return point
+
+def last_point(store_file=None):
+    """The newest point in the store, or None"""
+    store_path = Path(store_file or STORE_FILE)
+    if not store_path.exists():
+        return None
+    with open(store_path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        f.seek(max(0, size - 65536))
+        lines = f.read().splitlines()
+    return json.loads(lines[-1]) if lines else None
+
+def append_point(data, store_file=None, **fields):
+    """Append the analysis output's KPIs as a new point; returns it (None if older than the last point)"""
+    store_path = Path(store_file or STORE_FILE)
+    point = make_point(data, **fields)
+
+    # Points stay in time order; an as-of run in the past doesn't belong at the end
+    previous = last_point(store_path)
+    if previous and previous['as_of'] > point['as_of']:
+        return None
+
+    store_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(store_path, 'a') as f:
+        f.write(json.dumps(point, separators=(',', ':')) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+    return point
+
+def read_points(start=None, end=None, store_file=None):
+    """Points with start <= as_of <= end (dates or 'YYYY-MM-DD[ HH:MM:SS]' strings; end date inclusive)"""
+    store_path = Path(store_file or STORE_FILE)
+    if not store_path.exists():
+        return []
+
+    start = str(start) if start is not None else ''
+    end = str(end) if end is not None else '9999'
+    if len(end) == 10:
+        end += ' 99'  # Whole end day
+    points = []
+    with open(store_path, 'r') as f:
+        for line in f:
+            as_of = line[AS_OF_SLICE]
+            if as_of > end:
+                break  # Time order: nothing later is in range
+            if as_of >= start:
+                points.append(json.loads(line))
+    return points
+
+def load_series(start=None, end=None, freq=None, store_file=None):
+    """The stored KPIs as a DataFrame indexed by as_of
+
+    Breakdowns become one column per type ('membership_breakdown.Basic').
+    With `freq` (a pandas frequency: 'D', 'W', 'ME', ...) the last point in
+    each period is kept.
+    """
+    points = read_points(start, end, store_file)
+    rows = []
+    for point in points:
+        row = {key: point.get(key) for key in KPI_KEYS}
+        for key in BREAKDOWN_KEYS:
+            for type_name, value in (point.get(key) or {}).items():
+                row[f'{key}.{type_name}'] = value
+        rows.append(row)
+
+    series = pd.DataFrame(rows, index=pd.DatetimeIndex([point['as_of'] for point in points], name='as_of'))
+    series = series.astype('float64')
+    if freq and len(series):
+        series = series.resample(freq).last().dropna(how='all')
+    return series
+
+def trend_document(series):
+    """A series as compact, chart-ready JSON: dates plus one list per column (null for gaps)"""
+    return {
+        'dates': [date.strftime('%Y-%m-%d') for date in series.index],
+        'columns': {column: [None if pd.isna(value) else round(float(value), 2) for value in series[column]]
+                    for column in series.columns},
+    }
+
+def trends_json(store_file=None):
+    """The daily trend document published with the dashboard data"""
+    return json.dumps(trend_document(load_series(freq='D', store_file=store_file)), separators=(',', ':'))
+
+def backfill(store_file=None, prepared=None):
+    """Add daily points (from kpi_history) for the days before the first stored point"""
+    from analyze_members import ANALYSIS_CACHE, get_latest_export_file, load_prepared
+    from kpi_history import backfill as daily_kpis
+
+    store_path = Path(store_file or STORE_FILE)
+    if prepared is None:
+        prepared = load_prepared(get_latest_export_file(), ANALYSIS_CACHE)
+
+    # Up to the day before the first point (or yesterday), so refreshes still append in order
+    existing = read_points(store_file=store_path)
+    first_day = pd.Timestamp(existing[0]['as_of']) if existing else pd.Timestamp.now()
+    end = first_day.normalize() - pd.Timedelta(days=1)
+    kpis = daily_kpis(prepared, end=end)
+
+    points = [
+        {'as_of': f'{date:%Y-%m-%d} 23:59:59', **row, 'source': 'backfill'}
+        for date, row in zip(kpis.index, kpis.to_dict('records'))
+    ]
+    lines = [json.dumps(point, separators=(',', ':')) for point in points + existing]
+    atomic_write(store_path, ''.join(line + '\n' for line in lines))
+    print(f"✓ Added {len(points)} backfilled days before {first_day:%Y-%m-%d}")
+    return len(points)
+
+def status(store_file=None):
+    points = read_points(store_file=store_file)
+    if not points:
+        print(f"⚠ No KPI points yet in {store_file or STORE_FILE}")
+        return
+    backfilled = sum(point.get('source') == 'backfill' for point in points)
+    print(f"✓ {len(points)} points ({backfilled} backfilled), {points[0]['as_of']} → {points[-1]['as_of']}")
+
+def query(start=None, end=None, freq='D'):
+    series = load_series(start, end, freq)
+    print(series.to_string(float_format=lambda value: f'{value:,.2f}'))
+
+if __name__ == "__main__":
+    commands = {'status': status, 'query': query, 'backfill': backfill}
+    if len(sys.argv) < 2 or sys.argv[1] not in commands:
+        print(__doc__)
+        sys.exit(1)
+
+    try:
+        commands[sys.argv[1]](*sys.argv[2:])
+    except Exception as e:
+        print(f"✗ Error: {e}")
+        sys.exit(1)
@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+"""
+Master Payment Store
+====================
+Columnar (Parquet) storage for the payment history master database
+
+The master used to live in payment_history_master.xlsx, and reading it back
+through openpyxl was the slowest step of every refresh. The store keeps the
+same rows in Parquet with typed date and amount columns.
+
+Incremental merges don't rewrite the whole store. New and changed rows are
+appended as small delta files next to the base file, and are folded back
+into the base (compacted) once enough of them pile up.
+
+The analysis only needs a few columns, so read_payments() can prune to
+those (ANALYSIS_COLUMNS) and give them compact types: categoricals for the
+status and details strings, datetime64 dates and float64 amounts. Exports
+that really are CSV are read in chunks, so memory stays bounded by the
+pruned columns rather than the whole file.
+
+Usage:
+    python master_store.py import [xlsx_path]     # One-time import of the old xlsx master
+    python master_store.py export [xlsx_path]     # Write an xlsx copy for opening in Excel
+    python master_store.py compact                # Fold delta files into the base file
+"""
+import os
+import sys
+import time
+import hashlib
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+
+from publish import atomic_path
+
+# Auto-detect environment
+if os.name == 'nt':  # Windows
+    MASTER_STORE = r'C:\Users\erin\CFL Member Dashboard\payment_history_master.parquet'
+    MASTER_XLSX = r'C:\Users\erin\CFL Member Dashboard\payment_history_master.xlsx'
+else:  # Linux/Server
+    MASTER_STORE = '/var/www/cfl-member-dashboard/exports/payment_history_master.parquet'
+    MASTER_XLSX = '/var/www/cfl-member-dashboard/exports/payment_history_master.xlsx'
+
+# Fold deltas back into the base file once this many have accumulated
+MAX_DELTA_FILES = 24
+
+# Columns the analysis reads (besides the payment date), including older export names
+ANALYSIS_COLUMNS = ['Email', 'First Name', 'Last Name', 'Details', 'Payment Status',
+                    'Recurring Status', 'Total Amount', 'Contact', 'Description', 'Amount']
+
+# Types for the analysis columns; dates and amounts are handled by name
+ANALYSIS_DTYPES = {
+    'Email': 'string',
+    'Contact': 'string',
+    'First Name': 'string',
+    'Last Name': 'string',
+    'Details': 'category',
+    'Description': 'category',
+    'Payment Status': 'category',
+    'Recurring Status': 'category',
+}
+
+# Rows per chunk when streaming a CSV export
+CSV_CHUNK_ROWS = 50_000
+
+def is_date_column(col):
+    """Check if a column holds payment dates (e.g. 'Payment Date (UTC)')"""
+    return str(col).startswith('Payment Date')
+
+def is_amount_column(col):
+    """Check if a column holds money amounts (e.g. 'Total Amount')"""
+    return 'Amount' in str(col)
+
+def merge_key(df):
+    """Columns that identify a payment: Email + payment date
+
+    Older exports name the payer column Contact, and the date column may be
+    in UTC or local time (or some other 'Payment Date ...' variant).
+    """
+    contact_col = 'Email' if 'Email' in df.columns else 'Contact'
+    date_cols = [col for col in df.columns if is_date_column(col)]
+    date_col = 'Payment Date (UTC)' if 'Payment Date (UTC)' in date_cols else next(iter(date_cols), None)
+    if contact_col not in df.columns or date_col is None:
+        raise ValueError(f"Payments need an Email (or Contact) and a Payment Date column, found: {list(df.columns)}")
+    return [contact_col, date_col]
+
+def delta_folder(store_path=MASTER_STORE):
+    """Folder holding the delta files appended to a master store"""
+    return Path(store_path).with_suffix('.deltas')
+
+def delta_files(store_path=MASTER_STORE):
+    """Delta files for a master store, oldest first"""
+    folder = delta_folder(store_path)
+    if not folder.exists():
+        return []
+    return sorted(folder.glob('delta-*.parquet'))
+
+def store_version(store_path=MASTER_STORE):
+    """Cheap identifier of a store's current contents (its files' names, sizes
+    and modification times), or None if there is no store"""
+    store_path = Path(store_path)
+    if not store_path.exists():
+        return None
+    stats = [(path.name, path.stat()) for path in [store_path] + delta_files(store_path)]
+    return ';'.join(f'{name}:{stat.st_size}:{stat.st_mtime_ns}' for name, stat in stats)
+
+def content_hash(file_path):
+    """SHA-256 of a payment file, including its deltas for the master store"""
+    digest = hashlib.sha256()
+    for path in [Path(file_path)] + delta_files(file_path):
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+def last_modified(file_path):
+    """Modification time of a payment file, including its deltas for the master store"""
+    return max(path.stat().st_mtime for path in [Path(file_path)] + delta_files(file_path))
+
+def latest_payment_date(store_path=MASTER_STORE):
+    """Newest payment date in the master store, or None if there isn't one
+
+    Only the date column is read, so this stays cheap as the history grows.
+    """
+    store_path = Path(store_path)
+    if not store_path.exists():
+        return None
+
+    import pyarrow.parquet as pq
+    latest = None
+    for path in [store_path] + delta_files(store_path):
+        date_cols = [col for col in pq.read_schema(path).names if is_date_column(col)]
+        if not date_cols:
+            continue
+        newest = pd.to_datetime(pd.read_parquet(path, columns=date_cols[:1]).iloc[:, 0], errors='coerce').max()
+        if pd.notna(newest) and (latest is None or newest > latest):
+            latest = newest
+    return latest
+
+def wanted_columns(names, columns):
+    """The column names to read: those in `columns`, plus the payment dates"""
+    return [name for name in names if name in columns or is_date_column(name)]
+
+def apply_dtypes(df):
+    """Convert pruned payment columns to the analysis types (see ANALYSIS_DTYPES)"""
+    for col in df.columns:
+        if is_date_column(col):
+            if not pd.api.types.is_datetime64_any_dtype(df[col]):
+                df[col] = pd.to_datetime(df[col], errors='coerce')
+        elif is_amount_column(col):
+            if not pd.api.types.is_float_dtype(df[col]):
+                df[col] = pd.to_numeric(df[col], errors='coerce').astype('float64')
+        elif col in ANALYSIS_DTYPES and df[col].dtype != ANALYSIS_DTYPES[col]:
+            df[col] = df[col].astype(ANALYSIS_DTYPES[col])
+    return df
+
+def prune_payments(df, columns):
+    """An in-memory payments table cut down to `columns` (plus dates), with the analysis types
+
+    Gives the same table read_payments(path, columns) would read back from disk.
+    """
+    return apply_dtypes(df[wanted_columns(df.columns, columns)].copy())
+
+def frame_hash(df):
+    """SHA-256 of a DataFrame's contents (the in-memory counterpart of content_hash)"""
+    digest = hashlib.sha256(','.join(map(str, df.columns)).encode('utf-8'))
+    digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+def concat_payments(frames):
+    """Concatenate typed payment chunks, keeping categorical columns categorical
+
+    pandas falls back to object columns when the chunks' categories differ,
+    so the categories are unified first.
+    """
+    frames = [frame for frame in frames if len(frame.columns)]
+    if len(frames) <= 1:
+        return frames[0] if frames else pd.DataFrame()
+
+    for col in frames[0].columns:
+        if isinstance(frames[0][col].dtype, pd.CategoricalDtype):
+            categories = pd.api.types.union_categoricals(
+                [frame[col] for frame in frames if col in frame.columns], ignore_order=True).categories
+            for frame in frames:
+                if col in frame.columns:
+                    frame[col] = frame[col].cat.set_categories(categories)
+    return pd.concat(frames, ignore_index=True)
+
+def is_excel_file(file_path):
+    """Check whether a payment file is a spreadsheet (Zeffy's "CSV" usually is)"""
+    with open(file_path, 'rb') as f:
+        head = f.read(8)
+    # xlsx files are zip archives; old xls files are OLE documents
+    return head.startswith(b'PK') or head.startswith(b'\xd0\xcf\x11\xe0')
+
+def read_csv_payments(file_path, columns=None, chunk_rows=CSV_CHUNK_ROWS):
+    """Read a CSV export, streaming it in chunks when pruning to `columns`"""
+    if columns is None:
+        return pd.read_csv(file_path)
+
+    names = pd.read_csv(file_path, nrows=0).columns
+    usecols = wanted_columns(names, columns)
+    dtypes = {col: ANALYSIS_DTYPES[col] for col in usecols if col in ANALYSIS_DTYPES}
+    chunks = pd.read_csv(file_path, usecols=usecols, dtype=dtypes, chunksize=chunk_rows)
+    return concat_payments([apply_dtypes(chunk) for chunk in chunks])
+
+def normalize_types(df):
+    """Give payment data stable column types for columnar storage
+
+    Date columns become datetime64, amount columns become float64 and every
+    other text column becomes a string column. A date or amount column is only
+    converted if that doesn't turn existing values into blanks, so unexpected
+    formats are kept as text rather than silently lost.
+    """
+    df = df.copy()
+    for col in df.columns:
+        values = df[col]
+        if is_date_column(col) and not pd.api.types.is_datetime64_any_dtype(values):
+            converted = pd.to_datetime(values, errors='coerce')
+        elif is_amount_column(col) and not pd.api.types.is_float_dtype(values):
+            converted = pd.to_numeric(values, errors='coerce').astype('float64')
+        elif values.dtype == object:
+            converted = values.astype('string')
+        else:
+            continue
+
+        if converted.isna().sum() > values.isna().sum():
+            print(f"⚠ Could not convert all values in '{col}', storing as text")
+            converted = values.astype('string')
+        df[col] = converted
+
+    df.columns = [str(col) for col in df.columns]
+    return df
+
+def read_payments(file_path, columns=None):
+    """Read payment data from the master store or a Zeffy export
+
+    With `columns` (e.g. ANALYSIS_COLUMNS) only those columns and the payment
+    dates are read, with the analysis types applied.
+    """
+    file_path = Path(file_path)
+    if file_path.suffix == '.parquet':
+        return load_master(file_path, columns)
+
+    # Zeffy "CSV" exports are actually Excel files, but handle real CSVs too
+    if not is_excel_file(file_path):
+        return read_csv_payments(file_path, columns)
+    if columns is None:
+        return pd.read_excel(file_path)
+    return apply_dtypes(pd.read_excel(file_path, usecols=lambda name: bool(wanted_columns([name], columns))))
+
+def since_filter(schema, since):
+    """Parquet row filter for payments made on or after `since`
+
+    Payments without a date are kept too: nothing says they're older, and an
+    incremental merge has to see them to match the export's undated rows.
+    None (read everything) if the dates aren't stored as timestamps.
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    for field in schema:
+        if is_date_column(field.name):
+            if pa.types.is_timestamp(field.type):
+                return (ds.field(field.name) >= pd.Timestamp(since)) | ds.field(field.name).is_null()
+            return None
+    return None
+
+def read_parquet_columns(path, columns=None, since=None):
+    """Read a Parquet file, pruned to `columns` (plus dates) and typed if given
+
+    With `since` only payments made on or after it are read; the filter is
+    applied while reading, so row groups before it are skipped.
+    """
+    import pyarrow.parquet as pq
+    schema = pq.read_schema(path)
+    filters = since_filter(schema, since) if since is not None else None
+    if columns is None:
+        return pd.read_parquet(path, filters=filters)
+    return apply_dtypes(pd.read_parquet(path, columns=wanted_columns(schema.names, columns), filters=filters))
+
+def load_master(store_path=MASTER_STORE, columns=None, since=None):
+    """Load the master database, or an empty DataFrame if there isn't one yet
+
+    With `columns` only those columns and the payment dates are read, with
+    the analysis types applied (see read_payments). With `since` (a
+    datetime) only the payments made on or after it, or without a date, are
+    read.
+    """
+    store_path = Path(store_path)
+    if not store_path.exists():
+        return pd.DataFrame()
+
+    df = read_parquet_columns(store_path, columns, since)
+    deltas = delta_files(store_path)
+    if deltas:
+        # Later deltas replace earlier versions of the same payment
+        df = concat_payments([df] + [read_parquet_columns(path, columns, since) for path in deltas])
+        df = df.drop_duplicates(subset=merge_key(df), keep='last').reset_index(drop=True)
+    return df
+
+def save_master(df, store_path=MASTER_STORE):
+    """Write the full master database to the columnar store
+
+    Any deltas are already included in df, so they are removed afterwards.
+    The file is replaced atomically, so readers get the old or new master.
+    """
+    store_path = Path(store_path)
+    with atomic_path(store_path) as temp_path:
+        normalize_types(df).to_parquet(temp_path, index=False)
+
+    for path in delta_files(store_path):
+        path.unlink()
+    return store_path
+
+def append_master(df_delta, store_path=MASTER_STORE):
+    """Append new or changed payments to the master store as a delta file
+
+    Only the delta is written. Once MAX_DELTA_FILES deltas have accumulated
+    the store is compacted back into a single base file.
+    """
+    folder = delta_folder(store_path)
+    folder.mkdir(parents=True, exist_ok=True)
+    delta_path = folder / f"delta-{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}.parquet"
+    with atomic_path(delta_path) as temp_path:
+        normalize_types(df_delta).to_parquet(temp_path, index=False)
+
+    if len(delta_files(store_path)) >= MAX_DELTA_FILES:
+        compact_master(store_path)
+    return delta_path
+
+def compact_master(store_path=MASTER_STORE):
+    """Fold all deltas into the base file"""
+    df = load_master(store_path)
+    save_master(df, store_path)
+    print(f"✓ Compacted master database: {len(df)} records")
+    return store_path
+
+def import_xlsx(xlsx_path=MASTER_XLSX, store_path=MASTER_STORE):
+    """One-time import of the old xlsx master into the columnar store"""
+    xlsx_path = Path(xlsx_path)
+    if not xlsx_path.exists():
+        raise FileNotFoundError(f"No xlsx master found at {xlsx_path}")
+
+    print(f"Importing {xlsx_path}")
+    df = pd.read_excel(xlsx_path)
+    store_path = save_master(df, store_path)
+    print(f"✓ Imported {len(df)} records into {store_path}")
+
+    # Show the load-time difference this buys every refresh
+    start = time.perf_counter()
+    pd.read_excel(xlsx_path)
+    xlsx_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    load_master(store_path)
+    store_seconds = time.perf_counter() - start
+    print(f"  Load time: xlsx {xlsx_seconds:.2f}s → parquet {store_seconds:.2f}s")
+
+    return store_path
+
+def export_xlsx(xlsx_path=MASTER_XLSX, store_path=MASTER_STORE):
+    """Write an xlsx copy of the master store for opening in Excel"""
+    df = load_master(store_path)
+    if df.empty:
+        raise FileNotFoundError(f"No master store found at {store_path}")
+
+    with atomic_path(xlsx_path) as temp_path:
+        df.to_excel(temp_path, index=False, engine='openpyxl')
+    print(f"✓ Exported {len(df)} records to {xlsx_path}")
+    return xlsx_path
+
+if __name__ == "__main__":
+    commands = {'import': import_xlsx, 'export': export_xlsx, 'compact': compact_master}
+    if len(sys.argv) < 2 or sys.argv[1] not in commands:
+        print(__doc__)
+        sys.exit(1)
+
+    try:
+        commands[sys.argv[1]](*sys.argv[2:3])
+    except Exception as e:
+        print(f"✗ Error: {e}")
+        sys.exit(1)
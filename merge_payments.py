@@ -2,18 +2,28 @@
 """
 Payment History Merger
 Merges new Zeffy exports with historical master database
+
+Usage:
+    python merge_payments.py          # Append new/changed payments only
+    python merge_payments.py --full   # Rewrite the whole master database
 """
 import pandas as pd
 import os
+import sys
 from pathlib import Path
-from datetime import datetime
+
+from backups import backup_master
+from pipeline_metrics import stage
+from publish import refresh_lock
+from master_store import (MASTER_STORE, MASTER_XLSX, ANALYSIS_COLUMNS, load_master, save_master, append_master,
+                          import_xlsx, merge_key, normalize_types, read_payments, store_version)
+
+MASTER_DB = MASTER_STORE
 
 # Auto-detect environment
 if os.name == 'nt':  # Windows
-    MASTER_DB = r'C:\Users\erin\CFL Member Dashboard\payment_history_master.xlsx'
     EXPORT_FOLDER = r'C:\Users\erin\Zeffy_Exports'
 else:  # Linux/Server
-    MASTER_DB = '/var/www/cfl-member-dashboard/exports/payment_history_master.xlsx'
     EXPORT_FOLDER = '/var/www/cfl-member-dashboard/exports'
 
 def get_latest_export():
@@ -28,35 +38,133 @@ def get_latest_export():
     latest_file = max(files, key=lambda f: f.stat().st_mtime)
     return latest_file
 
-def merge_payments():
-    """Merge latest export with master database"""
+def find_changed_payments(df_master, df_new):
+    """Find export rows that are new or differ from the master's copy
+
+    Payments are matched on Email + payment date. Returns the changed rows
+    along with how many of them are new payments and how many are updates
+    to existing ones (e.g. a recurring status that moved to Stopped).
+    """
+    key = merge_key(df_new)
+    df_new = df_new.drop_duplicates(subset=key, keep='last').reset_index(drop=True)
+    if df_master.empty:
+        return df_new, len(df_new), 0
+
+    # Line up each export row with the master's version of the same payment
+    master = df_master.reindex(columns=df_new.columns)
+    master = master.drop_duplicates(subset=key, keep='last')
+    matched = df_new.merge(master, on=key, how='left', suffixes=('', '_master'), indicator=True)
+
+    is_new = (matched['_merge'] == 'left_only').to_numpy()
+    is_changed = is_new.copy()
+    for col in df_new.columns.difference(key):
+        new_values = matched[col].astype(object).where(matched[col].notna(), None)
+        old_values = matched[f'{col}_master'].astype(object).where(matched[f'{col}_master'].notna(), None)
+        both_blank = new_values.isna() & old_values.isna()
+        is_changed |= ((new_values != old_values) & ~both_blank).to_numpy()
+
+    return df_new[is_changed], int(is_new.sum()), int((is_changed & ~is_new).sum())
+
+def merge_payments(incremental=True, export_file=None):
+    """Merge latest export (or export_file) with master database
+
+    In incremental mode only new and changed payments are appended to the
+    master store, so the work and disk writes scale with the size of the
+    change rather than the whole payment history. Full mode rewrites the
+    master and saves a timestamped backup.
+    """
+    return merge_export(incremental=incremental, export_file=export_file)[0]
+
+def merged_payments(master_path):
+    """The master's payments as the analysis reads them (ANALYSIS_COLUMNS only)"""
+    with stage('merge.read_back') as metrics:
+        df = load_master(master_path, ANALYSIS_COLUMNS)
+        metrics['rows'] = len(df)
+    return df
+
+def merge_export(incremental=True, export_file=None, df_new=None, changes=None):
+    """Merge an export into the master database and return (master_path, merged payments)
+
+    The merged payments are the master as it now stands, in the columns the
+    analysis reads (what read_payments(master_path, ANALYSIS_COLUMNS) would
+    give), so pipeline.py can hand them straight to the analysis. Pass the
+    export as a DataFrame in df_new, or leave it to be read from export_file
+    (default: the latest export).
+
+    An incremental merge only reads the master's payments from the export's
+    first payment date on, plus any without a date: those are the only ones
+    the export can match.
+
+    `changes` (a dict) receives what the merge touched, for the analysis to
+    check only that: 'since', the earliest payment date that may differ
+    (None when the whole master was written), and 'version', the master's
+    store_version before the merge.
+    """
 
     master_path = Path(MASTER_DB)
 
-    # Load master database (or create if doesn't exist)
-    if master_path.exists():
-        print(f"Loading master database: {master_path}")
-        df_master = pd.read_excel(master_path)
-        print(f"  Master has {len(df_master)} records")
-    else:
-        print("⚠ No master database found, latest export will become master")
-        df_master = pd.DataFrame()
+    # One-time import of the old xlsx master into the columnar store
+    if not master_path.exists() and Path(MASTER_XLSX).exists():
+        import_xlsx(MASTER_XLSX, master_path)
 
-    # Load latest export
-    latest_file = get_latest_export()
-    print(f"Loading latest export: {latest_file}")
+    if changes is not None:
+        changes.update(since=None, version=store_version(master_path))
 
-    if latest_file.suffix == '.csv':
-        df_new = pd.read_excel(latest_file)  # Zeffy "CSV" is actually Excel
-    else:
-        df_new = pd.read_excel(latest_file)
+    # Match the master's column types so dates compare equal when deduplicating
+    with stage('merge.load_export') as metrics:
+        if df_new is None:
+            # Load latest export
+            latest_file = Path(export_file) if export_file else get_latest_export()
+            print(f"Loading latest export: {latest_file}")
+            df_new = read_payments(latest_file)
+        df_new = normalize_types(df_new)
+        metrics['rows'] = len(df_new)
 
     print(f"  Latest export has {len(df_new)} records")
 
+    # Load master database (or create if doesn't exist)
+    with stage('merge.load_master') as metrics:
+        if master_path.exists():
+            since = df_new[merge_key(df_new)[1]].min() if incremental else None
+            since = None if pd.isna(since) else since
+            print(f"Loading master database: {master_path}" + (f" (payments since {since})" if since else ""))
+            df_master = load_master(master_path, since=since)
+            print(f"  Master has {len(df_master)} records" + (" in that range" if since else ""))
+        else:
+            print("⚠ No master database found, latest export will become master")
+            df_master = pd.DataFrame()
+        metrics['rows'] = len(df_master)
+
     # If no master, use latest as master
-    if df_master.empty:
+    if not master_path.exists():
         df_merged = df_new.copy()
         print(f"✓ Created new master database with {len(df_merged)} records")
+    elif incremental:
+        # Append only payments that are new or changed since the last merge
+        with stage('merge.find_changes') as metrics:
+            df_delta, new_count, updated_count = find_changed_payments(df_master, df_new)
+            metrics.update(rows=len(df_delta), new=new_count, updated=updated_count)
+        del df_master
+
+        if changes is not None:
+            # Undated payments aren't in any dated total; with only those, the export's last day is checked
+            date_col = merge_key(df_new)[1]
+            since = df_delta[date_col].min()
+            since = since if pd.notna(since) else df_new[date_col].max()
+            changes['since'] = since if pd.notna(since) else None
+
+        if df_delta.empty:
+            print("✓ Master database already up to date")
+            return master_path, merged_payments(master_path)
+
+        with stage('merge.append', rows=len(df_delta)):
+            delta_path = append_master(df_delta, master_path)
+        print(f"✓ Appended {new_count} new and {updated_count} updated records: {delta_path.name}")
+
+        with stage('merge.backup'):
+            backup_master(master_path)
+
+        return master_path, merged_payments(master_path)
     else:
         # Merge: add new records, update existing ones
         # Use Email + Payment Date as unique key
@@ -69,35 +177,37 @@ def merge_payments():
             for col in missing_in_master:
                 df_master[col] = None
 
-        # Concatenate and remove duplicates
-        df_merged = pd.concat([df_master, df_new], ignore_index=True)
-
-        # Remove exact duplicates based on Email + Payment Date
-        date_col = 'Payment Date (UTC)' if 'Payment Date (UTC)' in df_merged.columns else 'Payment Date (America/Los_Angeles)'
+        with stage('merge.full_merge') as metrics:
+            # Concatenate and remove duplicates
+            df_merged = pd.concat([df_master, df_new], ignore_index=True)
 
-        initial_count = len(df_merged)
-        df_merged = df_merged.drop_duplicates(subset=['Email', date_col], keep='last')
-        duplicates_removed = initial_count - len(df_merged)
+            # Remove exact duplicates based on Email + Payment Date
+            initial_count = len(df_merged)
+            df_merged = df_merged.drop_duplicates(subset=merge_key(df_merged), keep='last')
+            duplicates_removed = initial_count - len(df_merged)
+            metrics['rows'] = len(df_merged)
 
         print(f"✓ Merged data: {len(df_merged)} total records ({duplicates_removed} duplicates removed)")
 
     # Save updated master
-    master_path.parent.mkdir(parents=True, exist_ok=True)
-    df_merged.to_excel(master_path, index=False)
+    with stage('merge.save', rows=len(df_merged)):
+        save_master(df_merged, master_path)
     print(f"✓ Saved master database: {master_path}")
 
-    # Create backup with timestamp
-    backup_path = master_path.parent / f"payment_history_backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-    df_merged.to_excel(backup_path, index=False)
-    print(f"✓ Backup saved: {backup_path}")
+    # Snapshot into the backup store and thin out old backups
+    with stage('merge.backup'):
+        backup_master(master_path)
 
-    return master_path
+    return master_path, merged_payments(master_path)
 
 if __name__ == "__main__":
     try:
-        master_file = merge_payments()
+        # --full rewrites the whole master instead of appending changes
+        with refresh_lock():
+            master_file = merge_payments(incremental='--full' not in sys.argv)
         print(f"\n✓ Master database ready: {master_file}")
         print("Run analyze_members.py to generate dashboard from master database")
+        print("Run 'python master_store.py export' for an Excel copy")
     except Exception as e:
         print(f"✗ Error: {e}")
         import traceback
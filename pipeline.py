@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Refresh Pipeline
+================
+Runs the whole refresh (Zeffy export → merge → analysis) in one process,
+handing the payment data from stage to stage in memory
+
+Run as separate scripts, each stage reads back what the one before it wrote:
+the merge parses the export, then the analysis loads the whole master
+database again. Here the export is parsed once, the merge returns the
+merged master (in the columns the analysis reads) as a DataFrame and the
+analysis works on that directly. The merge itself only reads the part of
+the master the export overlaps.
+
+The refresh daemon runs refreshes through run_pipeline(). The separate
+scripts still work on their own, e.g. to re-run just the analysis.
+
+Usage:
+    python pipeline.py                          # Export from Zeffy, merge and analyze
+    python pipeline.py --full                   # Full ("All time") export, rewriting the master
+    python pipeline.py --export-file FILE       # Merge and analyze an export already on disk
+"""
+import sys
+import asyncio
+import argparse
+from contextlib import nullcontext
+from pathlib import Path
+
+import zeffy_export
+import merge_payments
+import analyze_members
+from master_store import read_payments
+from pipeline_metrics import stage
+from publish import refresh_lock
+
+STAGES = ['export', 'merge', 'analyze']
+
+def export_payments(browser=None, full=False):
+    """Download the payments export from Zeffy and return its path
+
+    `browser` is the refresh daemon's ResidentBrowser, or None to launch a
+    fresh browser.
+    """
+    if browser:
+        export_file = browser.run(zeffy_export.download_zeffy_payments(browser.pool, full=full))
+    else:
+        export_file = asyncio.run(zeffy_export.download_zeffy_payments(full=full))
+    if not export_file:
+        raise RuntimeError('Zeffy export failed')
+    return Path(export_file)
+
+def run_pipeline(export_file=None, browser=None, full=False, output_file=None, track=None):
+    """Export, merge and analyze in one go; returns the dashboard data
+
+    Skips the export if export_file is given. `full` exports all payments
+    and rewrites the master instead of appending changes. `track(name)` is
+    a context manager wrapped around each stage (the daemon's job.stage).
+
+    Holds the refresh lock throughout (the daemon already does; a fallback
+    run from the CGI script or cron waits for any refresh in progress).
+    """
+    track = track or (lambda name: nullcontext())
+
+    with refresh_lock():
+        with track('export'):
+            if export_file is None:
+                export_file = export_payments(browser, full)
+            with stage('pipeline.read_export') as metrics:
+                df_export = read_payments(export_file)
+                metrics['rows'] = len(df_export)
+
+        with track('merge'):
+            changes = {}
+            master_path, df_master = merge_payments.merge_export(incremental=not full, export_file=export_file,
+                                                                 df_new=df_export, changes=changes)
+            del df_export
+
+        with track('analyze'):
+            return analyze_members.generate_dashboard(output_file, payments=df_master, source_file=master_path,
+                                                      changes=changes)
+
+def main():
+    parser = argparse.ArgumentParser(description='Refresh the dashboard data (export, merge, analyze)')
+    parser.add_argument('--full', action='store_true', help='Export all payments and rewrite the master')
+    parser.add_argument('--export-file', help='Use this export instead of downloading one')
+    args = parser.parse_args()
+
+    try:
+        data = run_pipeline(export_file=args.export_file, full=args.full)
+        print(f"\n✓ Refresh complete: {data['total_active_members']} active members")
+    except Exception as e:
+        print(f"✗ Error: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
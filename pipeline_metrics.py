@@ -0,0 +1,187 @@
+"""
+Refresh Pipeline Metrics
+========================
+Records wall time, peak memory and row counts for each stage of the
+refresh (Zeffy export, merge, analysis)
+
+Every finished stage is appended as one JSON line to pipeline_metrics.jsonl,
+and the stages of the latest run are also kept in last_run_metrics.json for
+the dashboard to show. Scripts started by the same refresh share a run id
+through the REFRESH_RUN_ID environment variable. When a new run starts,
+records older than PIPELINE_METRICS_KEEP_DAYS (default 90) are dropped
+from the log.
+
+Stages can be nested (e.g. pipeline.read_export inside a script's own
+stage): each reports its own peak memory, and an outer stage's peak
+includes its inner stages'.
+
+Usage:
+    from pipeline_metrics import stage
+
+    with stage('merge.load_master') as metrics:
+        df = load_master()
+        metrics['rows'] = len(df)
+
+    with stage('export.download') as metrics:
+        with step(metrics, 'open_modal'):   # Per-step seconds within a stage
+            ...
+"""
+import os
+import sys
+import json
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from publish import atomic_write
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Auto-detect environment
+if os.name == 'nt':  # Windows
+    METRICS_FILE = r'C:\Users\erin\CFL Member Dashboard\pipeline_metrics.jsonl'
+    LAST_RUN_FILE = r'C:\Users\erin\CFL Member Dashboard\last_run_metrics.json'
+else:  # Linux/Server
+    METRICS_FILE = '/var/www/cfl-member-dashboard/exports/pipeline_metrics.jsonl'
+    LAST_RUN_FILE = '/var/www/cfl-member-dashboard/exports/last_run_metrics.json'
+
+RUN_ID = os.getenv('REFRESH_RUN_ID') or datetime.now().strftime('%Y%m%d-%H%M%S')
+
+KEEP_DAYS = int(os.getenv('PIPELINE_METRICS_KEEP_DAYS', 90))
+
+# Peak memory seen so far by each open stage, outermost first. The kernel's
+# counter is reset when a stage starts, so a stage keeps what it saw before
+# an inner stage reset it.
+_open_peaks = []
+
+def _reset_peak_rss():
+    """Reset the kernel's peak-RSS counter so each stage reports its own peak (Linux only)"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+def _peak_rss_mb():
+    """Peak resident memory in MB (since the last reset on Linux, else process lifetime)"""
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS, KB elsewhere
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def _max_peak(*peaks):
+    peaks = [peak for peak in peaks if peak is not None]
+    return max(peaks) if peaks else None
+
+def prune(metrics_file=None, keep_days=KEEP_DAYS, now=None):
+    """Drop records that finished more than keep_days ago from the metrics log"""
+    metrics_path = Path(metrics_file or METRICS_FILE)
+    if not metrics_path.exists():
+        return 0
+    cutoff = ((now or datetime.now()) - timedelta(days=keep_days)).strftime('%Y-%m-%d %H:%M:%S')
+    with open(metrics_path, 'r') as f:
+        lines = f.readlines()
+
+    def recent(line):
+        try:
+            return json.loads(line)['finished'] >= cutoff
+        except (ValueError, KeyError, TypeError):
+            return False
+
+    kept = [line for line in lines if recent(line)]
+    if len(kept) < len(lines):
+        atomic_write(metrics_path, ''.join(kept))
+    return len(lines) - len(kept)
+
+def record(entry, metrics_file=None, last_run_file=None):
+    """Append a stage record to the metrics log and the last-run summary"""
+    try:
+        # Start a fresh summary when a new run begins
+        last_run_path = Path(last_run_file or LAST_RUN_FILE)
+        last_run = {'run_id': entry['run_id'], 'stages': []}
+        if last_run_path.exists():
+            with open(last_run_path, 'r') as f:
+                existing = json.load(f)
+            if existing.get('run_id') == entry['run_id']:
+                last_run = existing
+
+        # Once per run, thin out the log
+        if not last_run['stages']:
+            prune(metrics_file)
+
+        metrics_path = Path(metrics_file or METRICS_FILE)
+        metrics_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(metrics_path, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+
+        last_run['stages'].append(entry)
+        last_run['updated'] = entry['finished']
+
+        atomic_write(last_run_path, json.dumps(last_run, indent=2))
+    except Exception as e:
+        # Metrics must never break a refresh
+        print(f"⚠ Could not record pipeline metrics: {e}")
+
+def last_run(last_run_file=None):
+    """The stages recorded so far for the latest run, or None"""
+    last_run_path = Path(last_run_file or LAST_RUN_FILE)
+    if not last_run_path.exists():
+        return None
+    with open(last_run_path, 'r') as f:
+        return json.load(f)
+
+@contextmanager
+def stage(name, **fields):
+    """Time a pipeline stage and record it when the block finishes
+
+    Yields a dict; set keys on it (e.g. 'rows') to record them with the
+    stage. A stage that raises is still recorded, with 'error' set.
+    """
+    metrics = dict(fields)
+    if _open_peaks:
+        # The reset below would lose the outer stage's peak so far
+        _open_peaks[-1] = _max_peak(_open_peaks[-1], _peak_rss_mb())
+    _reset_peak_rss()
+    _open_peaks.append(None)
+    started = datetime.now()
+    start = time.perf_counter()
+    try:
+        yield metrics
+    except BaseException as e:
+        metrics['error'] = str(e) or type(e).__name__
+        raise
+    finally:
+        peak = _max_peak(_open_peaks.pop(), _peak_rss_mb())
+        if _open_peaks:
+            _open_peaks[-1] = _max_peak(_open_peaks[-1], peak)
+        record({
+            'run_id': RUN_ID,
+            'stage': name,
+            'started': started.strftime('%Y-%m-%d %H:%M:%S'),
+            'finished': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'seconds': round(time.perf_counter() - start, 3),
+            'peak_rss_mb': peak,
+            **metrics,
+        })
+
+@contextmanager
+def step(metrics, name):
+    """Time one step inside a stage; recorded in the stage's 'steps'"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.setdefault('steps', {})[name] = round(time.perf_counter() - start, 3)
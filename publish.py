@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""
+Atomic Publication
+==================
+Writes outputs so readers (nginx, run_dashboard.py, the kiosks) never see a
+half-written file, and publishes related outputs together
+
+Single files (the master store, its deltas, metrics) are written to a temp
+file in the same folder, fsynced and renamed over the target. A rename is
+atomic, so readers see either the old file or the new one.
+
+The dashboard's outputs (dashboard_data.json, its delta, their gzipped
+copies and the metrics of the run that made them) are published as one
+generation:
+    exports/published/<generation>/       every file of one publish
+    exports/published/current  →  <generation>
+    exports/published/previous →  <generation before it>
+    exports/dashboard_data.json  →  published/current/dashboard_data.json
+The files in exports/ are links through `current`, so swapping that one
+link switches them all at once. The previous generation is kept for
+rollback (plus a few older ones). On Windows, where links need admin
+rights, each file is renamed into place one at a time instead, and
+current/previous are small files naming the generation.
+
+Usage:
+    python publish.py status [exports_dir]      # Show the current and previous generations
+    python publish.py rollback [exports_dir]    # Switch back to the previous generation
+"""
+import os
+import sys
+import json
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# Auto-detect environment
+if os.name == 'nt':  # Windows
+    EXPORTS_DIR = r'C:\Users\erin\CFL Member Dashboard'
+else:  # Linux/Server
+    EXPORTS_DIR = '/var/www/cfl-member-dashboard/exports'
+
+PUBLISHED_NAME = 'published'
+
+# Held by anything that rewrites the master store or publishes from it
+LOCK_FILE = os.path.join(EXPORTS_DIR, 'refresh.lock')
+
+# Per lock file: [lock for this process's threads, how deeply it is held]
+_process_locks = {}
+_process_locks_guard = threading.Lock()
+
+# Generations kept besides current and previous
+KEEP_OLDER_GENERATIONS = 2
+
+# Publish through links where the OS allows it
+USE_LINKS = os.name != 'nt'
+
+def fsync_dir(path):
+    """Flush a directory entry change (a rename) to disk (no-op on Windows)"""
+    if os.name == 'nt':
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+@contextmanager
+def atomic_path(path):
+    """Yield a temp path to write `path` through; it replaces `path` only if the block succeeds
+
+    For writers that want a file name (to_parquet, to_excel). The temp name
+    starts with a dot, so globs for the real files don't pick it up.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, temp_name = tempfile.mkstemp(dir=path.parent, prefix=f'.{path.name}.', suffix='.tmp')
+    os.close(fd)
+    temp_path = Path(temp_name)
+    try:
+        yield temp_path
+        with open(temp_path, 'rb+') as f:
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+        fsync_dir(path.parent)
+    finally:
+        if temp_path.exists():
+            temp_path.unlink()
+
+def atomic_write(path, data):
+    """Write bytes (or text) to `path` atomically"""
+    with atomic_path(path) as temp_path:
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        temp_path.write_bytes(data)
+    return Path(path)
+
+@contextmanager
+def refresh_lock(lock_file=LOCK_FILE):
+    """Hold an exclusive lock so refreshes never overlap
+
+    Covers other processes (flock) and other threads of this one. A thread
+    that already holds it can take it again, so run_pipeline() can lock
+    whether it is called from the daemon (which holds the lock around each
+    job) or on its own.
+    """
+    lock_path = Path(lock_file).absolute()
+    with _process_locks_guard:
+        local = _process_locks.setdefault(lock_path, [threading.RLock(), 0])
+
+    with local[0]:
+        local[1] += 1
+        try:
+            if local[1] > 1 or fcntl is None:
+                yield
+                return
+
+            lock_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(lock_path, 'w') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+        finally:
+            local[1] -= 1
+
+def published_dir(exports_dir=EXPORTS_DIR):
+    return Path(exports_dir) / PUBLISHED_NAME
+
+def replace_link(link_path, target):
+    """Point a symlink at `target`, atomically replacing whatever was at link_path
+
+    Publishes hold the refresh lock, so only one at a time uses the temp link.
+    """
+    link_path = Path(link_path)
+    temp_link = link_path.with_name(f'.{link_path.name}.link')
+    if temp_link.is_symlink() or temp_link.exists():
+        temp_link.unlink()
+    os.symlink(target, temp_link)
+    os.replace(temp_link, link_path)
+
+def generation_of(pointer):
+    """The generation a current/previous pointer names, or None"""
+    pointer = Path(pointer)
+    if pointer.is_symlink():
+        return os.readlink(pointer)
+    if pointer.is_file():
+        return pointer.read_text().strip() or None
+    return None
+
+def set_pointer(pointer, generation):
+    """Point current/previous at a generation (a link, or a file on Windows)"""
+    if USE_LINKS:
+        replace_link(pointer, generation)
+    else:
+        atomic_write(pointer, generation)
+
+class Generation:
+    """A set of output files that are published together
+
+        generation = Generation(exports_dir)
+        generation.write('dashboard_data.json', data)
+        generation.commit()          # All files appear at once, or none do
+    """
+
+    def __init__(self, exports_dir=EXPORTS_DIR):
+        self.exports_dir = Path(exports_dir)
+        self.root = published_dir(exports_dir)
+        self.id = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+        self.dir = self.root / self.id
+        self.dir.mkdir(parents=True)
+        self.names = []
+        self.carried = set()
+
+    def write(self, name, data):
+        """Add a file (bytes, or text) to the generation"""
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        with open(self.dir / name, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        self.names.append(name)
+
+    def write_json(self, name, data, **kwargs):
+        self.write(name, json.dumps(data, **kwargs))
+
+    def carry(self, name, source):
+        """Add a published file unchanged: same bytes and mtime, so its ETag stays valid"""
+        source = Path(source).resolve()
+        try:
+            os.link(source, self.dir / name)
+        except OSError:
+            shutil.copy2(source, self.dir / name)
+        self.names.append(name)
+        self.carried.add(name)
+
+    def commit(self):
+        """Publish every file of the generation at once"""
+        fsync_dir(self.dir)
+
+        if not USE_LINKS:
+            # Carried files are already in place
+            for name in self.names:
+                if name not in self.carried:
+                    atomic_write(self.exports_dir / name, (self.dir / name).read_bytes())
+
+        current = self.root / 'current'
+        previous = generation_of(current)
+        set_pointer(current, self.id)
+        if previous:
+            set_pointer(self.root / 'previous', previous)
+        fsync_dir(self.root)
+
+        # The fixed names readers use go through `current` (set up once per name)
+        if USE_LINKS:
+            for name in self.names:
+                link_path = self.exports_dir / name
+                target = os.path.join(PUBLISHED_NAME, 'current', name)
+                if not link_path.is_symlink() or os.readlink(link_path) != target:
+                    replace_link(link_path, target)
+            fsync_dir(self.exports_dir)
+
+        self.prune()
+        return self
+
+    def abort(self):
+        """Throw the generation away without publishing it"""
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def prune(self):
+        """Remove generations beyond current, previous and a few older ones"""
+        keep = {generation_of(self.root / 'current'), generation_of(self.root / 'previous'), self.id}
+        generations = sorted(path for path in self.root.iterdir()
+                             if path.is_dir() and not path.is_symlink() and path.name not in keep)
+        for path in generations[:-KEEP_OLDER_GENERATIONS or None]:
+            shutil.rmtree(path, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
+
+def rollback(exports_dir=EXPORTS_DIR):
+    """Switch current and previous, publishing the previous generation again
+
+    Holds the refresh lock, so a refresh can't publish in between.
+    """
+    root = published_dir(exports_dir)
+    with refresh_lock(Path(exports_dir) / Path(LOCK_FILE).name):
+        current, previous = generation_of(root / 'current'), generation_of(root / 'previous')
+        if not previous or not (root / previous).is_dir():
+            raise FileNotFoundError(f"No previous generation to roll back to in {root}")
+
+        if not USE_LINKS:
+            for path in (root / previous).iterdir():
+                atomic_write(Path(exports_dir) / path.name, path.read_bytes())
+        set_pointer(root / 'current', previous)
+        set_pointer(root / 'previous', current)
+        fsync_dir(root)
+    print(f"✓ Rolled back to generation {previous} (was {current})")
+    return previous
+
+def status(exports_dir=EXPORTS_DIR):
+    root = published_dir(exports_dir)
+    for name in ('current', 'previous'):
+        generation = generation_of(root / name)
+        files = sorted(path.name for path in (root / generation).iterdir()) if generation else []
+        print(f"{name:>8}: {generation or '-'}  {', '.join(files)}")
+
+if __name__ == "__main__":
+    commands = {'status': status, 'rollback': rollback}
+    if len(sys.argv) < 2 or sys.argv[1] not in commands:
+        print(__doc__)
+        sys.exit(1)
+
+    try:
+        commands[sys.argv[1]](*sys.argv[2:3])
+    except Exception as e:
+        print(f"✗ Error: {e}")
+        sys.exit(1)
@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+"""
+Refresh Daemon
+==============
+Long-running service that refreshes the dashboard data on request
+
+Pandas, Playwright and the pipeline modules are imported once at startup
+instead of in a fresh Python for every button press. Refreshes run one at a
+time: a request that arrives while a refresh is running joins that refresh
+instead of starting a second one. A lock file keeps cron runs (--trigger or
+--once) from overlapping with the service as well.
+
+The service also keeps Chromium and the logged-in Zeffy session open between
+refreshes (zeffy_export.BrowserPool), so exports skip the browser start and
+login. Set ZEFFY_KEEP_BROWSER=0 to launch a fresh browser every time.
+
+Usage:
+    python refresh_daemon.py              # Run the service on 127.0.0.1:8765
+    python refresh_daemon.py --trigger    # Ask the running service to refresh and wait (for cron)
+    python refresh_daemon.py --once       # Refresh in this process, without the service
+    python refresh_daemon.py --job ID     # Same, reporting progress in exports/refresh_job.json
+                                          # (how the CGI script refreshes when the service is down)
+
+Endpoints:
+    POST /refresh           Start a refresh, or join the one already running; returns the job
+                            right away (?wait=1 blocks until it finishes instead)
+    GET  /status            The current or most recent refresh
+    GET  /status/<job_id>   A specific refresh: state, per-stage status and seconds,
+                            progress (0-1) and the latest step message
+
+Configuration (.env):
+    REFRESH_DAEMON_HOST     default 127.0.0.1 (keep it local; nginx/CGI talk to it)
+    REFRESH_DAEMON_PORT     default 8765
+    ZEFFY_KEEP_BROWSER      default 1 (keep the browser open between exports)
+    ZEFFY_CONTEXT_MAX_AGE_HOURS  default 12 (replace the resident browser after this long)
+"""
+import os
+import sys
+import json
+import time
+import signal
+import uuid
+import asyncio
+import threading
+import traceback
+import urllib.error
+import urllib.request
+from contextlib import contextmanager, redirect_stdout
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlparse, parse_qs
+
+from dotenv import load_dotenv
+
+# Imported once here so every refresh reuses them
+import pipeline
+import pipeline_metrics
+import zeffy_export
+from publish import EXPORTS_DIR, LOCK_FILE, atomic_write, refresh_lock
+
+load_dotenv()
+
+HOST = os.getenv('REFRESH_DAEMON_HOST', '127.0.0.1')
+PORT = int(os.getenv('REFRESH_DAEMON_PORT', 8765))
+KEEP_BROWSER = os.getenv('ZEFFY_KEEP_BROWSER', '1') != '0'
+
+STAGES = pipeline.STAGES
+
+# How many finished jobs /status/<job_id> can still look up
+MAX_JOB_HISTORY = 20
+
+# Output lines kept per job (shown when a refresh fails)
+MAX_LOG_LINES = 200
+
+# Progress of a --job refresh, for cgi-bin/refresh_status.py when the service is down
+JOB_FILE = os.path.join(EXPORTS_DIR, 'refresh_job.json')
+
+class JobLog:
+    """Stream that echoes output to the daemon's log and keeps the tail for the job
+
+    Only output printed by the job's own threads (the job thread and the
+    browser's event loop thread) is kept for the job.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.lines = []
+        self.threads = set()
+        self._partial = ''
+
+    def write(self, text):
+        self.stream.write(text)
+        if threading.current_thread() not in self.threads:
+            return len(text)
+        lines = (self._partial + text).split('\n')
+        self._partial = lines.pop()
+        self.lines = (self.lines + lines)[-MAX_LOG_LINES:]
+        return len(text)
+
+    def flush(self):
+        self.stream.flush()
+
+class RefreshJob:
+    """One refresh run and its progress"""
+
+    def __init__(self, job_id=None):
+        self.id = job_id or f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+        self.state = 'running'
+        self.stages = {name: 'pending' for name in STAGES}
+        self.stage_seconds = {}
+        self.started = datetime.now()
+        self.finished = None
+        self.error = None
+        self.log = JobLog(sys.stdout)
+        self.done = threading.Event()
+        self._stage_start = None
+
+    @contextmanager
+    def stage(self, name):
+        """Mark a stage as running while the block runs, then done (or failed)"""
+        self.stages[name] = 'running'
+        self._stage_start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.stages[name] = 'failed'
+            raise
+        finally:
+            self.stage_seconds[name] = round(time.perf_counter() - self._stage_start, 1)
+        self.stages[name] = 'done'
+
+    def to_dict(self):
+        running = [name for name, status in self.stages.items() if status == 'running']
+        if running:
+            # Show how long the current stage has been going
+            self.stage_seconds[running[0]] = round(time.perf_counter() - self._stage_start, 1)
+
+        done = sum(status == 'done' for status in self.stages.values())
+        return {
+            'job_id': self.id,
+            'state': self.state,
+            'stages': dict(self.stages),
+            'stage_seconds': dict(self.stage_seconds),
+            'current_stage': running[0] if running else None,
+            'progress': round(done / len(self.stages), 2),
+            # Latest line the pipeline printed, e.g. "Scrolling to load all payment records..."
+            'message': next((line.strip() for line in reversed(self.log.lines) if line.strip()), None),
+            'started': self.started.strftime('%Y-%m-%d %H:%M:%S'),
+            'finished': self.finished.strftime('%Y-%m-%d %H:%M:%S') if self.finished else None,
+            'error': self.error,
+            'details': '\n'.join(self.log.lines[-40:]) if self.error else None,
+        }
+
+def run_refresh(job, browser=None):
+    """Export from Zeffy, merge into the master database and rebuild the dashboard data
+
+    `browser` is a ResidentBrowser to export with, or None to launch a fresh one.
+    """
+    # Group this refresh's stage metrics under the job id
+    pipeline_metrics.RUN_ID = job.id
+
+    pipeline.run_pipeline(browser=browser, track=job.stage)
+
+class ResidentBrowser:
+    """A BrowserPool plus the event loop it lives on
+
+    Playwright objects belong to the event loop that created them, so the
+    pool gets its own long-lived loop thread and exports are run on it.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name='browser-loop', daemon=True)
+        self.thread.start()
+        self.pool = zeffy_export.BrowserPool()
+
+    def run(self, coro):
+        """Run a coroutine on the browser's loop and wait for the result"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def close(self):
+        try:
+            self.run(self.pool.close())
+        finally:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+
+class RefreshService:
+    """Runs refresh jobs one at a time; concurrent requests share the running job"""
+
+    def __init__(self, lock_file=LOCK_FILE, keep_browser=KEEP_BROWSER):
+        self.lock_file = lock_file
+        self.browser = ResidentBrowser() if keep_browser else None
+        self._lock = threading.Lock()
+        self.current = None
+        self.jobs = {}
+
+    def start(self):
+        """Start a refresh, or return the one already running
+
+        Returns (job, started) where started is False if the request joined
+        a refresh that was already in flight.
+        """
+        with self._lock:
+            if self.current and not self.current.done.is_set():
+                return self.current, False
+
+            job = RefreshJob()
+            self.current = job
+            self.jobs[job.id] = job
+            for old_id in list(self.jobs)[:-MAX_JOB_HISTORY]:
+                del self.jobs[old_id]
+
+        threading.Thread(target=self._run, args=(job,), name=f'refresh-{job.id}', daemon=True).start()
+        return job, True
+
+    def _run(self, job):
+        job.log.threads = {threading.current_thread()}
+        if self.browser:
+            job.log.threads.add(self.browser.thread)
+        try:
+            # Only one job runs at a time, so capturing stdout here is safe
+            with redirect_stdout(job.log), refresh_lock(self.lock_file):
+                run_refresh(job, self.browser)
+            job.state = 'succeeded'
+        except Exception as e:
+            job.state = 'failed'
+            job.error = str(e) or type(e).__name__
+            traceback.print_exc()
+        finally:
+            job.finished = datetime.now()
+            job.done.set()
+            print(f"{job.finished:%Y-%m-%d %H:%M:%S}: Refresh {job.id} {job.state}"
+                  + (f" ({job.error})" if job.error else ''))
+
+    def get(self, job_id=None):
+        """Look up a job by id, or the current/most recent job"""
+        if job_id is None:
+            return self.current
+        return self.jobs.get(job_id)
+
+class RefreshHandler(BaseHTTPRequestHandler):
+    """JSON API for starting refreshes and checking on them"""
+
+    service = None
+
+    def send_json(self, data, status=200):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != '/refresh':
+            self.send_json({'error': 'Not found'}, 404)
+            return
+
+        job, started = self.service.start()
+        if parse_qs(url.query).get('wait', ['0'])[0] not in ('0', ''):
+            job.done.wait()
+        self.send_json({**job.to_dict(), 'joined': not started}, 202 if not job.done.is_set() else 200)
+
+    def do_GET(self):
+        path = urlparse(self.path).path.rstrip('/')
+        if path == '/status':
+            job = self.service.get()
+            self.send_json(job.to_dict() if job else {'state': 'idle'})
+        elif path.startswith('/status/'):
+            job = self.service.get(path[len('/status/'):])
+            if job:
+                self.send_json(job.to_dict())
+            else:
+                self.send_json({'error': 'Unknown job'}, 404)
+        else:
+            self.send_json({'error': 'Not found'}, 404)
+
+    def log_request(self, code='-', size='-'):
+        # Status polling would flood the log; only report failed requests
+        if int(getattr(code, 'value', code) if code != '-' else 0) >= 400:
+            super().log_request(code, size)
+
+def serve(host=HOST, port=PORT):
+    """Run the refresh service until interrupted"""
+    service = RefreshService()
+    RefreshHandler.service = service
+    server = ThreadingHTTPServer((host, port), RefreshHandler)
+    print(f"✓ Refresh daemon listening on http://{host}:{port}")
+
+    # Shut down cleanly (closing the resident browser) when systemd stops us
+    signal.signal(signal.SIGTERM, _interrupt)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nShutting down refresh daemon")
+    finally:
+        server.server_close()
+        if service.browser:
+            service.browser.close()
+
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+def trigger(host=HOST, port=PORT, timeout=600):
+    """Ask the running service to refresh and wait for it; returns the job status"""
+    request = urllib.request.Request(f'http://{host}:{port}/refresh?wait=1', data=b'', method='POST')
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.load(response)
+
+def run_once():
+    """Refresh in this process (no service needed)"""
+    job = RefreshJob()
+    with refresh_lock():
+        run_refresh(job)
+    return job
+
+def run_job(job_id, job_file=JOB_FILE):
+    """Refresh in this process, writing the job's progress to job_file
+
+    The file holds what GET /status/<job_id> would return (plus the pid), and
+    is rewritten as each stage starts and ends. Returns the finished job.
+    """
+    job = RefreshJob(job_id)
+    job.log.threads = {threading.current_thread()}
+
+    def save():
+        atomic_write(job_file, json.dumps({**job.to_dict(), 'pid': os.getpid()}))
+
+    @contextmanager
+    def tracked(name):
+        with job.stage(name):
+            save()
+            yield
+        save()
+
+    save()
+    try:
+        with redirect_stdout(job.log):
+            pipeline_metrics.RUN_ID = job.id
+            pipeline.run_pipeline(track=tracked)
+        job.state = 'succeeded'
+    except Exception as e:
+        job.state = 'failed'
+        job.error = str(e) or type(e).__name__
+        traceback.print_exc()
+    finally:
+        job.finished = datetime.now()
+        save()
+    return job
+
+if __name__ == "__main__":
+    try:
+        if '--trigger' in sys.argv:
+            job = trigger()
+            if job['state'] != 'succeeded':
+                print(f"✗ Refresh {job['job_id']} failed: {job['error']}")
+                sys.exit(1)
+            print(f"✓ Refresh {job['job_id']} succeeded" + (" (joined a running refresh)" if job['joined'] else ''))
+        elif '--job' in sys.argv:
+            job = run_job(sys.argv[sys.argv.index('--job') + 1])
+            print(f"{'✓' if job.state == 'succeeded' else '✗'} Refresh {job.id} {job.state}")
+            sys.exit(0 if job.state == 'succeeded' else 1)
+        elif '--once' in sys.argv:
+            job = run_once()
+            print(f"✓ Refresh {job.id} succeeded")
+        else:
+            serve()
+    except urllib.error.URLError as e:
+        print(f"✗ Refresh daemon not reachable at {HOST}:{PORT}: {e.reason}")
+        sys.exit(2)
+    except Exception as e:
+        print(f"✗ Error: {e}")
+        traceback.print_exc()
+        sys.exit(1)
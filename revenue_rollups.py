@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""
+Revenue Rollups
+===============
+Membership revenue, payment counts and unique payers per membership type,
+by day, week, month, quarter and year, kept up to date between runs
+
+The rollup table is stored as revenue_rollups.parquet next to the dashboard
+data. Each row is one period of one granularity for one membership type
+(plus an 'All' row per period, since a member paying for two types is still
+one payer). Any range at any granularity is a filter on this table rather
+than a groupby over the payments.
+
+Each row also carries a checksum of the payments in it. When the payments
+change (a merge appended new or updated ones), the day checksums are
+compared with the stored ones; only the days that differ, and the weeks,
+months, quarters and years containing them, are recomputed. After a normal
+refresh that is the last few weeks, plus the current quarter and year.
+
+A refresh knows the earliest payment date its merge touched. If the stored
+table was saved from the master as it stood before that merge, only the
+days from then on are checksummed; older days keep their stored checksums,
+and a period's checksum is the sum of its days'. Otherwise (a restore, the
+analysis run on its own, a failed run in between) every day is checked. The
+analysis publishes the week to year series as revenue_rollups.json for
+trends.html.
+
+Usage:
+    python revenue_rollups.py status                              # Rows and range per granularity
+    python revenue_rollups.py query month 2025-01-01 2025-12-31   # Periods starting in a range (start/end optional)
+    python revenue_rollups.py query quarter 2024-01-01 - Pro      # One membership type ('-' for no end)
+    python revenue_rollups.py rebuild                             # Recompute the whole table
+"""
+import os
+import sys
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from publish import atomic_path
+
+# Auto-detect environment
+if os.name == 'nt':  # Windows
+    ROLLUP_FILE = r'C:\Users\erin\CFL Member Dashboard\revenue_rollups.parquet'
+else:  # Linux/Server
+    ROLLUP_FILE = '/var/www/cfl-member-dashboard/exports/revenue_rollups.parquet'
+
+ROLLUPS_NAME = 'revenue_rollups.json'
+
+# Granularity -> pandas period frequency (weeks run Monday to Sunday)
+GRANULARITIES = {'day': 'D', 'week': 'W', 'month': 'M', 'quarter': 'Q', 'year': 'Y'}
+
+# Granularities published for the trend charts (days are only kept for queries)
+PUBLISHED_GRANULARITIES = ['week', 'month', 'quarter', 'year']
+
+ALL_TYPES = 'All'
+
+ROLLUP_COLUMNS = ['granularity', 'period', 'start', 'membership_type',
+                  'revenue', 'payments', 'payers', 'checksum']
+
+def row_checksums(memberships, columns):
+    """Per-payment hash, small enough that sums over any period don't overflow"""
+    hashes = pd.util.hash_pandas_object(memberships[columns], index=False).to_numpy()
+    return pd.Series((hashes >> np.uint64(33)).astype('int64'), index=memberships.index)
+
+def period_labels(periods, granularity):
+    """Labels for a PeriodIndex: '2025-06-02' (day, and a week's Monday), '2025-06', '2025Q2', '2025'"""
+    if granularity == 'week':
+        return periods.start_time.strftime('%Y-%m-%d')
+    return periods.astype(str)
+
+def aggregate(frame, periods, granularity, prepared):
+    """Rollup rows for one granularity from payments and their periods
+
+    Without a _checksum column on the payments the checksums are left at 0
+    for the caller to fill in.
+    """
+    contact_col, amount_col = prepared['contact_col'], prepared['amount_col']
+    frame = frame.assign(_period=periods)
+    if '_checksum' not in frame.columns:
+        frame['_checksum'] = 0
+
+    def summarize(keys):
+        grouped = frame.groupby(keys, observed=True, sort=False)
+        return grouped.agg(revenue=(amount_col, 'sum'), payments=('_checksum', 'size'),
+                           payers=(contact_col, 'nunique'), checksum=('_checksum', 'sum')).reset_index()
+
+    by_type = summarize(['_period', 'Membership Type'])
+    by_period = summarize(['_period']).assign(**{'Membership Type': ALL_TYPES})
+    rows = pd.concat([by_type, by_period], ignore_index=True)
+
+    periods = pd.PeriodIndex(rows['_period'])
+    return pd.DataFrame({
+        'granularity': granularity,
+        'period': period_labels(periods, granularity),
+        'start': periods.start_time,
+        'membership_type': rows['Membership Type'].astype(str),
+        'revenue': rows['revenue'].astype('float64'),
+        'payments': rows['payments'].astype('int64'),
+        'payers': rows['payers'].astype('int64'),
+        'checksum': rows['checksum'].astype('int64'),
+    })
+
+def dated_memberships(prepared, since=None):
+    """The membership payments that have a date (on or after `since` if given)"""
+    date_col = prepared['date_col']
+    memberships = prepared['memberships']
+    if since is not None:
+        return memberships[memberships[date_col] >= since]
+    return memberships[memberships[date_col].notna()]
+
+def rollup_frame(prepared, since=None):
+    """The dated membership payments (on or after `since` if given), with their checksums"""
+    date_col = prepared['date_col']
+    memberships = dated_memberships(prepared, since)
+    columns = [col for col in (date_col, prepared['contact_col'], 'Membership Type', prepared['amount_col'])
+               if col in memberships.columns]
+    return memberships.assign(_checksum=row_checksums(memberships, columns))
+
+def build_rollups(prepared, granularities=GRANULARITIES, since=None):
+    """Rollup rows from prepared payment data (see analyze_members.load_prepared)
+
+    With `since`, only periods starting at or after it are built (from the
+    payments made since then).
+    """
+    date_col = prepared['date_col']
+    frame = rollup_frame(prepared)
+    if since is not None:
+        frame = frame[frame[date_col] >= since]
+
+    parts = [aggregate(frame, frame[date_col].dt.to_period(GRANULARITIES[granularity]), granularity, prepared)
+             for granularity in granularities]
+    rollups = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=ROLLUP_COLUMNS)
+    if since is not None:
+        rollups = rollups[rollups['start'] >= since]
+    return sort_rollups(rollups)
+
+def sort_rollups(rollups):
+    order = {granularity: i for i, granularity in enumerate(GRANULARITIES)}
+    return rollups.sort_values(['granularity', 'start', 'membership_type'],
+                               key=lambda col: col.map(order) if col.name == 'granularity' else col,
+                               ignore_index=True)
+
+def day_checksums(frame, days):
+    """Payment count and checksum per day and membership type (plus 'All'), without payer counts"""
+    by_type = frame.groupby([days, frame['Membership Type']], observed=True)['_checksum'].agg(['size', 'sum'])
+    by_day = frame.groupby(days)['_checksum'].agg(['size', 'sum'])
+    day_rows = pd.concat([
+        by_type.reset_index().set_axis(['start', 'membership_type', 'payments', 'checksum'], axis=1),
+        by_day.reset_index().set_axis(['start', 'payments', 'checksum'], axis=1).assign(membership_type=ALL_TYPES),
+    ], ignore_index=True)
+    day_rows['membership_type'] = day_rows['membership_type'].astype(str)
+    return day_rows
+
+def changed_days(stored, day_rows):
+    """Days whose payments differ between stored and freshly computed day rows"""
+    key = ['start', 'membership_type']
+    stored = stored[key + ['payments', 'checksum']]
+    compared = stored.merge(day_rows[key + ['payments', 'checksum']], on=key, how='outer',
+                            suffixes=('_stored', ''), indicator=True)
+    differs = ((compared['_merge'] != 'both') |
+               (compared['payments_stored'] != compared['payments']) |
+               (compared['checksum_stored'] != compared['checksum']))
+    return pd.DatetimeIndex(compared.loc[differs, 'start'].unique())
+
+def update_rollups(prepared, rollup_file=None, since=None, basis=None, previous_basis=None):
+    """Bring the stored rollup table up to date with prepared payment data
+
+    Returns (rollups, days recomputed). Without a usable stored table the
+    whole table is built. `basis` identifies the payments (see
+    analyze_members.rollup_basis) and is saved with the table. With `since`,
+    the earliest payment date changed since `previous_basis`, only days from
+    then on are checked, if the stored table was saved with previous_basis.
+    """
+    rollup_path = Path(rollup_file or ROLLUP_FILE)
+    rollups = read_rollups(rollup_path)
+    if rollups is None:
+        rollups = build_rollups(prepared)
+        save_rollups(rollups, rollup_path, basis)
+        return rollups, int((rollups['granularity'] == 'day').sum())
+
+    if since is not None and (previous_basis is None or rollups.attrs.get('basis') != previous_basis):
+        since = None
+    since = pd.Timestamp(since).normalize() if since is not None else None
+
+    # Day checksums are cheap (no unique payer counts); they show what changed
+    date_col = prepared['date_col']
+    frame = rollup_frame(prepared, since)
+    day_rows = day_checksums(frame, frame[date_col].dt.normalize())
+    stored_days = rollups[rollups['granularity'] == 'day']
+    if since is not None:
+        # Older days are as the stored table has them
+        day_rows = pd.concat([stored_days.loc[stored_days['start'] < since, day_rows.columns], day_rows],
+                             ignore_index=True)
+
+    changed = changed_days(stored_days if since is None else stored_days[stored_days['start'] >= since], day_rows)
+    if changed.empty:
+        if rollups.attrs.get('basis') != basis:
+            save_rollups(rollups, rollup_path, basis)
+        return rollups, 0
+
+    # Recompute every period (at every granularity) that contains a changed day;
+    # a period's checksum is the sum of its days'
+    memberships = dated_memberships(prepared)
+    recomputed = []
+    stale = pd.Series(False, index=rollups.index)
+    for granularity, freq in GRANULARITIES.items():
+        starts = changed.to_period(freq).unique().start_time
+        recent = memberships[memberships[date_col] >= starts.min()]
+        rows = aggregate(recent, recent[date_col].dt.to_period(freq), granularity, prepared)
+        rows = rows[rows['start'].isin(starts)].reset_index(drop=True)
+
+        days = day_rows[day_rows['start'] >= starts.min()]
+        sums = days.groupby([days['start'].dt.to_period(freq).dt.start_time, 'membership_type'])['checksum'].sum()
+        rows['checksum'] = sums.reindex(pd.MultiIndex.from_frame(rows[['start', 'membership_type']])).to_numpy()
+        recomputed.append(rows.astype({'checksum': 'int64'}))
+        stale |= (rollups['granularity'] == granularity) & rollups['start'].isin(starts)
+
+    rollups = sort_rollups(pd.concat([rollups[~stale]] + recomputed, ignore_index=True))
+    save_rollups(rollups, rollup_path, basis)
+    return rollups, len(changed)
+
+def read_rollups(rollup_file=None):
+    """The stored rollup table, or None if there isn't a usable one"""
+    rollup_path = Path(rollup_file or ROLLUP_FILE)
+    if not rollup_path.exists():
+        return None
+    try:
+        rollups = pd.read_parquet(rollup_path)
+    except Exception as e:
+        print(f"⚠ Ignoring unreadable revenue rollups: {e}")
+        return None
+    return rollups if list(rollups.columns) == ROLLUP_COLUMNS else None
+
+def save_rollups(rollups, rollup_file=None, basis=None):
+    """Save the rollup table, noting the payments it was built from (see update_rollups)"""
+    rollups.attrs['basis'] = basis
+    with atomic_path(rollup_file or ROLLUP_FILE) as temp_path:
+        rollups.to_parquet(temp_path, index=False)
+
+def select(rollups, granularity='month', start=None, end=None, membership_type=None):
+    """Rollup rows of one granularity for periods starting between start and end (inclusive)"""
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"Unknown granularity {granularity!r} (one of {', '.join(GRANULARITIES)})")
+    rows = rollups[rollups['granularity'] == granularity]
+    if start is not None:
+        rows = rows[rows['start'] >= pd.Timestamp(start)]
+    if end is not None:
+        rows = rows[rows['start'] <= pd.Timestamp(end)]
+    if membership_type is not None:
+        rows = rows[rows['membership_type'] == membership_type]
+    return rows.drop(columns=['granularity', 'checksum']).reset_index(drop=True)
+
+def revenue_series(rollups, granularity='month', start=None, end=None, membership_type=ALL_TYPES):
+    """{period label: revenue} for a range, as the dashboard's monthly_trend"""
+    rows = select(rollups, granularity, start, end, membership_type)
+    return {period: float(revenue) for period, revenue in zip(rows['period'], rows['revenue'])}
+
+def rollups_document(rollups):
+    """The published granularities as chart-ready JSON (every period present, 0 when nothing was paid)"""
+    doc = {}
+    for granularity in PUBLISHED_GRANULARITIES:
+        rows = rollups[rollups['granularity'] == granularity]
+        if rows.empty:
+            doc[granularity] = {'periods': [], 'starts': [], 'revenue': {}, 'payers': {}}
+            continue
+        freq = GRANULARITIES[granularity]
+        periods = pd.period_range(rows['start'].min().to_period(freq), rows['start'].max().to_period(freq))
+        starts = periods.start_time
+        doc[granularity] = {
+            'periods': list(period_labels(periods, granularity)),
+            'starts': list(starts.strftime('%Y-%m-%d')),
+            'revenue': {}, 'payers': {},
+        }
+        for membership_type, type_rows in rows.groupby('membership_type'):
+            type_rows = type_rows.set_index('start')[['revenue', 'payers']].reindex(starts, fill_value=0)
+            doc[granularity]['revenue'][membership_type] = [round(float(value), 2) for value in type_rows['revenue']]
+            doc[granularity]['payers'][membership_type] = [int(value) for value in type_rows['payers']]
+    return doc
+
+def rollups_json(rollups):
+    return json.dumps(rollups_document(rollups), separators=(',', ':'))
+
+def rebuild(rollup_file=None):
+    from analyze_members import ANALYSIS_CACHE, get_latest_export_file, load_prepared
+
+    prepared = load_prepared(get_latest_export_file(), ANALYSIS_CACHE)
+    rollups = build_rollups(prepared)
+    save_rollups(rollups, rollup_file)
+    print(f"✓ Rebuilt {len(rollups)} rollup rows: {rollup_file or ROLLUP_FILE}")
+
+def status(rollup_file=None):
+    rollups = read_rollups(rollup_file)
+    if rollups is None:
+        print(f"⚠ No revenue rollups yet in {rollup_file or ROLLUP_FILE}")
+        return
+    for granularity in GRANULARITIES:
+        rows = select(rollups, granularity, membership_type=ALL_TYPES)
+        if len(rows):
+            print(f"  {granularity:>8}: {len(rows)} periods, {rows['period'].iloc[0]} → {rows['period'].iloc[-1]}, "
+                  f"${rows['revenue'].sum():,.2f}")
+
+def query(granularity='month', start=None, end=None, membership_type=None):
+    rollups = read_rollups()
+    if rollups is None:
+        raise FileNotFoundError(f"No revenue rollups in {ROLLUP_FILE} (run the analysis or 'rebuild')")
+    rows = select(rollups, granularity, None if start == '-' else start, None if end == '-' else end,
+                  membership_type)
+    print(rows.drop(columns=['start']).to_string(index=False, float_format=lambda value: f'{value:,.2f}'))
+
+if __name__ == "__main__":
+    commands = {'status': status, 'query': query, 'rebuild': rebuild}
+    if len(sys.argv) < 2 or sys.argv[1] not in commands:
+        print(__doc__)
+        sys.exit(1)
+
+    try:
+        commands[sys.argv[1]](*sys.argv[2:])
+    except Exception as e:
+        print(f"✗ Error: {e}")
+        sys.exit(1)
@@ -3,39 +3,383 @@ Dashboard Server
 ================
 Runs a local web server to host the CFL Member Dashboard
 
+Files are served from memory: each is read once and kept until its mtime or
+size changes. Text files (HTML, JSON, JS, CSS) are compressed once per
+version, with gzip or brotli (if the brotli module is installed) depending on
+what the browser accepts. A fresh `.gz` file next to the original (e.g.
+dashboard_data.json.gz) is used as-is. Responses carry an ETag. The
+dashboard page and its data get "Cache-Control: no-cache" and images get an
+hour. A matching If-None-Match (or an If-Modified-Since no older than the
+file) gets 304 Not Modified, so the dashboard's polls cost next to nothing
+while the data hasn't changed.
+
+Only the dashboard pages, the logo and the published JSON in exports/ are
+served; everything else (cookies, .env, the cache and the master store next
+to them) is a 404. The server listens on 127.0.0.1 unless told otherwise.
+
+Live updates: /events is a Server-Sent Events stream. The server watches
+exports/dashboard_data.json and, the moment a new version is published,
+sends every connected dashboard an "update" event, so they fetch once per
+real update instead of polling. One watcher serves all connections.
+
 Usage:
-    python run_dashboard.py
+    python run_dashboard.py                                             # This computer only
+    python run_dashboard.py --host 0.0.0.0 --no-browser                 # Kiosks and phones on the network
+    python run_dashboard.py --port 8000 --no-browser                    # Behind nginx
 """
 
 import http.server
 import socketserver
 import webbrowser
+import argparse
+import threading
+import email.utils
+import gzip
+import json
+import io
 import os
+import re
+import posixpath
+from collections import OrderedDict
 from pathlib import Path
+from urllib.parse import unquote, urlparse
+
+try:
+    import brotli
+except ImportError:  # Optional: gzip only
+    brotli = None
 
 PORT = 8000
 DIRECTORY = Path(__file__).parent
 
+# What may be served (paths relative to DIRECTORY); "/" is the dashboard
+PUBLIC_FILES = {'dashboard.html', 'dashboard_compact.html', 'dashboard_full.html', 'trends.html', 'cfl-logo.webp'}
+PUBLIC_PATTERN = re.compile(r'exports/[A-Za-z0-9_-][A-Za-z0-9_.-]*\.json')
+INDEX_FILE = 'dashboard.html'
+
+# The file whose changes are pushed to connected dashboards
+DATA_FILE = DIRECTORY / 'exports' / 'dashboard_data.json'
+
+# How often the data file is checked, and how often idle streams get a keepalive
+WATCH_INTERVAL = 1.0
+KEEPALIVE_SECONDS = 15
+
+# In-memory file cache limits (bigger files are streamed from disk)
+MAX_CACHED_FILE_BYTES = 8 * 1024 * 1024
+MAX_CACHE_BYTES = 64 * 1024 * 1024
+
+# Worth compressing, and how long browsers may reuse a file without asking
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript', 'image/svg+xml')
+LONG_CACHE_SUFFIXES = {'.jpg', '.jpeg', '.png', '.gif', '.ico', '.css', '.js', '.webp'}
+
+def file_etag(path):
+    """ETag for a file from its modification time and size (like nginx's)"""
+    stat = os.stat(path)
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+def public_path(url):
+    """The file a URL may serve (relative to DIRECTORY), or None if it isn't public"""
+    path = posixpath.normpath(unquote(urlparse(url).path)).lstrip('/')
+    if path in ('', '.'):
+        return INDEX_FILE
+    if path in PUBLIC_FILES or PUBLIC_PATTERN.fullmatch(path):
+        return path
+    return None
+
+def accepted_encodings(header):
+    """Content codings the browser accepts, from its Accept-Encoding header"""
+    encodings = set()
+    for item in (header or '').split(','):
+        name, _, params = item.strip().partition(';')
+        if params.strip().replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            continue
+        if name:
+            encodings.add(name.strip().lower())
+    return encodings
+
+class CachedFile:
+    """A file's bytes and headers, plus compressed copies made on first request"""
+
+    def __init__(self, path, signature, content_type):
+        self.path = path
+        self.signature = signature
+        self.content_type = content_type
+        self.etag = f'"{signature[0]:x}-{signature[1]:x}"'
+        self.last_modified = email.utils.formatdate(signature[0] / 1e9, usegmt=True)
+        self.compressible = content_type.startswith(COMPRESSIBLE_TYPES)
+        with open(path, 'rb') as f:
+            self.variants = {'identity': f.read()}
+        self.lock = threading.Lock()
+
+    @property
+    def size(self):
+        return sum(len(body) for body in self.variants.values())
+
+    def body(self, encoding):
+        """The file in an encoding ('identity', 'gzip' or 'br'), compressing it once"""
+        with self.lock:
+            if encoding not in self.variants:
+                self.variants[encoding] = self.compress(encoding)
+            return self.variants[encoding]
+
+    def compress(self, encoding):
+        raw = self.variants['identity']
+        if encoding == 'br':
+            return brotli.compress(raw)
+
+        # Use a precompressed copy if one was written with (or after) this version
+        gz_path = self.path + '.gz'
+        try:
+            if os.stat(gz_path).st_mtime_ns >= self.signature[0]:
+                with open(gz_path, 'rb') as f:
+                    return f.read()
+        except OSError:
+            pass
+        return gzip.compress(raw, compresslevel=6, mtime=0)
+
+class FileCache:
+    """Recently served files, dropped when they change on disk or the cache is full"""
+
+    def __init__(self, max_bytes=MAX_CACHE_BYTES, max_file_bytes=MAX_CACHED_FILE_BYTES):
+        self.max_bytes = max_bytes
+        self.max_file_bytes = max_file_bytes
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, path, content_type):
+        """The cached file, (re)reading it if it changed; None if it's missing or too big"""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        if not os.path.isfile(path) or stat.st_size > self.max_file_bytes:
+            return None
+
+        signature = (stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is not None and entry.signature == signature:
+                self.entries.move_to_end(path)
+                return entry
+
+        entry = CachedFile(path, signature, content_type)
+        with self.lock:
+            self.entries[path] = entry
+            self.entries.move_to_end(path)
+            while len(self.entries) > 1 and sum(cached.size for cached in self.entries.values()) > self.max_bytes:
+                self.entries.popitem(last=False)
+        return entry
+
+FILE_CACHE = FileCache()
+
+class DataWatcher(threading.Thread):
+    """Watches the dashboard data file and wakes every event stream when it changes"""
+
+    def __init__(self, path=DATA_FILE, interval=WATCH_INTERVAL):
+        super().__init__(name='data-watcher', daemon=True)
+        self.path = Path(path)
+        self.interval = interval
+        self.changed = threading.Condition()
+        self.generation = 0
+        self.info = {}
+        self.signature = self.file_signature()
+        self.stopped = threading.Event()
+
+    def file_signature(self):
+        try:
+            stat = self.path.stat()
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def published_version(self):
+        """Version and etag of the published document (if it has them)"""
+        try:
+            with open(self.path, 'r') as f:
+                doc = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return {key: doc[key] for key in ('version', 'etag') if key in doc}
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            signature = self.file_signature()
+            if signature is None or signature == self.signature:
+                continue
+            self.signature = signature
+            info = self.published_version()
+            with self.changed:
+                self.generation += 1
+                self.info = info
+                self.changed.notify_all()
+
+    def wait_for_change(self, generation, timeout):
+        """Block until the generation moves past `generation` (or timeout); returns (generation, info)"""
+        with self.changed:
+            self.changed.wait_for(lambda: self.generation != generation, timeout)
+            return self.generation, self.info
+
 class MyHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
+    watcher = None
+
     def __init__(self, *args, **kwargs):
+        self.etag = None
         super().__init__(*args, directory=str(DIRECTORY), **kwargs)
 
+    def do_GET(self):
+        if urlparse(self.path).path == '/events' and self.watcher:
+            self.stream_events()
+        else:
+            super().do_GET()
+
+    def stream_events(self):
+        """Server-Sent Events: an "update" event whenever new dashboard data is published"""
+        self.close_connection = True
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('X-Accel-Buffering', 'no')  # Tell nginx not to buffer the stream
+        self.end_headers()
+
+        generation = self.watcher.generation
+        try:
+            self.wfile.write(b'retry: 5000\n\n')
+            self.wfile.flush()
+            while True:
+                latest, info = self.watcher.wait_for_change(generation, KEEPALIVE_SECONDS)
+                if latest != generation:
+                    generation = latest
+                    self.wfile.write(f'event: update\ndata: {json.dumps(info)}\n\n'.encode('utf-8'))
+                else:
+                    self.wfile.write(b': keepalive\n\n')
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # The dashboard went away
+
+    def send_head(self):
+        self.etag = None
+        public = public_path(self.path)
+        if public is None:
+            self.send_error(404, "File not found")
+            return None
+        self.path = '/' + public
+        path = self.translate_path(self.path)
+        entry = FILE_CACHE.get(path, self.guess_type(path))
+        if entry is not None:
+            return self.send_cached(entry)
+
+        # Big files: SimpleHTTPRequestHandler (which handles If-Modified-Since)
+        # plus ETags
+        self.etag = file_etag(path) if os.path.isfile(path) else None
+        if self.etag:
+            if_none_match = self.headers.get('If-None-Match')
+            if if_none_match and (if_none_match.strip() == '*' or
+                                  self.etag in [tag.strip() for tag in if_none_match.split(',')]):
+                self.send_response(304)
+                self.end_headers()
+                return None
+        return super().send_head()
+
+    def send_cached(self, entry):
+        """Send the headers for a cached file; returns its body to copy out"""
+        encoding = 'identity'
+        if entry.compressible:
+            accepted = accepted_encodings(self.headers.get('Accept-Encoding'))
+            if brotli and 'br' in accepted:
+                encoding = 'br'
+            elif 'gzip' in accepted:
+                encoding = 'gzip'
+        etag = entry.etag if encoding == 'identity' else f'{entry.etag[:-1]}-{encoding}"'
+
+        suffix = os.path.splitext(entry.path)[1].lower()
+        headers = {
+            'ETag': etag,
+            'Last-Modified': entry.last_modified,
+            'Cache-Control': 'public, max-age=3600' if suffix in LONG_CACHE_SUFFIXES else 'no-cache',
+        }
+        if entry.compressible:
+            headers['Vary'] = 'Accept-Encoding'
+
+        if self.not_modified(entry, etag):
+            self.send_response(304)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            return None
+
+        body = entry.body(encoding)
+        self.send_response(200)
+        self.send_header('Content-Type', entry.content_type)
+        self.send_header('Content-Length', str(len(body)))
+        if encoding != 'identity':
+            self.send_header('Content-Encoding', encoding)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        return io.BytesIO(body)
+
+    def not_modified(self, entry, etag):
+        """Check the request's validators against a cached file"""
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match:
+            tags = [tag.strip() for tag in if_none_match.split(',')]
+            return '*' in tags or etag in tags or entry.etag in tags
+
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since:
+            try:
+                since = email.utils.parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+            return int(entry.signature[0] / 1e9) <= since
+        return False
+
+    def end_headers(self):
+        if self.etag:
+            self.send_header('ETag', self.etag)
+            self.send_header('Cache-Control', 'no-cache')
+        super().end_headers()
+
+class DashboardServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    """One thread per connection, so open event streams don't block page loads"""
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 64  # Room for many displays (re)connecting at once
+
 def main():
+    parser = argparse.ArgumentParser(description='Serve the CFL Member Dashboard')
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='Address to listen on (default 127.0.0.1; 0.0.0.0 for other devices)')
+    parser.add_argument('--port', type=int, default=PORT, help=f'Port to listen on (default {PORT})')
+    parser.add_argument('--no-browser', action='store_true', help="Don't open a browser")
+    args = parser.parse_args()
+
     os.chdir(DIRECTORY)
 
-    with socketserver.TCPServer(("", PORT), MyHTTPRequestHandler) as httpd:
-        url = f"http://localhost:{PORT}/dashboard.html"
+    watcher = DataWatcher()
+    watcher.start()
+    MyHTTPRequestHandler.watcher = watcher
+
+    with DashboardServer((args.host, args.port), MyHTTPRequestHandler) as httpd:
+        url = f"http://localhost:{args.port}/dashboard.html"
         print(f"🚀 Dashboard server running!")
         print(f"📊 Open your browser to: {url}")
+        print(f"🔔 Live updates when {DATA_FILE.relative_to(DIRECTORY)} changes")
         print(f"Press Ctrl+C to stop the server\n")
 
         # Try to open browser automatically
+        if not args.no_browser:
+            try:
+                webbrowser.open(url)
+            except:
+                pass
+
         try:
-            webbrowser.open(url)
-        except:
+            httpd.serve_forever()
+        except KeyboardInterrupt:
             pass
-
-        httpd.serve_forever()
+        finally:
+            watcher.stopped.set()
 
 if __name__ == "__main__":
     main()
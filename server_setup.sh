@@ -32,7 +32,7 @@ sudo apt install -y python3 python3-pip nginx
 # Install Python packages
 echo ""
 echo "Step 3: Installing Python packages..."
-pip3 install playwright pandas openpyxl python-dotenv
+pip3 install playwright pandas openpyxl pyarrow python-dotenv
 
 # Install Playwright browser
 echo ""
@@ -77,26 +77,33 @@ server {
     root $INSTALL_DIR;
     index dashboard.html;
 
+    # Only the dashboard pages, the logo and the published data are public.
+    # Cookies, .env, the analysis cache and the master store sit in the same
+    # folder, so everything else is a 404.
     location / {
-        try_files \$uri \$uri/ =404;
+        return 404;
+    }
+
+    location = / {
+        try_files /dashboard.html =404;
         add_header Cache-Control "no-cache, must-revalidate";
     }
 
-    # Cache static assets
-    location ~* \.(jpg|jpeg|png|gif|ico|css|js|webp)$ {
-        expires 1h;
-        add_header Cache-Control "public, immutable";
+    location ~ ^/(dashboard|dashboard_compact|dashboard_full|trends)\.html$ {
+        add_header Cache-Control "no-cache, must-revalidate";
     }
 
-    # Prevent access to sensitive files
-    location ~ /\.(env|git) {
-        deny all;
-        return 404;
+    # Dashboard data: always revalidate, so unchanged polls get a 304 with no body
+    location ~ ^/exports/[A-Za-z0-9_-][A-Za-z0-9_.-]*\.json$ {
+        etag on;
+        if_modified_since exact;
+        gzip_static on;  # Serves the dashboard_data.json.gz written alongside
+        add_header Cache-Control "no-cache";
     }
 
-    location ~ \.(py|sh)$ {
-        deny all;
-        return 404;
+    location = /cfl-logo.webp {
+        expires 1h;
+        add_header Cache-Control "public, immutable";
     }
 }
 EOF
@@ -123,22 +130,27 @@ LOG_FILE="/var/log/cfl-dashboard.log"
 
 echo "$(date): Starting dashboard update..." >> "$LOG_FILE"
 
-# Run Zeffy export
-python3 zeffy_export.py >> "$LOG_FILE" 2>&1
-
-if [ $? -eq 0 ]; then
-    echo "$(date): Zeffy export successful" >> "$LOG_FILE"
+# Group this run's stage metrics (see pipeline_metrics.py)
+export REFRESH_RUN_ID=$(date +%Y%m%d-%H%M%S)
+
+# Let the refresh daemon do it (shares a refresh already in progress)
+python3 refresh_daemon.py --trigger >> "$LOG_FILE" 2>&1
+STATUS=$?
+if [ $STATUS -eq 0 ]; then
+    echo "$(date): Dashboard update completed successfully" >> "$LOG_FILE"
+    exit 0
+elif [ $STATUS -ne 2 ]; then
+    echo "$(date): ERROR - refresh failed (see refresh daemon log above)" >> "$LOG_FILE"
+    exit 1
+fi
 
-    # Process data
-    python3 analyze_members.py >> "$LOG_FILE" 2>&1
+# Daemon not running: run the pipeline (export, merge, analyze) directly
+python3 pipeline.py >> "$LOG_FILE" 2>&1
 
-    if [ $? -eq 0 ]; then
-        echo "$(date): Dashboard update completed successfully" >> "$LOG_FILE"
-    else
-        echo "$(date): ERROR - analyze_members.py failed" >> "$LOG_FILE"
-    fi
+if [ $? -eq 0 ]; then
+    echo "$(date): Dashboard update completed successfully" >> "$LOG_FILE"
 else
-    echo "$(date): ERROR - zeffy_export.py failed" >> "$LOG_FILE"
+    echo "$(date): ERROR - pipeline.py failed" >> "$LOG_FILE"
 fi
 EOF
 
@@ -148,9 +160,32 @@ chmod +x $INSTALL_DIR/update_dashboard.sh
 sudo touch /var/log/cfl-dashboard.log
 sudo chown $USER:$USER /var/log/cfl-dashboard.log
 
+# Set up refresh daemon
+echo ""
+echo "Step 8: Installing refresh daemon service..."
+sudo tee /etc/systemd/system/cfl-refresh.service > /dev/null << EOF
+[Unit]
+Description=CFL Dashboard refresh daemon
+After=network-online.target
+
+[Service]
+User=$USER
+WorkingDirectory=$INSTALL_DIR
+ExecStart=/usr/bin/python3 $INSTALL_DIR/refresh_daemon.py
+Restart=on-failure
+StandardOutput=append:/var/log/cfl-dashboard.log
+StandardError=append:/var/log/cfl-dashboard.log
+
+[Install]
+WantedBy=multi-user.target
+EOF
+
+sudo systemctl daemon-reload
+sudo systemctl enable --now cfl-refresh
+
 # Set up cron job
 echo ""
-echo "Step 8: Setting up cron job (runs every 6 hours)..."
+echo "Step 9: Setting up cron job (runs every 6 hours)..."
 CRON_CMD="0 */6 * * * $INSTALL_DIR/update_dashboard.sh"
 
 # Check if cron job already exists
@@ -160,7 +195,7 @@ echo "Cron job added successfully"
 
 # Run initial data collection
 echo ""
-echo "Step 9: Running initial data collection..."
+echo "Step 10: Running initial data collection..."
 echo "This may take a minute..."
 
 python3 zeffy_export.py
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Synthetic Zeffy Export Generator
+================================
+Writes realistic Zeffy-shaped payment exports for benchmarking and testing
+without touching real member data or the network
+
+Members join at random points over the history, pay monthly until they
+quit (or until today), and end with a Stopped or Past due recurring status
+when they quit. A share of payments are donations/workshops rather than
+memberships, and a few payments fail.
+
+Usage:
+    python synthetic_zeffy.py --members 500 --years 3 --output exports/zeffy-payments-synthetic.xlsx
+    python synthetic_zeffy.py --rows 1000000 --output synthetic.parquet
+"""
+import argparse
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+FIRST_NAMES = ['Alex', 'Sam', 'Jordan', 'Taylor', 'Morgan', 'Casey', 'Riley', 'Jamie', 'Avery', 'Quinn',
+               'Maria', 'David', 'Sarah', 'James', 'Linda', 'Robert', 'Emily', 'Michael', 'Grace', 'Daniel']
+LAST_NAMES = ['Smith', 'Johnson', 'Garcia', 'Brown', 'Lee', 'Martinez', 'Davis', 'Lopez', 'Wilson', 'Nguyen',
+              'Clark', 'Lewis', 'Walker', 'Hall', 'Young', 'King', 'Wright', 'Scott', 'Green', 'Baker']
+
+# Details text, amount and share of members for each kind of payer
+PAYER_KINDS = [
+    ('Basic Membership - Monthly', 35.0, 0.50),
+    ('Pro Membership - Monthly', 75.0, 0.28),
+    ('Volunteer Membership', 10.0, 0.10),
+    ('Donation', 50.0, 0.07),
+    ('Workshop: Intro to Laser Cutting', 45.0, 0.05),
+]
+
+COLUMNS = ['Payment Date (UTC)', 'Email', 'First Name', 'Last Name', 'Details',
+           'Payment Status', 'Recurring Status', 'Total Amount']
+
+def rows_to_members(rows, years):
+    """Roughly how many members produce `rows` payments over `years` of history"""
+    # Members pay monthly for about 30% of the history on average
+    return max(1, int(rows / (years * 12 * 0.3)))
+
+def generate_payments(members=500, years=3, seed=0, now=None):
+    """Generate a Zeffy-shaped payments DataFrame, newest payments first"""
+    rng = np.random.default_rng(seed)
+    now = now or datetime.now().replace(microsecond=0)
+    history_days = int(years * 365)
+
+    # Per-member attributes
+    kinds = rng.choice(len(PAYER_KINDS), size=members, p=[kind[2] for kind in PAYER_KINDS])
+    join_day = rng.integers(0, history_days, size=members)  # Days before now
+    tenure_days = rng.exponential(scale=history_days * 0.5, size=members).astype(int)
+    quit = tenure_days < join_day
+    payment_days = np.minimum(tenure_days, join_day)
+    payment_counts = payment_days // 30 + 1
+
+    first = np.array(FIRST_NAMES)[rng.integers(0, len(FIRST_NAMES), size=members)]
+    last = np.array(LAST_NAMES)[rng.integers(0, len(LAST_NAMES), size=members)]
+    emails = np.char.add(np.char.add(np.char.lower(np.char.add(np.char.add(first, '.'), last)),
+                                     np.arange(members).astype(str)), '@example.org')
+
+    # One row per payment: member m pays every ~30 days from their join date
+    member = np.repeat(np.arange(members), payment_counts)
+    nth = np.arange(len(member)) - np.repeat(np.cumsum(payment_counts) - payment_counts, payment_counts)
+    is_last = nth == payment_counts[member] - 1
+    days_ago = join_day[member] - nth * 30
+    seconds_ago = days_ago * 86400 - rng.integers(0, 86400, size=len(member))
+    dates = pd.Timestamp(now) - pd.to_timedelta(np.maximum(seconds_ago, 0), unit='s')
+
+    # Quitters end on Stopped (cancelled) or Past due (card stopped working)
+    recurring = np.full(len(member), 'Active', dtype=object)
+    quit_status = np.where(rng.random(members) < 0.7, 'Stopped', 'Past due')
+    recurring[is_last & quit[member]] = quit_status[member[is_last & quit[member]]]
+    late_now = is_last & ~quit[member] & (rng.random(len(member)) < 0.04)
+    recurring[late_now] = 'Past due'
+
+    details = np.array([kind[0] for kind in PAYER_KINDS], dtype=object)[kinds[member]]
+    amounts = np.array([kind[1] for kind in PAYER_KINDS])[kinds[member]]
+    one_off = kinds[member] >= 3
+    recurring[one_off] = None
+
+    status = np.where(rng.random(len(member)) < 0.97, 'Succeeded', 'Failed')
+
+    df = pd.DataFrame({
+        'Payment Date (UTC)': dates,
+        'Email': emails[member],
+        'First Name': first[member],
+        'Last Name': last[member],
+        'Details': details,
+        'Payment Status': status,
+        'Recurring Status': recurring,
+        'Total Amount': amounts,
+    }, columns=COLUMNS)
+
+    return df.sort_values('Payment Date (UTC)', ascending=False, kind='mergesort').reset_index(drop=True)
+
+def write_export(df, output_path):
+    """Write payments as an Excel export (like Zeffy's "CSV") or Parquet"""
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    if output_path.suffix == '.parquet':
+        df.to_parquet(output_path, index=False)
+    else:
+        # Zeffy "CSV" exports are actually Excel files
+        df.to_excel(output_path, index=False, engine='openpyxl')
+    return output_path
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Generate a synthetic Zeffy payments export')
+    parser.add_argument('--members', type=int, help='Number of payers (default 500)')
+    parser.add_argument('--rows', type=int, help='Approximate number of payment rows (instead of --members)')
+    parser.add_argument('--years', type=float, default=3, help='Years of payment history (default 3)')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed (default 0)')
+    parser.add_argument('--output', default='zeffy-payments-synthetic.xlsx', help='.xlsx/.csv (Excel) or .parquet')
+    args = parser.parse_args()
+
+    members = args.members or (rows_to_members(args.rows, args.years) if args.rows else 500)
+    df = generate_payments(members, args.years, args.seed)
+    path = write_export(df, args.output)
+    print(f"✓ Wrote {len(df):,} payments for {members:,} payers to {path}")
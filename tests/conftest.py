@@ -0,0 +1,24 @@
+"""Shared fixtures: the repo's modules on the path, and every output file kept in a temp folder"""
+import sys
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import pipeline_metrics
+from synthetic_zeffy import generate_payments
+
+NOW = datetime(2026, 10, 10, 15, 0)
+
+@pytest.fixture(autouse=True)
+def metrics_files(tmp_path, monkeypatch):
+    """Stage metrics go to the test's folder, never the server's exports"""
+    monkeypatch.setattr(pipeline_metrics, 'METRICS_FILE', str(tmp_path / 'pipeline_metrics.jsonl'))
+    monkeypatch.setattr(pipeline_metrics, 'LAST_RUN_FILE', str(tmp_path / 'last_run_metrics.json'))
+
+@pytest.fixture(scope='session')
+def payments():
+    """A small synthetic payment history (about 200 payers over two years)"""
+    return generate_payments(members=200, years=2, seed=1, now=NOW)
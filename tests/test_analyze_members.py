@@ -0,0 +1,61 @@
+import pandas as pd
+import pytest
+
+import analyze_members
+import kpi_history
+from analyze_members import (categorize_membership, categorize_memberships, end_of_day, build_dashboard,
+                             load_prepared, prepare_payments)
+from master_store import ANALYSIS_COLUMNS, prune_payments, save_master
+
+@pytest.mark.parametrize('details, expected', [
+    ('Basic Membership - Monthly', 'Basic'),
+    ('Pro Membership - Monthly', 'Pro'),
+    ('Professional membership', 'Pro'),
+    ('Basic Pro bundle', 'Basic'),      # Basic is listed first, so it wins...
+    ('Pro upgrade from BASIC', 'Basic'),  # ...wherever it appears in the text
+    ('Volunteer (pro bono)', 'Pro'),
+    ('VOLUNTEER Membership', 'Volunteer'),
+    ('Donation', None),
+    (None, None),
+])
+def test_classifier_precedence(details, expected):
+    assert categorize_membership(details) == expected
+    assert categorize_memberships(pd.Series([details], dtype=object)).iloc[0] == expected
+
+def test_cache_reused_until_input_changes(tmp_path, payments):
+    store = tmp_path / 'payment_history_master.parquet'
+    cache = tmp_path / 'analysis_cache.pkl'
+    save_master(payments, store)
+
+    assert load_prepared(store, cache)['cache_hit'] is False
+    assert load_prepared(store, cache)['cache_hit'] is True
+    save_master(payments.iloc[1:], store)
+    assert load_prepared(store, cache)['cache_hit'] is False
+
+    # Payments handed over in memory are keyed on their contents too
+    assert load_prepared(store, cache, payments=payments)['cache_hit'] is False
+    assert load_prepared(store, cache, payments=payments.copy())['cache_hit'] is True
+    changed = payments.copy()
+    changed.loc[changed.index[0], 'Recurring Status'] = 'Stopped'
+    assert load_prepared(store, cache, payments=changed)['cache_hit'] is False
+
+def test_cache_misses_when_rules_change(tmp_path, payments, monkeypatch):
+    store = tmp_path / 'payment_history_master.parquet'
+    cache = tmp_path / 'analysis_cache.pkl'
+    save_master(payments, store)
+    load_prepared(store, cache)
+
+    rules = analyze_members.MEMBERSHIP_RULES[::-1]
+    monkeypatch.setattr(analyze_members, 'MEMBERSHIP_PATTERN', analyze_members.compile_membership_pattern(rules))
+    assert load_prepared(store, cache)['cache_hit'] is False
+
+def test_backfill_matches_as_of_runs(payments):
+    payments = prune_payments(payments, ANALYSIS_COLUMNS)
+    daily = kpi_history.backfill(prepare_payments(payments.copy()), '2025-01-01', '2026-10-10')
+
+    for day in ['2025-01-01', '2025-02-28', '2025-07-15', '2025-12-31', '2026-03-01', '2026-10-10']:
+        as_of = end_of_day(pd.Timestamp(day).date())
+        data = build_dashboard(prepare_payments(payments.copy(), as_of), as_of)
+        row = daily.loc[pd.Timestamp(day)]
+        assert [data[kpi] for kpi in kpi_history.KPI_COLUMNS[:-1]] == row[kpi_history.KPI_COLUMNS[:-1]].astype(int).tolist()
+        assert data['projected_revenue'] == pytest.approx(row['projected_revenue'])
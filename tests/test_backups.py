@@ -0,0 +1,54 @@
+from datetime import datetime, timedelta
+
+import backups
+from backups import restore, select_retained, snapshot
+from master_store import append_master, delta_files, load_master, save_master
+
+def test_retention_keeps_newest_per_bucket():
+    now = datetime(2026, 10, 10, 12, 0)
+    times = [now - timedelta(minutes=20 * i) for i in range(24 * 3 * 4)]  # Every 20 minutes for four days
+    keep = select_retained(times, now, retention={'hourly': 6, 'daily': 3}, keep_last=2)
+
+    assert set(sorted(times)[-2:]) <= keep
+    hourly = [t for t in keep if t >= now - timedelta(hours=6)]
+    assert len({t.strftime('%Y-%m-%d %H') for t in hourly}) == len(hourly)
+    # Older than the daily window: nothing kept
+    assert all(t >= now - timedelta(days=3) for t in keep)
+
+def test_restore_rebuilds_store_and_can_be_undone(tmp_path, payments):
+    store = tmp_path / 'payment_history.parquet'
+    first, second = payments.iloc[:500], payments.iloc[500:600]
+    save_master(first, store)
+    append_master(second, store)
+    snapshot(store, when=datetime(2026, 10, 1))
+    before = load_master(store)
+
+    append_master(payments.iloc[600:], store)
+    newer = load_master(store)
+    restore('2026-10-01', store_path=store)
+
+    # One base file holding exactly the snapshot's payments, no stale deltas
+    assert delta_files(store) == []
+    assert len(load_master(store)) == len(before)
+    assert [p.name for p in tmp_path.iterdir() if p.name.startswith('.')] == []
+    assert not any(p.name.startswith('restore-') for p in backups.backup_folder(store).iterdir())
+
+    # The restore snapshotted the newer master first, so it can be undone
+    undone = restore(datetime.now().isoformat(timespec='seconds'), store_path=store, output_path=tmp_path / 'undone.parquet')
+    assert len(load_master(undone)) == len(newer)
+
+def test_unchanged_files_are_not_rehashed(tmp_path, payments, monkeypatch):
+    store = tmp_path / 'payment_history.parquet'
+    save_master(payments.iloc[:500], store)
+    snapshot(store, when=datetime(2026, 10, 1))
+
+    hashed = []
+    real_digest = backups.file_digest
+    monkeypatch.setattr(backups, 'file_digest', lambda path: hashed.append(path.name) or real_digest(path))
+    append_master(payments.iloc[500:600], store)
+    entry = snapshot(store, when=datetime(2026, 10, 2))
+
+    # Only the new delta was read; the base file's hash came from the manifest
+    assert hashed == [entry['files'][1]['name']]
+    assert entry['files'][0]['sha256'] == backups.file_digest(store)
+    assert snapshot(store) is None
@@ -0,0 +1,43 @@
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+from analyze_members import prepare_payments
+from cohorts import cohort_table
+
+def payment(email, when, details, amount):
+    return {'Payment Date (UTC)': datetime.fromisoformat(when), 'Email': email, 'Details': details,
+            'Payment Status': 'Succeeded', 'Recurring Status': 'Active', 'Total Amount': amount}
+
+@pytest.fixture
+def cohorts():
+    rows = [
+        payment('a@example.org', '2026-01-05', 'Basic Membership - Monthly', 10.0),
+        payment('a@example.org', '2026-02-05', 'Basic Membership - Monthly', 10.0),
+        payment('a@example.org', '2026-03-05', 'Basic Membership - Monthly', 10.0),
+        payment('b@example.org', '2026-01-20', 'Pro Membership - Monthly', 20.0),
+        payment('c@example.org', '2026-02-10', 'Basic Membership - Monthly', 10.0),
+        payment('c@example.org', '2026-03-10', 'Basic Membership - Monthly', 10.0),
+        payment('c@example.org', '2026-03-12', 'Donation', 50.0),  # Not a membership payment
+    ]
+    return prepare_payments(pd.DataFrame(rows))['cohorts']
+
+def test_cohort_matrix(cohorts):
+    assert cohorts['cohorts'] == ['2026-01', '2026-02']
+    assert cohorts['sizes'] == [2, 1]
+    assert cohorts['through'] == '2026-03'
+    # Months that haven't happened yet for a cohort are null
+    assert cohorts['retention'] == [[1.0, 0.5, 0.5], [1.0, 1.0, None]]
+    assert cohorts['revenue'] == [[30.0, 10.0, 10.0], [10.0, 10.0, None]]
+    assert cohorts['revenue_retention'] == [[1.0, 0.3333, 0.3333], [1.0, 1.0, None]]
+
+def test_tenure_per_type(cohorts):
+    assert cohorts['members_by_type'] == {'Basic': 2, 'Pro': 1}
+    # Basic: 59 and 28 days, in months of 365.25 / 12 days
+    assert cohorts['median_tenure_months'] == {'Basic': 1.4, 'Pro': 0.0}
+
+def test_cohort_table(cohorts):
+    table = cohort_table(cohorts, last=1)
+    assert table.index.tolist() == ['2026-02']
+    assert table['members'].tolist() == [1]
@@ -0,0 +1,57 @@
+import json
+
+from dashboard_schema import (apply_delta, compact_dashboard, dashboard_delta, delta_path, expand_dashboard,
+                              load_document, write_dashboard)
+
+def dashboard(as_of='2026-10-10 15:00:00', **changes):
+    data = {
+        'as_of': as_of,
+        'last_updated': '2026-10-10 14:00:00',
+        'total_active_members': 2,
+        'membership_breakdown': {'Basic': 1, 'Pro': 1},
+        'active_member_list': [
+            {'email': 'a@example.org', 'name': 'Ann', 'membership_type': 'Basic', 'days_as_member': 40},
+            {'email': 'b@example.org', 'name': 'Bo', 'membership_type': 'Pro', 'days_as_member': 12},
+        ],
+        'new_member_list': [{'email': 'b@example.org', 'name': 'Bo', 'days_as_member': 12}],
+        'quit_member_list': [],
+        'late_member_list': [],
+    }
+    data.update(changes)
+    return data
+
+def test_expand_round_trip():
+    data = dashboard()
+    assert expand_dashboard(compact_dashboard(data)) == data
+
+def test_delta_round_trip():
+    old = compact_dashboard(dashboard(), version=1)
+    new = compact_dashboard(dashboard(total_active_members=3, new_member_list=[]), version=2)
+    assert apply_delta(old, dashboard_delta(old, new)) == new
+
+def test_same_content_same_etag_later_in_the_day():
+    # The run time isn't content; day counts only depend on the day
+    assert (compact_dashboard(dashboard('2026-10-10 09:00:00'))['etag'] ==
+            compact_dashboard(dashboard('2026-10-10 17:30:00'))['etag'])
+
+def test_repeat_run_keeps_version_and_file(tmp_path):
+    output = tmp_path / 'dashboard_data.json'
+    write_dashboard(dashboard('2026-10-10 09:00:00'), output, {'run_metrics.json': '{"run": 1}'})
+    first = load_document(output)
+    mtime = output.stat().st_mtime_ns
+
+    doc = write_dashboard(dashboard('2026-10-10 09:05:00'), output, {'run_metrics.json': '{"run": 2}'})
+    assert (doc['version'], doc['etag']) == (first['version'], first['etag'])
+    assert output.stat().st_mtime_ns == mtime  # Same ETag for HTTP clients too
+
+    # The extra files of the second run are still published
+    assert json.loads((tmp_path / 'run_metrics.json').read_text()) == {'run': 2}
+    assert delta_path(output).exists()
+
+def test_changed_content_bumps_version(tmp_path):
+    output = tmp_path / 'dashboard_data.json'
+    write_dashboard(dashboard(), output)
+    doc = write_dashboard(dashboard(total_active_members=3), output)
+    assert doc['version'] == 2
+    delta = json.loads(delta_path(output).read_text())
+    assert (delta['base_version'], delta['version'], delta['set']) == (1, 2, {'total_active_members': 3})
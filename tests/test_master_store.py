@@ -0,0 +1,56 @@
+import pandas as pd
+
+import master_store
+from master_store import append_master, delta_files, load_master, read_payments, save_master
+
+KEY = ['Email', 'Payment Date (UTC)']
+
+def test_round_trip_keeps_types(tmp_path, payments):
+    store = tmp_path / 'payment_history_master.parquet'
+    save_master(payments, store)
+    stored = load_master(store)
+    assert len(stored) == len(payments)
+    assert pd.api.types.is_datetime64_any_dtype(stored['Payment Date (UTC)'])
+    assert stored['Total Amount'].dtype == 'float64'
+    assert read_payments(store, ['Email'])['Email'].dtype == 'string'
+
+def test_later_deltas_replace_earlier_versions(tmp_path, payments):
+    store = tmp_path / 'payment_history_master.parquet'
+    save_master(payments.iloc[:100], store)
+
+    update = payments.iloc[:2].copy()
+    update['Recurring Status'] = 'Stopped'
+    append_master(update, store)
+    append_master(payments.iloc[100:150], store)
+
+    stored = load_master(store)
+    assert len(stored) == 150
+    assert not stored.duplicated(KEY).any()
+    assert stored.set_index(KEY).loc[list(update.set_index(KEY).index), 'Recurring Status'].eq('Stopped').all()
+
+def test_deltas_compacted_into_base(tmp_path, payments, monkeypatch):
+    monkeypatch.setattr(master_store, 'MAX_DELTA_FILES', 3)
+    store = tmp_path / 'payment_history_master.parquet'
+    save_master(payments.iloc[:100], store)
+    before = load_master(store)
+
+    append_master(payments.iloc[100:110], store)
+    append_master(payments.iloc[105:120], store)  # Overlaps the first delta
+    assert len(delta_files(store)) == 2
+    append_master(payments.iloc[120:130], store)
+
+    assert delta_files(store) == []
+    compacted = load_master(store)
+    assert len(compacted) == len(before) + 30
+    assert not compacted.duplicated(KEY).any()
+
+def test_load_since_reads_only_recent_payments(tmp_path, payments):
+    store = tmp_path / 'payment_history_master.parquet'
+    history = payments.sort_values('Payment Date (UTC)', ignore_index=True)
+    save_master(history.iloc[:1000], store)
+    append_master(history.iloc[1000:], store)
+
+    since = history['Payment Date (UTC)'].iloc[900]
+    recent = load_master(store, since=since)
+    assert recent['Payment Date (UTC)'].min() >= since
+    assert len(recent) == (history['Payment Date (UTC)'] >= since).sum()
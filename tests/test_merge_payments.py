@@ -0,0 +1,77 @@
+import pandas as pd
+import pytest
+
+import merge_payments
+from master_store import delta_files, load_master, merge_key, store_version
+
+@pytest.fixture
+def master(tmp_path, monkeypatch):
+    path = tmp_path / 'payment_history_master.parquet'
+    monkeypatch.setattr(merge_payments, 'MASTER_DB', str(path))
+    return path
+
+@pytest.fixture
+def history(payments):
+    return payments.sort_values('Payment Date (UTC)', ignore_index=True)
+
+def test_incremental_merge_appends_new_and_changed(master, history):
+    merge_payments.merge_export(df_new=history.iloc[:1000])
+
+    # A recent export overlapping the master, with one payment's status changed
+    export = history.iloc[900:].copy()
+    export.loc[950, 'Recurring Status'] = 'Stopped'
+    path, merged = merge_payments.merge_export(df_new=export)
+
+    assert len(delta_files(path)) == 1
+    stored = load_master(path)
+    assert len(stored) == len(merged) == len(history.drop_duplicates(['Email', 'Payment Date (UTC)']))
+    changed = stored[(stored['Email'] == history.loc[950, 'Email']) &
+                     (stored['Payment Date (UTC)'] == history.loc[950, 'Payment Date (UTC)'])]
+    assert changed['Recurring Status'].tolist() == ['Stopped']
+
+    # The same export again changes nothing
+    merge_payments.merge_export(df_new=export)
+    assert len(delta_files(path)) == 1
+
+def test_incremental_merge_reads_only_the_overlap(master, history, monkeypatch):
+    merge_payments.merge_export(df_new=history.iloc[:1000])
+
+    read = []
+    real_load = merge_payments.load_master
+    monkeypatch.setattr(merge_payments, 'load_master',
+                        lambda *args, **kwargs: read.append(real_load(*args, **kwargs)) or read[-1])
+    merge_payments.merge_export(df_new=history.iloc[900:])
+
+    # The comparison read only master rows from the export's first date on
+    assert len(read[0]) == 100
+
+def test_merge_key_finds_older_column_names(history):
+    assert merge_key(history) == ['Email', 'Payment Date (UTC)']
+    local = history.rename(columns={'Email': 'Contact', 'Payment Date (UTC)': 'Payment Date (America/Los_Angeles)'})
+    assert merge_key(local) == ['Contact', 'Payment Date (America/Los_Angeles)']
+    with pytest.raises(ValueError, match='Payment Date'):
+        merge_key(history.drop(columns='Payment Date (UTC)'))
+
+def test_undated_payments_are_not_appended_again(master, history):
+    export = history.iloc[900:].copy()
+    export.loc[export.index[:3], 'Payment Date (UTC)'] = pd.NaT
+    merge_payments.merge_export(df_new=history.iloc[:900])
+    path, merged = merge_payments.merge_export(df_new=export)
+    assert merged['Payment Date (UTC)'].isna().sum() == 3
+
+    # The next run's export still has them: they match the master's, nothing is new
+    merge_payments.merge_export(df_new=export)
+    assert len(delta_files(path)) == 1
+    assert load_master(path)['Payment Date (UTC)'].isna().sum() == 3
+
+def test_merge_reports_what_it_touched(master, history):
+    changes = {}
+    merge_payments.merge_export(df_new=history.iloc[:1000], changes=changes)
+    assert changes == {'since': None, 'version': None}
+
+    version = store_version(master)
+    export = history.iloc[900:].copy()
+    export.loc[950, 'Recurring Status'] = 'Stopped'
+    merge_payments.merge_export(df_new=export, changes=changes)
+    assert changes == {'since': history.loc[950, 'Payment Date (UTC)'], 'version': version}
+    assert store_version(master) != version
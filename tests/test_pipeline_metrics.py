@@ -0,0 +1,47 @@
+import json
+from datetime import datetime, timedelta
+
+import pipeline_metrics
+from pipeline_metrics import prune, stage
+
+def recorded(tmp_path):
+    with open(tmp_path / 'pipeline_metrics.jsonl') as f:
+        return {entry['stage']: entry for entry in map(json.loads, f)}
+
+def test_nested_stage_keeps_the_outer_peak(tmp_path, monkeypatch):
+    # A fake kernel counter: reset to the current usage, raised by allocations
+    usage = {'current': 100, 'peak': 100}
+    monkeypatch.setattr(pipeline_metrics, '_reset_peak_rss', lambda: usage.update(peak=usage['current']))
+    monkeypatch.setattr(pipeline_metrics, '_peak_rss_mb', lambda: usage['peak'])
+
+    def use(mb):
+        usage['current'] = mb
+        usage['peak'] = max(usage['peak'], mb)
+
+    with stage('outer'):
+        use(500)
+        use(200)
+        with stage('inner'):
+            use(300)
+            use(150)
+        use(250)
+
+    stages = recorded(tmp_path)
+    assert stages['inner']['peak_rss_mb'] == 300
+    assert stages['outer']['peak_rss_mb'] == 500
+
+def test_old_records_are_pruned_when_a_run_starts(tmp_path, monkeypatch):
+    metrics_file = tmp_path / 'pipeline_metrics.jsonl'
+    now = datetime.now()
+    with open(metrics_file, 'w') as f:
+        for days in (200, 91, 89, 1):
+            finished = (now - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+            f.write(json.dumps({'run_id': f'old-{days}', 'stage': f'merge-{days}', 'finished': finished}) + '\n')
+
+    monkeypatch.setattr(pipeline_metrics, 'RUN_ID', 'new')
+    with stage('first'):
+        pass
+    with stage('second'):
+        pass
+    assert list(recorded(tmp_path)) == ['merge-89', 'merge-1', 'first', 'second']
+    assert prune(metrics_file, keep_days=90) == 0
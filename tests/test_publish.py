@@ -0,0 +1,61 @@
+import os
+import threading
+
+import pytest
+
+from publish import Generation, atomic_write, refresh_lock, rollback
+
+def test_atomic_write_replaces_whole_file(tmp_path):
+    path = tmp_path / 'data.json'
+    atomic_write(path, 'old')
+    atomic_write(path, 'new')
+    assert path.read_text() == 'new'
+    assert os.listdir(tmp_path) == ['data.json']  # No temp files left
+
+def test_generation_switches_all_files_and_rolls_back(tmp_path):
+    with Generation(tmp_path) as generation:
+        generation.write('a.json', '1')
+        generation.write('b.json', '1')
+    with Generation(tmp_path) as generation:
+        generation.write('a.json', '2')
+        generation.write('b.json', '2')
+    assert [(tmp_path / name).read_text() for name in ('a.json', 'b.json')] == ['2', '2']
+
+    rollback(tmp_path)
+    assert [(tmp_path / name).read_text() for name in ('a.json', 'b.json')] == ['1', '1']
+
+def test_failed_generation_publishes_nothing(tmp_path):
+    with Generation(tmp_path) as generation:
+        generation.write('a.json', '1')
+    with pytest.raises(RuntimeError):
+        with Generation(tmp_path) as generation:
+            generation.write('a.json', '2')
+            raise RuntimeError('analysis failed')
+    assert (tmp_path / 'a.json').read_text() == '1'
+
+def test_publishes_under_the_refresh_lock_never_collide(tmp_path):
+    errors = []
+
+    def publish_many(worker):
+        try:
+            for i in range(20):
+                with refresh_lock(tmp_path / 'refresh.lock'), Generation(tmp_path) as generation:
+                    generation.write('a.json', f'{worker}-{i}')
+                    generation.write('b.json', f'{worker}-{i}')
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=publish_many, args=(worker,)) for worker in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert (tmp_path / 'a.json').read_text() == (tmp_path / 'b.json').read_text()
+    assert sorted(name for name in os.listdir(tmp_path) if name != 'refresh.lock') == ['a.json', 'b.json', 'published']
+
+def test_refresh_lock_is_reentrant(tmp_path):
+    """The daemon holds the lock around run_pipeline(), which takes it too"""
+    with refresh_lock(tmp_path / 'refresh.lock'):
+        with refresh_lock(tmp_path / 'refresh.lock'):
+            pass
@@ -0,0 +1,35 @@
+import json
+
+import pipeline
+import refresh_daemon
+
+def test_background_job_reports_progress(tmp_path, monkeypatch):
+    job_file = tmp_path / 'refresh_job.json'
+    seen = []
+
+    def run_pipeline(track):
+        for name in pipeline.STAGES:
+            with track(name):
+                seen.append(json.loads(job_file.read_text()))
+                print(f"Running {name}")
+
+    monkeypatch.setattr(pipeline, 'run_pipeline', run_pipeline)
+    job = refresh_daemon.run_job('20261016-120000', job_file)
+
+    assert job.state == 'succeeded'
+    assert [status['current_stage'] for status in seen] == pipeline.STAGES
+    assert all(status['state'] == 'running' and status['job_id'] == '20261016-120000' for status in seen)
+    final = json.loads(job_file.read_text())
+    assert (final['state'], final['progress'], final['message']) == ('succeeded', 1.0, 'Running analyze')
+
+def test_failed_background_job_is_recorded(tmp_path, monkeypatch):
+    job_file = tmp_path / 'refresh_job.json'
+
+    def run_pipeline(track):
+        with track('export'):
+            raise RuntimeError('Zeffy export failed')
+
+    monkeypatch.setattr(pipeline, 'run_pipeline', run_pipeline)
+    assert refresh_daemon.run_job('20261016-120000', job_file).state == 'failed'
+    final = json.loads(job_file.read_text())
+    assert (final['state'], final['error'], final['stages']['export']) == ('failed', 'Zeffy export failed', 'failed')
@@ -0,0 +1,66 @@
+import pandas as pd
+
+import revenue_rollups
+from analyze_members import prepare_payments
+from revenue_rollups import build_rollups, read_rollups, select, update_rollups
+
+def test_update_recomputes_only_changed_days(tmp_path, payments):
+    rollup_file = tmp_path / 'revenue_rollups.parquet'
+    prepared = prepare_payments(payments)
+    rollups, days = update_rollups(prepared, rollup_file)
+    assert days == (rollups['granularity'] == 'day').sum()
+
+    # Same payments again: nothing to recompute
+    assert update_rollups(prepared, rollup_file)[1] == 0
+
+    # One payment's amount changes: only its day (and the periods around it) are redone
+    changed = payments.copy()
+    row = changed.index[changed['Details'].str.contains('Membership', na=False)][-1]
+    changed.loc[row, 'Total Amount'] += 10
+    rollups, days = update_rollups(prepare_payments(changed), rollup_file)
+    assert days == 1
+    pd.testing.assert_frame_equal(rollups, build_rollups(prepare_payments(changed)))
+
+def test_stale_table_from_other_input_is_corrected(tmp_path, payments):
+    """A stored table built from different payments is brought in line, not trusted"""
+    rollup_file = tmp_path / 'revenue_rollups.parquet'
+    update_rollups(prepare_payments(payments.iloc[: len(payments) // 2]), rollup_file)
+
+    prepared = prepare_payments(payments)
+    rollups, days = update_rollups(prepared, rollup_file)
+    assert days > 0
+    pd.testing.assert_frame_equal(read_rollups(rollup_file), build_rollups(prepared))
+    assert select(rollups, 'year')['revenue'].sum() > 0
+
+def test_only_days_since_the_merge_are_checksummed(tmp_path, payments, monkeypatch):
+    rollup_file = tmp_path / 'revenue_rollups.parquet'
+    update_rollups(prepare_payments(payments), rollup_file, basis='v1')
+
+    changed = payments.copy()
+    row = changed.index[changed['Details'].str.contains('Membership', na=False)][-1]
+    changed.loc[row, 'Total Amount'] += 10
+    since = changed.loc[row, 'Payment Date (UTC)']
+    prepared = prepare_payments(changed)
+
+    hashed = []
+    real_checksums = revenue_rollups.row_checksums
+    monkeypatch.setattr(revenue_rollups, 'row_checksums',
+                        lambda memberships, columns: hashed.append(len(memberships)) or real_checksums(memberships, columns))
+    rollups, days = update_rollups(prepared, rollup_file, since, basis='v2', previous_basis='v1')
+
+    memberships = prepared['memberships']
+    assert hashed == [(memberships['Payment Date (UTC)'] >= since.normalize()).sum()]
+    assert days == 1
+    pd.testing.assert_frame_equal(rollups, build_rollups(prepared))
+    assert read_rollups(rollup_file).attrs['basis'] == 'v2'
+
+def test_since_is_ignored_for_a_table_from_other_payments(tmp_path, payments):
+    rollup_file = tmp_path / 'revenue_rollups.parquet'
+    update_rollups(prepare_payments(payments.iloc[: len(payments) // 2]), rollup_file, basis='v1')
+
+    # The table isn't from the master the merge started from, so every day is checked
+    prepared = prepare_payments(payments)
+    since = payments['Payment Date (UTC)'].max()
+    rollups, days = update_rollups(prepared, rollup_file, since, basis='v3', previous_basis='v2')
+    assert days > 1
+    pd.testing.assert_frame_equal(rollups, build_rollups(prepared))
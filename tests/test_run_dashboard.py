@@ -0,0 +1,78 @@
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+import run_dashboard
+from run_dashboard import DashboardServer, MyHTTPRequestHandler, public_path
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    """The dashboard server on a free port, serving a folder laid out like the repo"""
+    (tmp_path / 'exports').mkdir()
+    (tmp_path / 'dashboard.html').write_text('<html>dashboard</html>')
+    (tmp_path / 'exports' / 'dashboard_data.json').write_text('{"version": 1}')
+    for secret in ('.env', 'zeffy_cookies.json', 'zeffy_export_request.json', 'exports/analysis_cache.pkl',
+                   'exports/payment_history_master.parquet', 'exports/pipeline_metrics.jsonl'):
+        (tmp_path / secret).write_text('secret')
+    monkeypatch.setattr(run_dashboard, 'DIRECTORY', tmp_path)
+    monkeypatch.setattr(run_dashboard, 'FILE_CACHE', run_dashboard.FileCache())
+
+    httpd = DashboardServer(('127.0.0.1', 0), MyHTTPRequestHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{httpd.server_address[1]}'
+    httpd.shutdown()
+    httpd.server_close()
+
+def status(url, headers=None):
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, headers=headers or {})) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+def test_public_paths():
+    assert public_path('/') == 'dashboard.html'
+    assert public_path('/trends.html?x=1') == 'trends.html'
+    assert public_path('/exports/dashboard_data.json') == 'exports/dashboard_data.json'
+    for url in ('/.env', '/zeffy_cookies.json', '/exports/analysis_cache.pkl', '/exports/',
+                '/exports/published/g1/dashboard_data.json', '/exports/.dashboard_data.json.tmp',
+                '/exports/../zeffy_cookies.json', '/%2e%2e/etc/passwd', '/cgi-bin/refresh_data.py'):
+        assert public_path(url) is None, url
+
+def test_only_dashboard_files_are_served(server):
+    assert status(server + '/') == 200
+    assert status(server + '/dashboard.html') == 200
+    assert status(server + '/exports/dashboard_data.json') == 200
+    for path in ('/.env', '/zeffy_cookies.json', '/zeffy_export_request.json', '/exports/analysis_cache.pkl',
+                 '/exports/payment_history_master.parquet', '/exports/pipeline_metrics.jsonl', '/exports/',
+                 '/exports/../zeffy_cookies.json', '/run_dashboard.py'):
+        assert status(server + path) == 404, path
+
+def fetch(url, headers=None):
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, headers=headers or {})) as response:
+            return response.status, response.headers, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.headers, b''
+
+def test_unchanged_data_gets_304(server, tmp_path):
+    url = server + '/exports/dashboard_data.json'
+    code, headers, body = fetch(url)
+    assert (code, body) == (200, b'{"version": 1}')
+    assert headers['Cache-Control'] == 'no-cache'
+
+    assert fetch(url, {'If-None-Match': headers['ETag']})[0] == 304
+    assert fetch(url, {'If-Modified-Since': headers['Last-Modified']})[0] == 304
+
+    # Compressed copies have their own ETag, and still revalidate
+    gzip_headers = fetch(url, {'Accept-Encoding': 'gzip'})[1]
+    assert gzip_headers['Content-Encoding'] == 'gzip' and gzip_headers['ETag'] != headers['ETag']
+    assert fetch(url, {'Accept-Encoding': 'gzip', 'If-None-Match': gzip_headers['ETag']})[0] == 304
+
+    # A new version is sent in full
+    (tmp_path / 'exports' / 'dashboard_data.json').write_text('{"version": 22}')
+    code, _, body = fetch(url, {'If-None-Match': headers['ETag']})
+    assert (code, body) == (200, b'{"version": 22}')
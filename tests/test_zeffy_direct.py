@@ -0,0 +1,120 @@
+import json
+import threading
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+import pytest
+
+from synthetic_zeffy import write_export
+from zeffy_direct import DirectDownloadError, build_recipe, direct_download, load_recipe, save_recipe, stream_to_file
+
+class MockZeffy(BaseHTTPRequestHandler):
+    """The export API: POST /api/exports answers with a link, GET /files/export.xlsx is the file"""
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.server.requests.append(('POST', self.path, body.decode('utf-8')))
+        reply = json.dumps({'data': {'url': '/files/export.xlsx'}}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+
+    def do_GET(self):
+        self.server.requests.append(('GET', self.path, None))
+        if self.server.expired:
+            content_type, content = 'application/octet-stream', b'<!DOCTYPE html><html><body>Log in</body></html>'
+        else:
+            content_type, content = 'application/vnd.ms-excel', self.server.export.read_bytes()
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Disposition', 'attachment; filename="export.xlsx"')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+@pytest.fixture
+def zeffy(tmp_path, payments):
+    export = tmp_path / 'export.xlsx'
+    write_export(payments.iloc[:300], export)
+
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), MockZeffy)
+    httpd.export, httpd.expired, httpd.requests = export, False, []
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+@pytest.fixture
+def session(tmp_path, zeffy):
+    """Recipe and cookie files for the mock, with full and incremental recordings"""
+    base = f'http://127.0.0.1:{zeffy.server_address[1]}'
+    cookie_file = tmp_path / 'cookies.json'
+    cookie_file.write_text(json.dumps([{'domain': '127.0.0.1', 'path': '/', 'name': 'session', 'value': 'abc'}]))
+    recipe_file = tmp_path / 'recipe.json'
+    for since in (None, date(2025, 9, 1)):
+        post_data = {'format': 'xlsx', 'note': 'exported 2025-09-01'}
+        if since is not None:
+            post_data['filters'] = {'startDate': '2025-09-01', 'endDate': '2026-10-10'}
+        create_request = {'method': 'POST', 'url': base + '/api/exports?version=2025-09-01',
+                          'headers': {'Content-Type': 'application/json', 'Cookie': 'dropped'},
+                          'post_data': json.dumps(post_data)}
+        save_recipe(build_recipe(base + '/files/export.xlsx', create_request,
+                                 {'data': {'url': '/files/export.xlsx'}}, since), recipe_file)
+    return {'recipe_file': recipe_file, 'cookie_file': cookie_file}
+
+def test_streams_the_export_to_disk(tmp_path, zeffy, session):
+    metrics = {}
+    saved = direct_download(tmp_path / 'downloads', metrics, **session)
+    assert saved.read_bytes() == zeffy.export.read_bytes()
+    assert metrics['bytes'] == zeffy.export.stat().st_size
+    assert [method for method, _, _ in zeffy.requests] == ['POST', 'GET']
+    assert list((tmp_path / 'downloads').iterdir()) == [saved]
+
+def test_expired_session_page_is_rejected(tmp_path, zeffy, session):
+    zeffy.expired = True
+    with pytest.raises(DirectDownloadError, match='session expired'):
+        direct_download(tmp_path / 'downloads', **session)
+    assert list((tmp_path / 'downloads').iterdir()) == []
+
+def test_stale_export_is_rejected(tmp_path, zeffy, session, payments):
+    newest = payments['Payment Date (UTC)'].iloc[:300].max()
+    with pytest.raises(DirectDownloadError, match='older than'):
+        direct_download(tmp_path / 'downloads', not_before=newest + pd.Timedelta(days=1), **session)
+    assert list((tmp_path / 'downloads').iterdir()) == []
+
+    assert direct_download(tmp_path / 'downloads', not_before=newest, **session).exists()
+
+def test_incremental_replay_swaps_only_the_start_date(tmp_path, zeffy, session):
+    recipe = load_recipe(session['recipe_file'], date(2026, 1, 15))
+    assert recipe['since_fields'] == [{'in': 'post_data', 'path': ['filters', 'startDate']}]
+
+    direct_download(tmp_path / 'downloads', since=date(2026, 1, 15), **session)
+    method, path, body = zeffy.requests[0]
+    assert method == 'POST'
+    # The start date moved; the same date elsewhere in the request didn't
+    assert parse_qs(urlparse(path).query) == {'version': ['2025-09-01']}
+    assert json.loads(body) == {'format': 'xlsx', 'note': 'exported 2025-09-01',
+                                'filters': {'startDate': '2026-01-15', 'endDate': '2026-10-10'}}
+
+def test_recording_without_a_findable_start_date_fails():
+    create_request = {'method': 'POST', 'url': 'https://example.org/api/exports', 'headers': {},
+                      'post_data': json.dumps({'range': 'last-30-days'})}
+    with pytest.raises(DirectDownloadError, match='start date'):
+        build_recipe('https://example.org/files/export.xlsx', create_request, since=date(2025, 9, 1))
+
+def test_broken_stream_leaves_no_partial_file(tmp_path):
+    class Dropped:
+        def read(self, size=-1):
+            raise ConnectionResetError('connection dropped')
+
+    with pytest.raises(ConnectionResetError):
+        stream_to_file(Dropped(), tmp_path / 'export.csv')
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,13 @@
+from datetime import datetime
+
+import zeffy_export
+from zeffy_export import load_export_state, record_full_export
+
+def test_full_export_is_recorded_atomically(tmp_path, monkeypatch):
+    monkeypatch.setattr(zeffy_export, 'DOWNLOAD_FOLDER', str(tmp_path))
+    (tmp_path / zeffy_export.EXPORT_STATE_NAME).write_text('{"other": 1}')
+
+    record_full_export(datetime(2026, 10, 16, 9, 30))
+    assert load_export_state() == {'other': 1, 'last_full_export': '2026-10-16T09:30:00'}
+    # Written through a temp file that was renamed into place
+    assert [path.name for path in tmp_path.iterdir()] == [zeffy_export.EXPORT_STATE_NAME]
@@ -9,6 +9,9 @@ echo "$(date): Starting data update..." >> "$LOG_FILE"
 
 cd "$DASHBOARD_DIR"
 
+# Group this run's stage metrics (see pipeline_metrics.py)
+export REFRESH_RUN_ID=$(date +%Y%m%d-%H%M%S)
+
 # Run the analysis script
 python3 analyze_members.py >> "$LOG_FILE" 2>&1
 
@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+"""
+Direct Zeffy Export Download
+============================
+Downloads the payments export straight over HTTP with the saved session
+cookies, skipping the browser, the payments table scrolling and the modal
+
+The export is built server-side, so the browser is only needed to find out
+which request produces it. When zeffy_export.py does an export through the
+UI it records that request (the call the modal's Export button makes, and
+where the file came from) in zeffy_export_request.json. Later exports replay
+it with the cookies from zeffy_cookies.json and stream the file to disk. If
+anything about the replay looks wrong (no recording yet, expired session,
+something other than a spreadsheet comes back, or a file whose newest payment
+is older than the master's) zeffy_export.py falls back to the browser, which
+records a fresh request.
+
+Only a recorded Export call is replayed, never a bare download link: the link
+points at the file built back then, so fetching it again would quietly bring
+back old data.
+
+Full ("All time") and incremental (date-ranged) exports are recorded
+separately. For an incremental export the recording notes which field
+carries the start date (a query parameter, or a key in the JSON or form
+body), and a replay swaps the new start date into that field only.
+
+Usage:
+    python zeffy_direct.py                  # Try a direct full download now (exit 1 if it can't)
+    python zeffy_direct.py 2025-09-01       # Try a direct download of payments since a date
+
+Configuration (.env):
+    ZEFFY_DIRECT_DOWNLOAD   default 1 (set to 0 to always use the browser)
+"""
+import os
+import sys
+import json
+import time
+import re
+import shutil
+import urllib.error
+import urllib.request
+from datetime import datetime
+from pathlib import Path
+from urllib.parse import parse_qsl, urlencode, urljoin, urlparse
+
+import pandas as pd
+from dotenv import load_dotenv
+
+from master_store import MASTER_STORE, is_date_column, latest_payment_date, read_payments
+
+load_dotenv()
+
+DIRECT_DOWNLOAD = os.getenv('ZEFFY_DIRECT_DOWNLOAD', '1') != '0'
+
+# Auto-detect environment
+if os.name == 'nt':  # Windows
+    DOWNLOAD_FOLDER = os.getenv('DOWNLOAD_FOLDER', r'C:\Users\erin\Zeffy_Exports')
+    COOKIE_FILE = r'C:\Users\erin\CFL Member Dashboard\zeffy_cookies.json'
+    RECIPE_FILE = r'C:\Users\erin\CFL Member Dashboard\zeffy_export_request.json'
+else:  # Linux/Server
+    DOWNLOAD_FOLDER = os.getenv('DOWNLOAD_FOLDER', '/var/www/cfl-member-dashboard/exports')
+    COOKIE_FILE = '/var/www/cfl-member-dashboard/zeffy_cookies.json'
+    RECIPE_FILE = '/var/www/cfl-member-dashboard/zeffy_export_request.json'
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+
+# Request headers worth replaying (the rest are per-browser or per-session)
+REPLAY_HEADERS = {'accept', 'content-type', 'x-requested-with'}
+
+# Field names that look like a range's start, for when the date shows up twice
+START_FIELD = re.compile(r'start|from|since|begin', re.IGNORECASE)
+
+class DirectDownloadError(Exception):
+    """The export couldn't be downloaded directly; use the browser instead"""
+
+def find_key_path(data, target, path=()):
+    """Find where in a JSON response a value equal to `target` sits, as a list of keys"""
+    if isinstance(data, dict):
+        items = data.items()
+    elif isinstance(data, list):
+        items = enumerate(data)
+    else:
+        return list(path) if data == target else None
+
+    for key, value in items:
+        found = find_key_path(value, target, path + (key,))
+        if found is not None:
+            return found
+    return None
+
+def find_value_paths(data, predicate, path=()):
+    """Every key path in JSON data whose (string) value matches predicate"""
+    if isinstance(data, dict):
+        items = data.items()
+    elif isinstance(data, list):
+        items = enumerate(data)
+    else:
+        if isinstance(data, str) and predicate(data):
+            yield list(path)
+        return
+
+    for key, value in items:
+        yield from find_value_paths(value, predicate, path + (key,))
+
+def parse_json(text):
+    try:
+        return json.loads(text)
+    except (TypeError, ValueError):
+        return None
+
+def find_date_fields(recipe, since):
+    """Where an incremental request carries its start date
+
+    Returns a list of {'in': 'download_url' | 'url' | 'post_data', and
+    'param' (a query or form parameter) or 'path' (a JSON key path)}.
+    When the date appears in more than one field, only fields named like a
+    start ('startDate', 'from', ...) are kept. Raises DirectDownloadError if
+    that still doesn't settle it, or the date isn't there at all.
+    """
+    since = str(since)
+    create = recipe['create']
+    fields = []
+    for where, url in (('download_url', recipe['download_url']), ('url', create['url'])):
+        fields += [{'in': where, 'param': name} for name, value in parse_qsl(urlparse(url).query) if since in value]
+
+    post_data = create.get('post_data')
+    body = parse_json(post_data)
+    if isinstance(body, (dict, list)):
+        fields += [{'in': 'post_data', 'path': path} for path in find_value_paths(body, lambda value: since in value)]
+    elif post_data:
+        fields += [{'in': 'post_data', 'param': name} for name, value in parse_qsl(post_data) if since in value]
+
+    if len(fields) > 1:
+        fields = [field for field in fields if START_FIELD.search(str(field.get('param') or field['path'][-1]))]
+    if not fields:
+        raise DirectDownloadError(f"Couldn't tell which field of the export request holds the start date {since}")
+    return fields
+
+def swap_query(url, name, old, new):
+    parts = urlparse(url)
+    query = [(key, value.replace(old, new) if key == name else value) for key, value in parse_qsl(parts.query)]
+    return parts._replace(query=urlencode(query)).geturl()
+
+def build_recipe(download_url, create_request=None, create_response=None, since=None):
+    """Describe how an export was produced so it can be replayed
+
+    create_request is the API call the Export button made, as a dict with
+    method, url, headers and post_data; create_response is its JSON body.
+    `since` is the start date an incremental export was requested with.
+    Raises DirectDownloadError without a create request.
+    """
+    if not create_request:
+        raise DirectDownloadError("No export call seen, only the download link (which would go stale)")
+
+    recipe = {'recorded': datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 'download_url': download_url}
+    recipe['create'] = {
+        'method': create_request['method'],
+        'url': create_request['url'],
+        'headers': {name: value for name, value in create_request['headers'].items()
+                    if name.lower() in REPLAY_HEADERS},
+        'post_data': create_request.get('post_data'),
+    }
+    if create_response is not None:
+        # The response links to the file; remember which key holds the link
+        download_path = urlparse(download_url).path
+        for target in (download_url, download_path):
+            key_path = find_key_path(create_response, target)
+            if key_path is not None:
+                recipe['create']['url_key'] = key_path
+                break
+
+    if since is not None:
+        recipe['since'] = str(since)
+        recipe['since_fields'] = find_date_fields(recipe, since)
+    return recipe
+
+def recipe_mode(since):
+    """Which recording a full (since=None) or incremental export uses"""
+    return 'full' if since is None else 'incremental'
+
+def load_recipes(recipe_file=RECIPE_FILE):
+    """Load all recorded export requests, by mode"""
+    recipe_path = Path(recipe_file)
+    if not recipe_path.exists():
+        return {}
+    with open(recipe_path, 'r') as f:
+        return json.load(f)
+
+def save_recipe(recipe, recipe_file=RECIPE_FILE):
+    """Save a recorded export request, replacing the previous one of its mode"""
+    recipes = load_recipes(recipe_file)
+    recipes[recipe_mode(recipe.get('since'))] = recipe
+
+    recipe_path = Path(recipe_file)
+    recipe_path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = recipe_path.with_suffix('.tmp')
+    with open(temp_path, 'w') as f:
+        json.dump(recipes, f, indent=2)
+    os.replace(temp_path, recipe_path)
+
+def load_recipe(recipe_file=RECIPE_FILE, since=None):
+    """Load the recorded request for a full or incremental export, or None"""
+    recipe = load_recipes(recipe_file).get(recipe_mode(since))
+    if recipe is None or since is None:
+        return recipe
+
+    # Swap this export's start date into the fields that carried the recorded one
+    if not recipe.get('since_fields') or not recipe.get('create'):
+        raise DirectDownloadError("Recorded incremental request doesn't say where its start date goes")
+    recorded, since = recipe['since'], str(since)
+    recipe = {**recipe, 'create': dict(recipe['create']), 'since': since}
+    create = recipe['create']
+    body = parse_json(create.get('post_data'))
+    for field in recipe['since_fields']:
+        if field['in'] == 'download_url':
+            recipe['download_url'] = swap_query(recipe['download_url'], field['param'], recorded, since)
+        elif field['in'] == 'url':
+            create['url'] = swap_query(create['url'], field['param'], recorded, since)
+        elif 'path' in field:
+            try:
+                parent = body
+                for key in field['path'][:-1]:
+                    parent = parent[key]
+                parent[field['path'][-1]] = parent[field['path'][-1]].replace(recorded, since)
+            except (KeyError, IndexError, TypeError, AttributeError):
+                raise DirectDownloadError("Recorded request body no longer has its start date field")
+        else:
+            create['post_data'] = urlencode([(key, value.replace(recorded, since) if key == field['param'] else value)
+                                             for key, value in parse_qsl(create['post_data'])])
+    if any('path' in field for field in recipe['since_fields']):
+        create['post_data'] = json.dumps(body)
+    return recipe
+
+def cookie_header(url, cookie_file=COOKIE_FILE):
+    """Cookie header for a URL from the saved Playwright cookies"""
+    cookie_path = Path(cookie_file)
+    if not cookie_path.exists():
+        raise DirectDownloadError(f"No saved cookies at {cookie_path}")
+    with open(cookie_path, 'r') as f:
+        cookies = json.load(f)
+
+    url = urlparse(url)
+    now = time.time()
+    pairs = []
+    for cookie in cookies:
+        domain = cookie.get('domain', '').lstrip('.')
+        if not (url.hostname == domain or url.hostname.endswith('.' + domain)):
+            continue
+        if not url.path.startswith(cookie.get('path', '/')):
+            continue
+        if cookie.get('secure') and url.scheme != 'https':
+            continue
+        if cookie.get('expires', -1) not in (-1, None) and cookie['expires'] < now:
+            continue
+        pairs.append(f"{cookie['name']}={cookie['value']}")
+    return '; '.join(pairs)
+
+def open_url(url, method='GET', headers=None, data=None, cookie_file=COOKIE_FILE, timeout=120):
+    """Make a request with the session cookies"""
+    request = urllib.request.Request(url, data=data, method=method, headers={
+        'User-Agent': USER_AGENT,
+        'Cookie': cookie_header(url, cookie_file),
+        **(headers or {}),
+    })
+    try:
+        return urllib.request.urlopen(request, timeout=timeout)
+    except urllib.error.HTTPError as e:
+        raise DirectDownloadError(f"{method} {urlparse(url).path} returned HTTP {e.code}")
+    except urllib.error.URLError as e:
+        raise DirectDownloadError(f"Could not reach {urlparse(url).netloc}: {e.reason}")
+
+def is_file_response(response):
+    """Check a response is a file download rather than an API reply or web page"""
+    content_type = response.headers.get('Content-Type', '')
+    return 'attachment' in response.headers.get('Content-Disposition', '') or \
+        not any(kind in content_type for kind in ('json', 'html'))
+
+def stream_to_file(response, save_path):
+    """Stream a download to disk, keeping it only if it looks like an export"""
+    temp_path = save_path.with_suffix('.part')
+    try:
+        with open(temp_path, 'wb') as f:
+            shutil.copyfileobj(response, f, length=1 << 20)
+
+        # Zeffy "CSV" exports are actually Excel files (zip archives start with PK);
+        # an expired session typically gets us a login page instead
+        with open(temp_path, 'rb') as f:
+            head = f.read(512)
+        if not head.startswith(b'PK') and (b'<html' in head.lower() or b',' not in head):
+            raise DirectDownloadError("Download wasn't a payments export (session expired?)")
+
+        os.replace(temp_path, save_path)
+    except BaseException:
+        # Never leave partial data for the next run to trip over
+        temp_path.unlink(missing_ok=True)
+        raise
+    return save_path
+
+def check_fresh(save_path, not_before):
+    """Make sure a download is at least as new as the data we already have
+
+    Reads only the payment dates. A file whose newest payment is older than
+    `not_before` (the master's newest) is deleted.
+    """
+    dates = read_payments(save_path, columns=())
+    date_cols = [col for col in dates.columns if is_date_column(col)]
+    newest = dates[date_cols[0]].max() if date_cols else None
+    if newest is None or pd.isna(newest) or newest < pd.Timestamp(not_before):
+        save_path.unlink()
+        raise DirectDownloadError(f"Download's newest payment ({newest}) is older than the master's ({not_before})")
+
+def direct_download(download_folder=DOWNLOAD_FOLDER, metrics=None, recipe_file=RECIPE_FILE,
+                    cookie_file=COOKIE_FILE, since=None, not_before=None):
+    """Download the payments export by replaying the recorded request
+
+    Downloads all payments, or those since a date (a datetime.date) for an
+    incremental export. With `not_before` (the master's newest payment date)
+    a file with nothing that recent is rejected as stale. Returns the saved
+    file. Raises DirectDownloadError if the export can't be fetched this way.
+    """
+    recipe = load_recipe(recipe_file, since)
+    if recipe is None:
+        raise DirectDownloadError(f"No {recipe_mode(since)} export request recorded yet")
+
+    create = recipe.get('create')
+    if not create:
+        raise DirectDownloadError("Recorded request has no export call to replay")
+
+    data = create['post_data'].encode('utf-8') if create.get('post_data') is not None else None
+    response = open_url(create['url'], create['method'], create['headers'], data, cookie_file)
+    if not is_file_response(response):
+        # The API answered with a link to the file
+        try:
+            body = json.load(response)
+        except ValueError:
+            raise DirectDownloadError("Export request didn't return JSON or a file")
+        finally:
+            response.close()
+        response = None
+
+        if 'url_key' not in create:
+            raise DirectDownloadError("Don't know where the export response puts the download link")
+        try:
+            for key in create['url_key']:
+                body = body[key]
+        except (KeyError, IndexError, TypeError):
+            raise DirectDownloadError("Export response no longer has the download link")
+        download_url = urljoin(create['url'], str(body))
+
+    if response is None:
+        response = open_url(download_url, cookie_file=cookie_file)
+
+    timestamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+    save_path = Path(download_folder) / f'zeffy-payments-{timestamp}.csv'
+    save_path.parent.mkdir(parents=True, exist_ok=True)
+    with response:
+        if not is_file_response(response):
+            raise DirectDownloadError("Download link didn't return a file")
+        stream_to_file(response, save_path)
+    if not_before is not None:
+        check_fresh(save_path, not_before)
+
+    file_size = save_path.stat().st_size
+    if metrics is not None:
+        metrics['bytes'] = file_size
+    print(f"✓ Downloaded export directly: {save_path} ({file_size:,} bytes)")
+    return save_path
+
+if __name__ == "__main__":
+    try:
+        direct_download(since=datetime.strptime(sys.argv[1], '%Y-%m-%d').date() if len(sys.argv) > 1 else None,
+                        not_before=latest_payment_date(MASTER_STORE))
+    except DirectDownloadError as e:
+        print(f"✗ Direct download not possible: {e}")
+        sys.exit(1)
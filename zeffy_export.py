@@ -8,7 +8,18 @@ Requirements:
     playwright install chromium
 
 Usage:
-    python zeffy_export.py
+    python zeffy_export.py           # Incremental export (or full, when one is due)
+    python zeffy_export.py --full    # Export "All time"
+
+Normally only payments since the newest one in the master database (minus
+ZEFFY_OVERLAP_DAYS, to catch late status changes) are exported. A full "All
+time" export still runs every ZEFFY_FULL_EXPORT_DAYS to reconcile history,
+and whenever there is no master database yet.
+
+The export is first downloaded directly over HTTP by replaying the request
+recorded during the last browser export (see zeffy_direct.py). The browser
+is only used when that isn't possible, and each browser export records the
+request again.
 
 Troubleshooting:
     If selectors break, use: playwright codegen https://www.zeffy.com/login
@@ -16,13 +27,20 @@ Troubleshooting:
 """
 
 import os
+import sys
+import time
 import asyncio
 import json
-from datetime import datetime
+from datetime import datetime, timedelta
 from pathlib import Path
 from dotenv import load_dotenv
 from playwright.async_api import async_playwright, TimeoutError as PlaywrightTimeout
 
+from master_store import MASTER_STORE, latest_payment_date
+from pipeline_metrics import stage, step
+from publish import atomic_write
+from zeffy_direct import DIRECT_DOWNLOAD, RECIPE_FILE, build_recipe, direct_download, save_recipe
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -40,265 +58,549 @@ else:  # Linux/Server
     DOWNLOAD_FOLDER = os.getenv('DOWNLOAD_FOLDER', '/var/www/cfl-member-dashboard/exports')
     COOKIE_FILE = '/var/www/cfl-member-dashboard/zeffy_cookies.json'
 
-async def download_zeffy_payments():
-    """Main function to automate Zeffy payment export"""
-
-    # Ensure download folder exists
-    download_path = Path(DOWNLOAD_FOLDER)
-    download_path.mkdir(parents=True, exist_ok=True)
-
-    print(f"Starting Zeffy export automation...")
-    print(f"Download folder: {download_path}")
-
-    async with async_playwright() as p:
-        # Launch browser in headless mode (invisible)
-        browser = await p.chromium.launch(
-            headless=True,  # Set to False for debugging
-            downloads_path=str(download_path)
-        )
-
-        # Load saved cookies if they exist
-        cookie_path = Path(COOKIE_FILE)
-        storage_state = None
-        if cookie_path.exists():
-            print(f"✓ Loading saved cookies from {cookie_path}")
-            with open(cookie_path, 'r') as f:
-                cookies = json.load(f)
-                storage_state = {'cookies': cookies, 'origins': []}
-        else:
-            print(f"⚠ No saved cookies found. Run save_zeffy_cookies.py first!")
-
-        # Create browser context with download path and realistic user agent
-        context = await browser.new_context(
-            accept_downloads=True,
-            viewport={'width': 1920, 'height': 1080},
-            user_agent='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-            storage_state=storage_state
-        )
-
-        page = await context.new_page()
-
+# Browser context settings (download path and realistic user agent)
+CONTEXT_OPTIONS = {
+    'accept_downloads': True,
+    'viewport': {'width': 1920, 'height': 1080},
+    'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+}
+
+# Any of these is the payments page's Export button
+EXPORT_BUTTON = ', '.join([
+    'button:has-text("Export")',
+    'button[aria-label*="Export"]',
+    'button:text-is("Export")',
+    '[data-testid*="export"]',
+])
+
+EXPORT_DIALOG = 'div[role="dialog"]'
+
+# The export modal's date range control, its options and the custom range start date
+DATE_RANGE_SELECTORS = [
+    'button:has-text("All time")',
+    'select[name*="date"]',
+    '[data-testid*="date-range"]',
+]
+ALL_TIME_OPTION = 'button:has-text("All time"), li:has-text("All time")'
+CUSTOM_RANGE_OPTION = 'button:has-text("Custom"), li:has-text("Custom")'
+START_DATE_INPUT = 'input[name*="start"], input[placeholder*="Start"], input[type="date"]'
+
+# Incremental exports: re-export this many days before the newest payment we have
+# (recurring status changes land on earlier payments), and do a full export this often
+INCREMENTAL_EXPORTS = os.getenv('ZEFFY_INCREMENTAL', '1') != '0'
+OVERLAP_DAYS = int(os.getenv('ZEFFY_OVERLAP_DAYS', 35))
+FULL_EXPORT_DAYS = float(os.getenv('ZEFFY_FULL_EXPORT_DAYS', 7))
+EXPORT_STATE_NAME = 'zeffy_export_state.json'
+
+# Infinite scroll is done once the page stops growing for this long
+SCROLL_SETTLE_MS = int(os.getenv('ZEFFY_SCROLL_SETTLE_MS', 2000))
+
+# Save before/after screenshots of the export modal (for fixing selectors)
+DEBUG_SCREENSHOTS = os.getenv('ZEFFY_DEBUG_SCREENSHOTS', '0') == '1'
+
+# A resident browser context is replaced after this long even if it still looks healthy
+CONTEXT_MAX_AGE_HOURS = float(os.getenv('ZEFFY_CONTEXT_MAX_AGE_HOURS', 12))
+
+def load_storage_state(cookie_file=COOKIE_FILE):
+    """Load saved cookies as a Playwright storage state, or None if there aren't any"""
+    cookie_path = Path(cookie_file)
+    if not cookie_path.exists():
+        print(f"⚠ No saved cookies found. Run save_zeffy_cookies.py first!")
+        return None
+
+    print(f"✓ Loading saved cookies from {cookie_path}")
+    with open(cookie_path, 'r') as f:
+        cookies = json.load(f)
+    return {'cookies': cookies, 'origins': []}
+
+def save_cookies(cookies, cookie_file=COOKIE_FILE):
+    """Write the session's cookies back if Zeffy refreshed them; returns True if saved"""
+    cookie_path = Path(cookie_file)
+    if cookie_path.exists():
+        with open(cookie_path, 'r') as f:
+            if json.load(f) == cookies:
+                return False
+
+    cookie_path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = cookie_path.with_suffix('.tmp')
+    with open(temp_path, 'w') as f:
+        json.dump(cookies, f, indent=2)
+    os.replace(temp_path, cookie_path)
+    print(f"✓ Saved refreshed cookies to {cookie_path}")
+    return True
+
+async def wait_for_payments_page(page):
+    """Wait until the payments table has rendered (its Export button is visible)"""
+    await page.wait_for_selector(EXPORT_BUTTON, state='visible', timeout=60000)
+
+async def load_all_payments(page):
+    """Scroll until infinite scroll stops adding payment rows
+
+    After each scroll we wait for the page to grow rather than sleeping; once
+    it hasn't grown for SCROLL_SETTLE_MS we've reached the end.
+    """
+    last_height = await page.evaluate("document.body.scrollHeight")
+    scroll_attempts = 0
+    max_scrolls = 20  # Prevent infinite loop
+
+    while scroll_attempts < max_scrolls:
+        # Scroll to bottom
+        await page.evaluate("window.scrollTo(0, document.body.scrollHeight)")
+
+        # Wait for new content to load
         try:
-            # If we have cookies, skip login and go straight to payments page
-            if storage_state:
-                print("Using saved session, skipping login...")
-                await page.goto(ZEFFY_PAYMENTS_URL, wait_until='domcontentloaded', timeout=60000)
-                await page.wait_for_timeout(3000)
-
-                # Scroll down multiple times to load ALL payments via infinite scroll/pagination
-                print("Scrolling to load all payment records...")
-                try:
-                    last_height = await page.evaluate("document.body.scrollHeight")
-                    scroll_attempts = 0
-                    max_scrolls = 20  # Prevent infinite loop
-
-                    while scroll_attempts < max_scrolls:
-                        # Scroll to bottom
-                        await page.evaluate("window.scrollTo(0, document.body.scrollHeight)")
-                        await page.wait_for_timeout(1500)  # Wait for new content to load
-
-                        # Check if new content loaded
-                        new_height = await page.evaluate("document.body.scrollHeight")
-                        if new_height == last_height:
-                            print(f"✓ Reached end of payments after {scroll_attempts + 1} scrolls")
-                            break
-
-                        last_height = new_height
-                        scroll_attempts += 1
-                        print(f"  Scrolled {scroll_attempts} times, loading more data...")
-
-                    # Scroll back to top for export button
-                    await page.evaluate("window.scrollTo(0, 0)")
-                    await page.wait_for_timeout(1000)
-
-                except Exception as e:
-                    print(f"⚠ Scroll failed: {e}")
-            else:
-                # Step 1: Navigate to login page
-                print("Navigating to login page...")
-                await page.goto(ZEFFY_LOGIN_URL, wait_until='networkidle')
-                await page.wait_for_timeout(2000)  # Wait for page to settle
-
-                # Dismiss cookie consent popup if it appears
-                print("Checking for cookie popup...")
-                try:
-                    cookie_accept_selectors = [
-                        'button:has-text("Accept all cookies")',
-                        'button:has-text("Accept")',
-                        'button[id*="cookie"]',
-                    ]
-                    for selector in cookie_accept_selectors:
-                        try:
-                            await page.click(selector, timeout=2000)
-                            print("✓ Dismissed cookie popup")
-                            await page.wait_for_timeout(1000)
-                            break
-                        except:
-                            continue
-                except:
-                    print("No cookie popup found, continuing...")
-
-                # Step 2: Enter credentials and login
-                print("Logging in...")
-
-                # Find and fill email field (adjust selector if needed)
-                email_selector = 'input[type="email"], input[name="email"], input[id*="email"]'
-                await page.wait_for_selector(email_selector, timeout=10000)
-                await page.fill(email_selector, ZEFFY_EMAIL)
-
-                # Click Next button after email (not the Google login button)
-                print("Clicking Next button...")
-                next_button = 'button:has-text("Next")'
-                await page.click(next_button)
-                await page.wait_for_timeout(3000)
-
-                # Debug screenshot after clicking Next
-                await page.screenshot(path='/var/www/cfl-member-dashboard/exports/after_next.png')
-
-                # Find and fill password field on next screen
-                print("Entering password...")
-                password_selector = 'input[type="password"], input[name="password"], input[id*="password"]'
-
-                # Try to wait for password field with better error handling
-                try:
-                    await page.wait_for_selector(password_selector, timeout=10000)
-                    await page.fill(password_selector, ZEFFY_PASSWORD)
-                except:
-                    # Take screenshot if password field not found
-                    await page.screenshot(path='/var/www/cfl-member-dashboard/exports/password_not_found.png')
-                    raise Exception("Password field not found. Check after_next.png and password_not_found.png")
-
-                # Click Confirm button to login
-                print("Clicking Confirm button...")
-                confirm_button = 'button:has-text("Confirm")'
-                await page.click(confirm_button)
-
-                # Wait for navigation after login
-                print("Waiting for login to complete...")
-                await page.wait_for_load_state('domcontentloaded', timeout=30000)
-                await page.wait_for_timeout(5000)  # Additional wait for dashboard to load
-
-                # Step 3: Navigate to payments page
-                print(f"Navigating to payments page...")
-                await page.goto(ZEFFY_PAYMENTS_URL, wait_until='domcontentloaded', timeout=60000)
-                await page.wait_for_timeout(5000)  # Wait for page to fully render
-
-            # Step 4: Click Export button - try multiple selectors
-            print("Clicking Export button...")
-            export_button_selectors = [
-                'button:has-text("Export")',
-                'button[aria-label*="Export"]',
-                'button:text-is("Export")',
-                '[data-testid*="export"]',
-                'button:text("Export")',
-            ]
-
-            export_clicked = False
-            for selector in export_button_selectors:
-                try:
-                    await page.wait_for_selector(selector, timeout=3000)
-                    await page.click(selector)
-                    export_clicked = True
-                    print(f"✓ Clicked export button using selector: {selector}")
-                    break
-                except:
-                    continue
-
-            if not export_clicked:
-                # Take screenshot for debugging
-                await page.screenshot(path='/var/www/cfl-member-dashboard/exports/debug_screenshot.png')
-                raise Exception("Could not find Export button. Screenshot saved to exports/debug_screenshot.png")
-
-            # Wait for export modal to appear
-            await page.wait_for_timeout(1000)
-
-            # Step 5: Ensure "Payments" tab is selected (it should be by default)
-            print("Selecting export options...")
-            payments_tab_selector = 'button:has-text("Payments")'
+            await page.wait_for_function("height => document.body.scrollHeight > height",
+                                         arg=last_height, timeout=SCROLL_SETTLE_MS)
+        except PlaywrightTimeout:
+            print(f"✓ Reached end of payments after {scroll_attempts + 1} scrolls")
+            break
+
+        last_height = await page.evaluate("document.body.scrollHeight")
+        scroll_attempts += 1
+        print(f"  Scrolled {scroll_attempts} times, loading more data...")
+
+    # Scroll back to top for export button
+    await page.evaluate("window.scrollTo(0, 0)")
+
+def load_export_state():
+    """When the last full export ran, etc. (kept in the download folder)"""
+    state_path = Path(DOWNLOAD_FOLDER) / EXPORT_STATE_NAME
+    if not state_path.exists():
+        return {}
+    with open(state_path, 'r') as f:
+        return json.load(f)
+
+def record_full_export(when=None):
+    """Note that a full export just succeeded"""
+    state = load_export_state()
+    state['last_full_export'] = (when or datetime.now()).isoformat(timespec='seconds')
+    atomic_write(Path(DOWNLOAD_FOLDER) / EXPORT_STATE_NAME, json.dumps(state, indent=2))
+
+def incremental_start(now=None):
+    """Start date for an incremental export, or None when a full export is due"""
+    if not INCREMENTAL_EXPORTS:
+        return None
+
+    now = now or datetime.now()
+    last_full = load_export_state().get('last_full_export')
+    if not last_full or now - datetime.fromisoformat(last_full) >= timedelta(days=FULL_EXPORT_DAYS):
+        return None
+
+    latest = latest_payment_date(MASTER_STORE)
+    if latest is None:
+        return None
+    return (latest - timedelta(days=OVERLAP_DAYS)).date()
+
+async def open_payments_page(page, saved_session, metrics):
+    """Get to the payments page, logging in first if there's no saved session"""
+    # If we have cookies, skip login and go straight to payments page
+    if saved_session:
+        print("Using saved session, skipping login...")
+        with step(metrics, 'goto_payments'):
+            await page.goto(ZEFFY_PAYMENTS_URL, wait_until='domcontentloaded', timeout=60000)
+            await wait_for_payments_page(page)
+
+        # Scroll down multiple times to load ALL payments via infinite scroll/pagination
+        print("Scrolling to load all payment records...")
+        try:
+            with step(metrics, 'scroll'):
+                await load_all_payments(page)
+        except Exception as e:
+            print(f"⚠ Scroll failed: {e}")
+    else:
+        # Step 1: Navigate to login page
+        print("Navigating to login page...")
+        with step(metrics, 'goto_login'):
+            await page.goto(ZEFFY_LOGIN_URL, wait_until='networkidle')
+
+        # Dismiss cookie consent popup if it appears
+        print("Checking for cookie popup...")
+        with step(metrics, 'cookie_popup'):
+            cookie_accept = page.locator(', '.join([
+                'button:has-text("Accept all cookies")',
+                'button:has-text("Accept")',
+                'button[id*="cookie"]',
+            ])).first
+            try:
+                await cookie_accept.click(timeout=2000)
+                await cookie_accept.wait_for(state='hidden', timeout=5000)
+                print("✓ Dismissed cookie popup")
+            except PlaywrightTimeout:
+                print("No cookie popup found, continuing...")
+
+        # Step 2: Enter credentials and login
+        print("Logging in...")
+
+        with step(metrics, 'login'):
+            # Find and fill email field (adjust selector if needed)
+            email_selector = 'input[type="email"], input[name="email"], input[id*="email"]'
+            await page.wait_for_selector(email_selector, timeout=10000)
+            await page.fill(email_selector, ZEFFY_EMAIL)
+
+            # Click Next button after email (not the Google login button)
+            print("Clicking Next button...")
+            next_button = 'button:has-text("Next")'
+            await page.click(next_button)
+
+            # Find and fill password field on next screen
+            print("Entering password...")
+            password_selector = 'input[type="password"], input[name="password"], input[id*="password"]'
+
+            # Try to wait for password field with better error handling
             try:
-                await page.click(payments_tab_selector, timeout=5000)
+                await page.wait_for_selector(password_selector, timeout=10000)
+                await page.fill(password_selector, ZEFFY_PASSWORD)
             except:
-                print("Payments tab already selected or not found, continuing...")
-
-            await page.wait_for_timeout(500)
+                # Take screenshot if password field not found
+                await page.screenshot(path='/var/www/cfl-member-dashboard/exports/password_not_found.png')
+                raise Exception("Password field not found. Check password_not_found.png")
+
+            # Click Confirm button to login
+            print("Clicking Confirm button...")
+            confirm_button = 'button:has-text("Confirm")'
+            login_url = page.url
+            await page.click(confirm_button)
+
+            # Wait for navigation after login (we leave the login page)
+            print("Waiting for login to complete...")
+            await page.wait_for_url(lambda url: url != login_url, wait_until='domcontentloaded', timeout=30000)
+
+        # Step 3: Navigate to payments page
+        print(f"Navigating to payments page...")
+        with step(metrics, 'goto_payments'):
+            await page.goto(ZEFFY_PAYMENTS_URL, wait_until='domcontentloaded', timeout=60000)
+            await wait_for_payments_page(page)
+
+async def click_if_present(page, selector):
+    """Click an element if the (already open) modal has it; returns True if clicked"""
+    element = page.locator(selector).first
+    if await element.count() == 0:
+        return False
+    await element.click()
+    return True
+
+async def debug_screenshot(page, name):
+    """Save a step screenshot when ZEFFY_DEBUG_SCREENSHOTS=1"""
+    if DEBUG_SCREENSHOTS:
+        await page.screenshot(path=str(Path(DOWNLOAD_FOLDER) / name))
+        print(f"📸 Screenshot saved: {name}")
+
+async def set_custom_range(page, since):
+    """Set the export modal's date range to start at `since`; returns False if it can't"""
+    for selector in DATE_RANGE_SELECTORS:
+        if await click_if_present(page, f'{EXPORT_DIALOG} {selector}'):
+            break
+    else:
+        return False
+
+    try:
+        await page.click(CUSTOM_RANGE_OPTION, timeout=2000)
+        await page.locator(START_DATE_INPUT).first.fill(since.isoformat(), timeout=2000)
+    except PlaywrightTimeout:
+        return False
+    return True
+
+async def download_export(page, download_path, metrics, since=None):
+    """Export payments (all, or since a date) from the payments page and save the file
+
+    Returns (file, since) where since is None if the export ended up "All time".
+    """
+    # Step 4: Click Export button - any of the known selectors
+    print("Clicking Export button...")
+    with step(metrics, 'open_export_modal'):
+        try:
+            await page.locator(EXPORT_BUTTON).first.click(timeout=15000)
+        except PlaywrightTimeout:
+            # Take screenshot for debugging
+            await page.screenshot(path='/var/www/cfl-member-dashboard/exports/debug_screenshot.png')
+            raise Exception("Could not find Export button. Screenshot saved to exports/debug_screenshot.png")
+        print("✓ Clicked export button")
+
+        # Wait for export modal to appear
+        await page.wait_for_selector(EXPORT_DIALOG, state='visible', timeout=10000)
+
+    with step(metrics, 'export_options'):
+        # Step 5: Ensure "Payments" tab is selected (it should be by default)
+        print("Selecting export options...")
+        if not await click_if_present(page, f'{EXPORT_DIALOG} button:has-text("Payments")'):
+            print("Payments tab already selected or not found, continuing...")
+
+        # Step 6: Select date range - payments since `since`, or "All time"
+        if since is not None:
+            print(f"Setting date range to payments since {since}...")
+            if await set_custom_range(page, since):
+                print("✓ Set date range")
+            else:
+                print("⚠ Couldn't set a custom date range, exporting All time instead")
+                since = None
 
-            # Step 6: Select date range - try to select "All time" or maximum range
+        if since is None:
             print("Setting date range to All time...")
-            date_range_selectors = [
-                'button:has-text("All time")',
-                'select[name*="date"]',
-                '[data-testid*="date-range"]',
-            ]
-
-            for selector in date_range_selectors:
-                try:
-                    await page.click(selector, timeout=2000)
-                    await page.wait_for_timeout(500)
-                    # Try to click "All time" option if dropdown appeared
+            for selector in DATE_RANGE_SELECTORS:
+                if await click_if_present(page, f'{EXPORT_DIALOG} {selector}'):
+                    # Pick "All time" if that opened a dropdown
                     try:
-                        await page.click('button:has-text("All time"), li:has-text("All time")', timeout=2000)
-                    except:
+                        await page.click(ALL_TIME_OPTION, timeout=2000)
+                    except PlaywrightTimeout:
                         pass
                     print("✓ Set date range")
                     break
-                except:
-                    continue
+        metrics['since'] = str(since) if since else 'all'
 
-            # Step 7: Click "Select all" checkbox
-            print("Clicking Select all...")
-            select_all_selector = 'label:has-text("Select all")'
-            await page.wait_for_selector(select_all_selector, timeout=5000)
+        # Step 7: Click "Select all" checkbox
+        print("Clicking Select all...")
+        select_all_selector = 'label:has-text("Select all")'
+        await page.wait_for_selector(select_all_selector, timeout=5000)
+        await debug_screenshot(page, 'before_select_all.png')
 
-            # Take screenshot before clicking Select all
-            await page.screenshot(path='/var/www/cfl-member-dashboard/exports/before_select_all.png')
-            print("📸 Screenshot saved: before_select_all.png")
+        await page.click(select_all_selector)
+        await debug_screenshot(page, 'after_select_all.png')
 
-            await page.click(select_all_selector)
-            await page.wait_for_timeout(1000)
+    # Step 7: Click the Export button in the modal (inside the dialog)
+    print("Starting export...")
+    # Use a more specific selector for the Export button within the modal dialog
+    modal_export_button = f'{EXPORT_DIALOG} button:has-text("Export")'
 
-            # Take screenshot after clicking Select all
-            await page.screenshot(path='/var/www/cfl-member-dashboard/exports/after_select_all.png')
-            print("📸 Screenshot saved: after_select_all.png")
-
-            # Step 7: Click the Export button in the modal (inside the dialog)
-            print("Starting export...")
-            # Use a more specific selector for the Export button within the modal dialog
-            modal_export_button = 'div[role="dialog"] button:has-text("Export")'
+    with step(metrics, 'download'):
+        # The button stays disabled until the column selection registers
+        try:
+            await page.wait_for_selector(f'{modal_export_button}:not([disabled])', timeout=5000)
+        except PlaywrightTimeout:
+            pass
 
+        # Note the requests the Export button makes, so the next export can replay them
+        export_requests = []
+        page.on('request', export_requests.append)
+        try:
             # Set up download promise before clicking
             async with page.expect_download(timeout=60000) as download_info:
                 await page.click(modal_export_button, force=True)
 
             download = await download_info.value
+        finally:
+            page.remove_listener('request', export_requests.append)
+
+        # Step 8: Save the downloaded file with timestamp
+        timestamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+        filename = f'zeffy-payments-{timestamp}.csv'
+        save_path = download_path / filename
+
+        await download.save_as(save_path)
+    print(f"✓ Export successful!")
+    print(f"✓ File saved: {save_path}")
+
+    # Optional: Print file size
+    file_size = save_path.stat().st_size
+    metrics['bytes'] = file_size
+    print(f"✓ File size: {file_size:,} bytes")
+
+    await record_export_request(export_requests, download.url, since)
+    return save_path, since
+
+async def record_export_request(requests, download_url, since=None):
+    """Save the request behind this export so the next one can skip the browser"""
+    # The Export button's API call is the last non-GET fetch before the download
+    api_calls = [request for request in requests
+                 if request.resource_type in ('fetch', 'xhr') and request.method != 'GET']
+    create_request = create_response = None
+    if api_calls:
+        request = api_calls[-1]
+        create_request = {'method': request.method, 'url': request.url,
+                          'headers': request.headers, 'post_data': request.post_data}
+        try:
+            create_response = await (await request.response()).json()
+        except Exception:
+            pass
+
+    try:
+        save_recipe(build_recipe(download_url, create_request, create_response, since), RECIPE_FILE)
+        print("✓ Recorded export request for direct downloads")
+    except Exception as e:
+        print(f"⚠ Could not record export request: {e}")
+
+async def run_export(page, download_path, saved_session, since=None):
+    """Run the export in an open page
+
+    Returns (file, since) as download_export() does; file is None on failure.
+    """
+    try:
+        with stage('export.open_payments_page', saved_session=saved_session) as metrics:
+            await open_payments_page(page, saved_session, metrics)
+
+        with stage('export.download') as metrics:
+            return await download_export(page, download_path, metrics, since)
+
+    except PlaywrightTimeout as e:
+        print(f"✗ Timeout error: {e}")
+        print("Tip: Run 'playwright codegen https://www.zeffy.com/login' to update selectors")
+
+    except Exception as e:
+        print(f"✗ Error occurred: {e}")
+        # Take screenshot for debugging
+        screenshot_path = download_path / f'error-screenshot-{datetime.now().strftime("%Y%m%d-%H%M%S")}.png'
+        try:
+            await page.screenshot(path=str(screenshot_path))
+            print(f"Screenshot saved to: {screenshot_path}")
+        except Exception:
+            print("Could not take an error screenshot")
+
+    return None, since
+
+class BrowserPool:
+    """Keeps Chromium and a logged-in Zeffy context open between exports
+
+    Used by the refresh daemon so an export doesn't pay for a cold browser
+    start and a fresh login every time. Refreshes run one at a time, so one
+    context is enough. The context is health-checked before each export and
+    replaced if the browser died, an export failed, or it is older than
+    CONTEXT_MAX_AGE_HOURS. Must be used from a single event loop.
+    """
+
+    def __init__(self, download_folder=DOWNLOAD_FOLDER, cookie_file=COOKIE_FILE):
+        self.download_path = Path(download_folder)
+        self.cookie_file = cookie_file
+        self.playwright = None
+        self.browser = None
+        self.context = None
+        self.saved_session = False
+        self.created = None
+
+    async def start(self):
+        """Launch the browser and create a context from the saved cookies"""
+        with stage('export.launch_browser', pooled=True):
+            if self.playwright is None:
+                self.playwright = await async_playwright().start()
+            self.browser = await self.playwright.chromium.launch(
+                headless=True,
+                downloads_path=str(self.download_path)
+            )
+            storage_state = load_storage_state(self.cookie_file)
+            self.context = await self.browser.new_context(storage_state=storage_state, **CONTEXT_OPTIONS)
+            self.saved_session = storage_state is not None
+            self.created = time.monotonic()
+
+    async def healthy(self):
+        """Check the resident browser still responds and isn't due for replacement"""
+        if self.context is None or not self.browser.is_connected():
+            return False
+        if time.monotonic() - self.created > CONTEXT_MAX_AGE_HOURS * 3600:
+            print("Resident browser context is due for replacement")
+            return False
+        try:
+            await asyncio.wait_for(self.context.cookies(), timeout=10)
+            return True
+        except Exception as e:
+            print(f"⚠ Resident browser not responding ({type(e).__name__})")
+            return False
+
+    async def acquire(self):
+        """Return a healthy context, replacing the browser if needed"""
+        if not await self.healthy():
+            await self.recycle()
+            await self.start()
+        else:
+            print("✓ Reusing resident browser session")
+        return self.context
+
+    async def save_cookies(self):
+        """Write the context's cookies back to the cookie file if they changed"""
+        save_cookies(await self.context.cookies(), self.cookie_file)
 
-            # Step 8: Save the downloaded file with timestamp
-            timestamp = datetime.now().strftime('%Y%m%d-%H%M%S')
-            filename = f'zeffy-payments-{timestamp}.csv'
-            save_path = download_path / filename
+    async def recycle(self):
+        """Close the browser so the next export starts a fresh one"""
+        if self.browser is not None:
+            try:
+                await self.browser.close()
+            except Exception:
+                pass
+            print("Browser closed.")
+        self.browser = None
+        self.context = None
+
+    async def close(self):
+        """Close the browser and stop Playwright"""
+        await self.recycle()
+        if self.playwright is not None:
+            await self.playwright.stop()
+            self.playwright = None
+
+async def download_zeffy_payments(pool=None, full=False):
+    """Main function to automate Zeffy payment export
+
+    Exports payments since the master database's high-water mark, or "All
+    time" when `full` is set or a full export is due. Tries a direct download
+    first. Otherwise launches and closes its own browser, or reuses the
+    resident browser in `pool` (a BrowserPool). Returns the path of the
+    downloaded file, or None if the export failed.
+    """
 
-            await download.save_as(save_path)
-            print(f"✓ Export successful!")
-            print(f"✓ File saved: {save_path}")
+    # Ensure download folder exists
+    download_path = Path(DOWNLOAD_FOLDER)
+    download_path.mkdir(parents=True, exist_ok=True)
 
-            # Optional: Print file size
-            file_size = save_path.stat().st_size
-            print(f"✓ File size: {file_size:,} bytes")
+    print(f"Starting Zeffy export automation...")
+    print(f"Download folder: {download_path}")
 
-        except PlaywrightTimeout as e:
-            print(f"✗ Timeout error: {e}")
-            print("Tip: Run 'playwright codegen https://www.zeffy.com/login' to update selectors")
+    since = None if full else incremental_start()
+    print(f"Exporting payments since {since}" if since else "Exporting all payments (full export)")
 
+    save_path = None
+    if DIRECT_DOWNLOAD:
+        try:
+            with stage('export.direct_download', since=str(since) if since else 'all') as metrics:
+                save_path = await asyncio.to_thread(direct_download, download_path, metrics,
+                                                    recipe_file=RECIPE_FILE, cookie_file=COOKIE_FILE, since=since,
+                                                    not_before=latest_payment_date(MASTER_STORE))
         except Exception as e:
-            print(f"✗ Error occurred: {e}")
-            # Take screenshot for debugging
-            screenshot_path = download_path / f'error-screenshot-{datetime.now().strftime("%Y%m%d-%H%M%S")}.png'
-            await page.screenshot(path=str(screenshot_path))
-            print(f"Screenshot saved to: {screenshot_path}")
+            print(f"⚠ Direct download not possible ({e}), using the browser")
 
+    if save_path is None and pool is not None:
+        context = await pool.acquire()
+        page = await context.new_page()
+        try:
+            save_path, since = await run_export(page, download_path, pool.saved_session, since)
         finally:
-            # Close browser
-            await browser.close()
-            print("Browser closed.")
+            await page.close()
+
+        if save_path:
+            # The context is logged in now, even if it started without cookies
+            pool.saved_session = True
+            await pool.save_cookies()
+        else:
+            # Don't reuse a context that just failed
+            await pool.recycle()
+
+    elif save_path is None:
+        async with async_playwright() as p:
+            with stage('export.launch_browser'):
+                # Launch browser in headless mode (invisible)
+                browser = await p.chromium.launch(
+                    headless=True,  # Set to False for debugging
+                    downloads_path=str(download_path)
+                )
+
+                # Load saved cookies if they exist
+                storage_state = load_storage_state()
+
+                # Create browser context with download path and realistic user agent
+                context = await browser.new_context(storage_state=storage_state, **CONTEXT_OPTIONS)
+
+                page = await context.new_page()
+
+            try:
+                save_path, since = await run_export(page, download_path, storage_state is not None, since)
+                if save_path:
+                    save_cookies(await context.cookies())
+
+            finally:
+                # Close browser
+                await browser.close()
+                print("Browser closed.")
+
+    if save_path and since is None:
+        record_full_export()
+    return save_path
 
 if __name__ == "__main__":
-    asyncio.run(download_zeffy_payments())
+    if not asyncio.run(download_zeffy_payments(full='--full' in sys.argv)):
+        sys.exit(1)
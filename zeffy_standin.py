@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+"""
+Zeffy Stand-in Site
+===================
+A local imitation of the Zeffy pages zeffy_export.py drives, for trying the
+export automation without a Zeffy account or network access
+
+It serves a login page (email → Next → password → Confirm, plus a cookie
+popup), a payments page whose table loads more rows as you scroll, and the
+Export modal (Payments tab, a date range menu with "All time" and "Custom",
+"Select all", Export). Exporting
+downloads a synthetic payments file from synthetic_zeffy.py: the modal POSTs
+to /api/exports, which builds the file for the chosen date range and
+answers with a link to it, like Zeffy's
+server-side export (and what zeffy_direct.py replays). Every request
+to the stand-in's API waits --latency ms, so you can see the automation only
+waits as long as the page actually needs.
+
+Usage:
+    python zeffy_standin.py                    # Serve on http://127.0.0.1:8780 (open /login in a browser)
+    python zeffy_standin.py --run              # Serve, then run zeffy_export against it: fresh login,
+                                               # saved session, a direct (browserless) download,
+                                               # then incremental exports through the browser and directly
+    python zeffy_standin.py --run --latency 50 --pages 8
+"""
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import threading
+from datetime import datetime
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest.mock import patch
+from urllib.parse import urlparse, parse_qs
+
+from master_store import read_payments, save_master
+from synthetic_zeffy import generate_payments, write_export
+
+HOST = '127.0.0.1'
+PORT = 8780
+
+SESSION_COOKIE = 'standin_session'
+ROWS_PER_PAGE = 50
+
+LOGIN_PAGE = """<!DOCTYPE html>
+<html><head><title>Zeffy stand-in - Log in</title></head>
+<body>
+  <div id="cookie-banner">We use cookies. <button id="cookie-accept">Accept all cookies</button></div>
+  <h1>Log in</h1>
+  <div id="email-step">
+    <input type="email" name="email" placeholder="Email">
+    <button onclick="nextStep()">Next</button>
+    <button>Continue with Google</button>
+  </div>
+  <div id="password-step" style="display: none;"></div>
+  <script>
+    document.getElementById('cookie-accept').onclick = () => document.getElementById('cookie-banner').remove();
+
+    async function nextStep() {
+      await fetch('/api/login/check', {method: 'POST'});
+      document.getElementById('email-step').style.display = 'none';
+      const step = document.getElementById('password-step');
+      step.innerHTML = '<input type="password" name="password" placeholder="Password">' +
+                       '<button onclick="confirmLogin()">Confirm</button>';
+      step.style.display = '';
+    }
+
+    async function confirmLogin() {
+      await fetch('/api/login', {method: 'POST'});
+      location.href = '/o/dashboard';
+    }
+  </script>
+</body></html>
+"""
+
+DASHBOARD_PAGE = """<!DOCTYPE html>
+<html><head><title>Zeffy stand-in - Dashboard</title></head>
+<body><h1>Dashboard</h1><a href="/o/fundraising/payments">Payments</a></body></html>
+"""
+
+PAYMENTS_PAGE = """<!DOCTYPE html>
+<html><head><title>Zeffy stand-in - Payments</title>
+<style>
+  td { height: 40px; }
+  div[role="dialog"] { position: fixed; top: 20%; left: 30%; background: #fff; border: 1px solid #333; padding: 20px; }
+</style></head>
+<body>
+  <h1>Payments</h1>
+  <nav><button>Payments</button></nav>
+  <div id="toolbar"></div>
+  <table><tbody id="rows"></tbody></table>
+  <div id="modal-root"></div>
+  <script>
+    let nextPage = 0, loading = false, done = false;
+
+    async function loadPage() {
+      if (loading || done) return;
+      loading = true;
+      const response = await fetch('/api/payments?page=' + nextPage);
+      const data = await response.json();
+      const rows = document.getElementById('rows');
+      data.rows.forEach(row => {
+        const tr = document.createElement('tr');
+        tr.innerHTML = `<td>${row.date}</td><td>${row.name}</td><td>${row.amount}</td>`;
+        rows.appendChild(tr);
+      });
+      done = !data.more;
+      nextPage += 1;
+      loading = false;
+    }
+
+    window.addEventListener('scroll', () => {
+      if (window.innerHeight + window.scrollY >= document.body.scrollHeight - 200) loadPage();
+    });
+
+    function openExportModal() {
+      document.getElementById('modal-root').innerHTML = `
+        <div role="dialog">
+          <h2>Export</h2>
+          <button>Payments</button><button>Donors</button>
+          <div id="date-range">
+            <button onclick="document.getElementById('range-menu').style.display = ''">All time</button>
+            <ul id="range-menu" style="display: none;">
+              <li onclick="setRange('all_time')">All time</li>
+              <li onclick="setRange('custom')">Custom</li>
+            </ul>
+            <span id="custom-range"></span>
+          </div>
+          <label><input type="checkbox" id="select-all" onchange="toggleAll(this.checked)"> Select all</label>
+          <button id="modal-export" disabled onclick="startExport()">Export</button>
+        </div>`;
+    }
+
+    let range = 'all_time';
+    function setRange(value) {
+      range = value;
+      document.getElementById('range-menu').style.display = 'none';
+      document.getElementById('custom-range').innerHTML =
+        value === 'custom' ? '<input type="date" name="start_date" placeholder="Start date">' : '';
+    }
+
+    function toggleAll(checked) {
+      // The real modal enables Export a moment after the columns are selected
+      setTimeout(() => { document.getElementById('modal-export').disabled = !checked; }, 100);
+    }
+
+    async function startExport() {
+      const response = await fetch('/api/exports', {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify(range === 'custom'
+          ? {type: 'payments', range: 'custom', start: document.querySelector('input[name="start_date"]').value, columns: 'all'}
+          : {type: 'payments', range: 'all_time', columns: 'all'})
+      });
+      const data = await response.json();
+      location.href = data.url;
+    }
+
+    // The table (and the Export button) render after the first page of data arrives
+    loadPage().then(() => {
+      document.getElementById('toolbar').innerHTML = '<button onclick="openExportModal()">Export</button>';
+    });
+  </script>
+</body></html>
+"""
+
+class StandinHandler(BaseHTTPRequestHandler):
+    """Serves the stand-in pages; configured through class attributes"""
+
+    payments = None
+    work_dir = None
+    latency = 0.2
+    pages = 5
+
+    def logged_in(self):
+        cookie = SimpleCookie(self.headers.get('Cookie', ''))
+        return SESSION_COOKIE in cookie
+
+    def send_body(self, body, content_type, status=200, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, data, status=200, headers=None):
+        self.send_body(json.dumps(data).encode('utf-8'), 'application/json', status, headers)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+
+        if url.path == '/login':
+            self.send_body(LOGIN_PAGE.encode('utf-8'), 'text/html')
+        elif not self.logged_in():
+            # Like Zeffy, pages need a session
+            self.send_body(b'', 'text/html', status=302, headers={'Location': '/login'})
+        elif url.path == '/o/dashboard':
+            self.send_body(DASHBOARD_PAGE.encode('utf-8'), 'text/html')
+        elif url.path == '/o/fundraising/payments':
+            self.send_body(PAYMENTS_PAGE.encode('utf-8'), 'text/html')
+        elif url.path == '/api/payments':
+            time.sleep(self.latency)
+            page = int(parse_qs(url.query).get('page', ['0'])[0])
+            rows = [{'date': f'2025-01-{(page % 28) + 1:02d}', 'name': f'Member {page * ROWS_PER_PAGE + i}', 'amount': '$35.00'}
+                    for i in range(ROWS_PER_PAGE)]
+            self.send_json({'rows': rows, 'more': page + 1 < self.pages})
+        elif url.path.startswith('/api/exports/'):
+            time.sleep(self.latency)
+            export_path = Path(self.work_dir) / Path(url.path).name
+            if not export_path.exists():
+                self.send_body(b'Not found', 'text/plain', status=404)
+                return
+            body = export_path.read_bytes()
+            self.send_body(body, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', headers={
+                'Content-Disposition': f'attachment; filename="payments-{datetime.now():%Y%m%d}.xlsx"'
+            })
+        else:
+            self.send_body(b'Not found', 'text/plain', status=404)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        time.sleep(self.latency)
+
+        if url.path == '/api/login/check':
+            self.send_json({'ok': True})
+        elif url.path == '/api/login':
+            self.send_json({'ok': True}, headers={'Set-Cookie': f'{SESSION_COOKIE}=standin; Path=/; HttpOnly'})
+        elif not self.logged_in():
+            self.send_json({'error': 'Not logged in'}, status=401)
+        elif url.path == '/api/exports':
+            # Zeffy builds the export server-side and hands back a download link
+            options = json.loads(body or b'{}')
+            df = self.payments
+            if options.get('range') == 'custom':
+                df = df[df['Payment Date (UTC)'] >= datetime.fromisoformat(options['start'])]
+            name = f'{datetime.now():%Y%m%d%H%M%S%f}.xlsx'
+            write_export(df, Path(self.work_dir) / name)
+            self.send_json({'url': f'/api/exports/{name}'})
+        else:
+            self.send_body(b'Not found', 'text/plain', status=404)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_standin(work_dir, host=HOST, port=PORT, latency_ms=200, pages=5, members=200):
+    """Start the stand-in site in a background thread; returns the server"""
+    StandinHandler.payments = generate_payments(members=members)
+    StandinHandler.work_dir = str(work_dir)
+    StandinHandler.latency = latency_ms / 1000
+    StandinHandler.pages = pages
+
+    server = ThreadingHTTPServer((host, port), StandinHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def run_exports(base_url, work_dir):
+    """Run zeffy_export against the stand-in: full exports, then incremental ones
+
+    zeffy_export's settings and the metrics files point at work_dir only
+    while this runs.
+    """
+    import zeffy_export
+    import pipeline_metrics
+
+    work_dir = Path(work_dir)
+    master_store = str(work_dir / 'payment_history_master.parquet')
+    metrics_file = work_dir / 'pipeline_metrics.jsonl'
+    settings = patch.multiple(
+        zeffy_export,
+        ZEFFY_LOGIN_URL=f'{base_url}/login',
+        ZEFFY_PAYMENTS_URL=f'{base_url}/o/fundraising/payments',
+        ZEFFY_EMAIL='standin@example.org',
+        ZEFFY_PASSWORD='standin',
+        DOWNLOAD_FOLDER=str(work_dir / 'downloads'),
+        COOKIE_FILE=str(work_dir / 'cookies.json'),
+        RECIPE_FILE=str(work_dir / 'export_request.json'),
+        MASTER_STORE=master_store,
+        DIRECT_DOWNLOAD=zeffy_export.DIRECT_DOWNLOAD,
+    )
+    metrics = patch.multiple(pipeline_metrics, METRICS_FILE=str(metrics_file),
+                             LAST_RUN_FILE=str(work_dir / 'last_run_metrics.json'))
+
+    # The first run has no cookies (login flow) and saves them; the second reuses
+    # them; both record the export request, which the third replays without a browser.
+    # Once a master exists the last two only export the recent payments.
+    runs = [('login', False, True), ('saved session', False, True), ('direct download', True, True),
+            ('incremental', False, False), ('incremental direct download', True, False)]
+    with settings, metrics:
+        for label, direct, full in runs:
+            zeffy_export.DIRECT_DOWNLOAD = direct
+            start = time.perf_counter()
+            save_path = asyncio.run(zeffy_export.download_zeffy_payments(full=full))
+            print(f"\n{'✓' if save_path else '✗'} {label}: {time.perf_counter() - start:.1f}s\n")
+            if not save_path:
+                return False
+
+            if full:
+                # Stand in for merge_payments.py: the export becomes the master
+                save_master(read_payments(save_path), master_store)
+
+    print("Step timings (seconds):")
+    with open(metrics_file, 'r') as f:
+        for line in f:
+            entry = json.loads(line)
+            steps = ', '.join(f'{name} {seconds:.2f}' for name, seconds in entry.get('steps', {}).items())
+            print(f"  {entry['stage']:<30} {entry['seconds']:>6.2f}  {steps}")
+    return True
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Serve a local stand-in for the Zeffy payments pages')
+    parser.add_argument('--port', type=int, default=PORT, help=f'Port to serve on (default {PORT})')
+    parser.add_argument('--latency', type=int, default=200, help='Milliseconds each API call takes (default 200)')
+    parser.add_argument('--pages', type=int, default=5, help='Pages of payments the table loads while scrolling (default 5)')
+    parser.add_argument('--run', action='store_true', help='Run zeffy_export against the stand-in, then exit')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        server = start_standin(work_dir, port=args.port, latency_ms=args.latency, pages=args.pages)
+        base_url = f'http://{HOST}:{args.port}'
+        print(f"✓ Zeffy stand-in running at {base_url}/login")
+
+        try:
+            if args.run:
+                ok = run_exports(base_url, work_dir)
+                raise SystemExit(0 if ok else 1)
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.shutdown()